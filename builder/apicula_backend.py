@@ -0,0 +1,265 @@
+"""
+Open-Source Build Backend
+
+Builds the bitstream with yosys (synth_gowin), nextpnr-himbaechel and
+gowin_pack from Project Apicula instead of gw_sh. Selected with
+board_build.fpga_backend = apicula; it uses the same scanned sources,
+.cst files and top module as the Gowin flow.
+"""
+
+Import("env")
+import os
+import re
+import json
+import time
+import shutil
+import subprocess
+from pathlib import Path
+from fpga_common import TRUE_VALUES
+
+# Executables of the flow, by step
+APICULA_TOOLS = {
+    "yosys": "yosys",
+    "nextpnr": "nextpnr-himbaechel",
+    "gowin_pack": "gowin_pack",
+}
+
+# Dual-purpose pin options and the nextpnr/gowin_pack flag for each
+APICULA_GPIO_FLAGS = {
+    "use_sspi_as_gpio": "sspi_as_gpio",
+    "use_mspi_as_gpio": "mspi_as_gpio",
+    "use_jtag_as_gpio": "jtag_as_gpio",
+    "use_ready_as_gpio": "ready_as_gpio",
+    "use_done_as_gpio": "done_as_gpio",
+}
+
+# Header files are found through include directories, not read on their own
+VERILOG_HEADER_EXTENSIONS = (".vh", ".svh")
+
+# Versions reported by each tool, by (path, mtime_ns)
+TOOL_VERSIONS = {}
+
+def find_apicula_tool(env, name):
+    """Path of a tool, from board_build.fpga_apicula_path first, then PATH."""
+    tool_dir = env.BoardConfig().get("build.fpga_apicula_path", "")
+    if tool_dir:
+        found = shutil.which(name, path=os.path.expanduser(tool_dir))
+        if found:
+            return found
+    return shutil.which(name)
+
+def get_tool_version(step, path):
+    """First line a tool prints for its version flag, remembered per binary.
+
+    gowin_pack has no version flag, so it is identified by its mtime.
+    """
+    try:
+        key = (path, os.stat(path).st_mtime_ns)
+    except OSError:
+        return "unknown"
+    if step == "gowin_pack":
+        return f"{Path(path).name} {key[1]}"
+    if key not in TOOL_VERSIONS:
+        flag = "-V" if step == "yosys" else "--version"
+        try:
+            result = subprocess.run([path, flag], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                    text=True, errors="replace", timeout=30)
+            lines = result.stdout.strip().splitlines()
+            TOOL_VERSIONS[key] = lines[0].strip() if lines else "unknown"
+        except (OSError, subprocess.TimeoutExpired):
+            TOOL_VERSIONS[key] = "unknown"
+    return TOOL_VERSIONS[key]
+
+def find_apicula_toolchain(env):
+    """The yosys/nextpnr/gowin_pack installation, or None if a tool is missing."""
+    tools = {}
+    for step, name in APICULA_TOOLS.items():
+        tools[step] = find_apicula_tool(env, name)
+        if not tools[step]:
+            print(f"Warning: {name} not found (set board_build.fpga_apicula_path or add it to PATH)")
+            return None
+    versions = {step: get_tool_version(step, path) for step, path in tools.items()}
+    return {
+        "tools": tools,
+        "version": versions["yosys"],
+        # Cache keys change whenever any tool of the flow changes
+        "id": json.dumps(versions, sort_keys=True),
+    }
+
+def get_apicula_family(env):
+    """Chip family name used by nextpnr and gowin_pack, e.g. GW2A-18."""
+    board = env.BoardConfig()
+    return board.get("build.fpga_apicula_family", board.get("build.device", ""))
+
+def quote(path):
+    return '"' + Path(path).as_posix() + '"'
+
+def find_vhdl_top_units(vhdl_files):
+    """VHDL entities not instantiated by other VHDL files; each is elaborated for yosys."""
+    texts = {}
+    for path in vhdl_files:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            texts[path] = re.sub(r"--[^\n]*", " ", f.read().lower())
+    tops = []
+    for path, text in texts.items():
+        for entity in re.findall(r"\bentity\s+(\w+)\s+is\b", text):
+            used = any(re.search(r"\b%s\b" % entity, other)
+                       for other_path, other in texts.items() if other_path != path)
+            if not used:
+                tops.append(entity)
+    return tops
+
+def write_yosys_script(sources, top_module, family, script_path, netlist_path):
+    """Write the synthesis script; VHDL is read through the ghdl plugin."""
+    lines = []
+    include_dirs = sorted({str(Path(path).parent) for path in sources['verilog']})
+    for include_dir in include_dirs:
+        lines.append(f"verilog_defaults -add -I{quote(include_dir)}")
+    verilog = [path for path in sources['verilog']
+               if not str(path).lower().endswith(VERILOG_HEADER_EXTENSIONS)]
+    if verilog:
+        lines.append("read_verilog -sv " + " ".join(quote(path) for path in verilog))
+    if sources['vhdl']:
+        files = " ".join(quote(path) for path in sources['vhdl'])
+        for unit in find_vhdl_top_units(sources['vhdl']):
+            lines.append(f"ghdl --std=08 {files} -e {unit}")
+    synth = f"synth_gowin -top {top_module} -json {quote(netlist_path)}"
+    family_match = re.match(r"GW(\d)A", family, re.I)
+    if family_match:
+        synth += f" -family gw{family_match.group(1)}a"
+    lines.append(synth)
+    with open(script_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+def merge_constraints(constraint_files, cst_path):
+    """Concatenate the .cst files into the single file nextpnr reads."""
+    with open(cst_path, "w", encoding="utf-8") as out:
+        for path in constraint_files:
+            if str(path).lower().endswith(".cst"):
+                out.write(f"// {Path(path).name}\n")
+                with open(path, "r", encoding="utf-8", errors="replace") as f:
+                    out.write(f.read().rstrip() + "\n")
+
+def run_apicula_step(env, step, command, impl_dir, timeout):
+    """Run one tool of the flow, logging to impl_dir/<step>.log; returns its exit code."""
+    log_path = Path(impl_dir) / f"{step}.log"
+    print(f"--- [{step}] {Path(command[0]).name} ---")
+    stop_reasons = []
+    with open(log_path, "w", encoding="utf-8") as log:
+        log.write(" ".join(str(part) for part in command) + "\n")
+        log.flush()
+        try:
+            proc = subprocess.Popen([str(part) for part in command], cwd=impl_dir,
+                                    stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT)
+        except OSError as e:
+            print(f"Error: Could not run {command[0]}: {e}")
+            return 1
+
+        def stop(reason):
+            stop_reasons.append(reason)
+            proc.kill()
+
+        with env["FPGA_CANCELLABLE_RUN"](stop):
+            try:
+                returncode = proc.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                stop(f"{step} timed out after {timeout}s")
+                returncode = proc.wait()
+    if stop_reasons:
+        print(stop_reasons[0])
+        return 1
+    if returncode != 0:
+        print(f"Error: {step} failed with exit code {returncode}, see {log_path}")
+        with open(log_path, "r", encoding="utf-8", errors="replace") as f:
+            for line in f.readlines()[-20:]:
+                print(f"  {line.rstrip()}")
+    return returncode
+
+def convert_fs_to_bin(fs_path, bin_path):
+    """Pack the bit rows of a .fs bitstream into the binary form the flash loaders take."""
+    data = bytearray()
+    with open(fs_path, "r", encoding="ascii", errors="replace") as f:
+        for line in f:
+            bits = line.strip()
+            if not bits or bits.startswith("//"):
+                continue
+            bits = bits.ljust((len(bits) + 7) // 8 * 8, "0")
+            data += int(bits, 2).to_bytes(len(bits) // 8, "big")
+    with open(bin_path, "wb") as f:
+        f.write(data)
+
+def build_with_apicula(env, toolchain, sources, options, impl_dir):
+    """Synthesize, place & route and pack the design; returns the bitstream path or None."""
+    board = env.BoardConfig()
+    tools = toolchain["tools"]
+    impl_dir = Path(impl_dir)
+    family = get_apicula_family(env)
+    device = board.get("build.fpga_device_full", board.get("build.device", ""))
+    try:
+        timeout = int(board.get("build.fpga_build_timeout", "600"))
+    except (TypeError, ValueError):
+        timeout = 600
+    gpio_flags = [flag for name, flag in APICULA_GPIO_FLAGS.items()
+                  if options.get(name, "0") in TRUE_VALUES]
+
+    netlist = impl_dir / "synth.json"
+    routed = impl_dir / "pnr.json"
+    cst = impl_dir / "constraints.cst"
+    fs = impl_dir / "project.fs"
+    write_yosys_script(sources, options["top_module"], family, impl_dir / "synth.ys", netlist)
+    merge_constraints(sources['constraints'], cst)
+
+    yosys = [tools["yosys"], "-q", "-s", "synth.ys"]
+    if sources['vhdl']:
+        yosys[1:1] = ["-m", "ghdl"]
+    nextpnr = [tools["nextpnr"], "--json", netlist, "--write", routed, "--device", device,
+               "--vopt", f"family={family}", "--vopt", f"cst={cst}", "--report", "report.json"]
+    for flag in gpio_flags:
+        nextpnr += ["--vopt", flag]
+    gowin_pack = ([tools["gowin_pack"], "-d", family, "-o", fs]
+                  + [f"--{flag}" for flag in gpio_flags])
+    if options.get("bit_compress") in TRUE_VALUES:
+        gowin_pack.append("--compress")
+    gowin_pack.append(routed)
+
+    telemetry = env.get("FPGA_TELEMETRY")
+    print("Starting open-source synthesis and place & route...")
+    for step, command in (("yosys", yosys), ("nextpnr", nextpnr), ("gowin_pack", gowin_pack)):
+        start = time.time()
+        returncode = run_apicula_step(env, step, command, impl_dir, timeout)
+        if telemetry is not None:
+            telemetry.add_phase(f"apicula:{step}", time.time() - start)
+        if returncode != 0:
+            return None
+
+    bitstream = impl_dir / "project.bin"
+    convert_fs_to_bin(fs, bitstream)
+    return bitstream
+
+def describe_apicula_results(impl_dir):
+    """Utilization and timing from the nextpnr report, in the build report's format."""
+    utilization, timing = {}, {"worst_slack": None, "fmax": {}}
+    try:
+        with open(Path(impl_dir) / "report.json", "r", encoding="utf-8") as f:
+            report = json.load(f)
+    except (OSError, ValueError):
+        return {"utilization": utilization, "timing": timing}
+    for name, usage in report.get("utilization", {}).items():
+        utilization[name] = {"used": usage.get("used"), "total": usage.get("available")}
+    slacks = []
+    for clock, fmax in report.get("fmax", {}).items():
+        achieved, constraint = fmax.get("achieved"), fmax.get("constraint")
+        if achieved:
+            timing["fmax"][clock] = round(achieved, 3)
+            if constraint:
+                slacks.append(round(1000.0 / constraint - 1000.0 / achieved, 3))
+    if slacks:
+        timing["worst_slack"] = min(slacks)
+    return {"utilization": utilization, "timing": timing}
+
+# Register the backend with the FPGA builder
+env["FPGA_BACKENDS"]["apicula"] = {
+    "find_toolchain": find_apicula_toolchain,
+    "build": build_with_apicula,
+    "describe": describe_apicula_results,
+}
@@ -0,0 +1,194 @@
+"""
+Flash Image Packaging
+
+Combines MCU firmware and FPGA bitstreams into a single flash image, so a
+dual-target board can be programmed in one connection. The MCU firmware
+environment builds in the background while the gateware builds.
+"""
+
+Import("env")
+import os
+import re
+import sys
+import time
+import atexit
+import subprocess
+from pathlib import Path
+from fpga_common import write_atomic, get_process_group_args, kill_process_tree
+
+# Flash address of the FPGA bitstream in the combined image
+DEFAULT_BITSTREAM_ADDRESS = 0x100000
+
+# Value of erased flash, used to fill gaps between images
+FLASH_FILL_BYTE = b"\xff"
+
+# Firmware builds started by start_firmware_build and not waited for yet,
+# keyed by environment name: (process, log file, log path, start time)
+FIRMWARE_BUILDS = {}
+
+def parse_size(value):
+    """Parse a flash size or address such as 4MB, 512KB, 0x400000 or 4194304."""
+    value = str(value).strip()
+    match = re.match(r"(?i)^(\d+)\s*([KM])B?$", value)
+    if match:
+        return int(match.group(1)) * (1024 if match.group(2).upper() == "K" else 1024 * 1024)
+    return int(value, 0)
+
+def get_flash_size(env):
+    """Flash size in bytes from board_build.fpga_flash_size, or None if not set."""
+    value = env.BoardConfig().get("build.fpga_flash_size", "")
+    return parse_size(value) if value else None
+
+def parse_flash_images(value, env):
+    """Parse "address path" lines into (address, path) pairs."""
+    images = []
+    for line in re.split(r"[\n|]", value):
+        line = line.strip()
+        if not line:
+            continue
+        address, _, path = line.partition(" ")
+        path = env.subst(path.strip())
+        if not os.path.isabs(path):
+            path = os.path.join(env.subst("$PROJECT_DIR"), path)
+        images.append((parse_size(address), path))
+    return images
+
+def get_firmware_images(env):
+    """MCU images to combine with the bitstream, as (address, path) pairs.
+
+    board_build.fpga_firmware lists them explicitly. Otherwise the
+    firmware.bin of board_build.fpga_firmware_env goes at 0x0.
+    """
+    board = env.BoardConfig()
+    images = board.get("build.fpga_firmware", "")
+    if not images:
+        firmware_env = board.get("build.fpga_firmware_env", "")
+        if not firmware_env:
+            return []
+        images = f"0x0 $PROJECT_BUILD_DIR/{firmware_env}/firmware.bin"
+    return parse_flash_images(images, env)
+
+def start_firmware_build(env):
+    """Start building board_build.fpga_firmware_env in the background.
+
+    build_fpga_action calls this when the combined image is a target, so
+    the MCU firmware compiles while the gateware builds. Its output goes
+    to a log next to the bitstream. Returns False if it could not start.
+    """
+    firmware_env = env.BoardConfig().get("build.fpga_firmware_env", "")
+    if not firmware_env or firmware_env in FIRMWARE_BUILDS:
+        return True
+    log_path = Path(env.subst("$BUILD_DIR")) / f"{firmware_env}_build.log"
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    print(f"Building firmware environment '{firmware_env}' in the background (log: {log_path})")
+    log = open(log_path, "w", encoding="utf-8")
+    try:
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "platformio", "run",
+             "-d", env.subst("$PROJECT_DIR"), "-e", firmware_env],
+            stdin=subprocess.DEVNULL,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            **get_process_group_args(),
+        )
+    except OSError as e:
+        log.close()
+        print(f"Error: Could not build firmware environment '{firmware_env}': {e}")
+        return False
+    FIRMWARE_BUILDS[firmware_env] = (proc, log, log_path, time.time())
+    return True
+
+def wait_for_firmware_build(env):
+    """Wait for the firmware build; returns its exit code (0 if no environment is set).
+
+    Starts the build first if the gateware was up to date, so
+    build_fpga_action did not run.
+    """
+    firmware_env = env.BoardConfig().get("build.fpga_firmware_env", "")
+    if not firmware_env:
+        return 0
+    if not start_firmware_build(env):
+        return 1
+    proc, log, log_path, start = FIRMWARE_BUILDS.pop(firmware_env)
+    if proc.poll() is None:
+        print(f"Waiting for firmware environment '{firmware_env}'...")
+    returncode = proc.wait()
+    log.close()
+    if returncode != 0:
+        print(f"Error: Firmware build of '{firmware_env}' failed, see {log_path}")
+        with open(log_path, "r", encoding="utf-8", errors="replace") as f:
+            for line in f.readlines()[-20:]:
+                print(f"  {line.rstrip()}")
+    else:
+        print(f"✓ Firmware environment '{firmware_env}' built in {time.time() - start:.1f}s")
+    return returncode
+
+def stop_firmware_builds():
+    """Stop firmware builds nothing waited for, e.g. because the gateware failed.
+
+    Left running, one would race a later build of its environment.
+    """
+    for proc, log, _, _ in FIRMWARE_BUILDS.values():
+        if proc.poll() is None:
+            kill_process_tree(proc)
+            proc.wait()
+        log.close()
+    FIRMWARE_BUILDS.clear()
+
+atexit.register(stop_firmware_builds)
+
+def pack_flash_images(images, output, flash_size=None, base=0):
+    """Write images, as (address, path) pairs, into one flash image at output.
+
+    The image starts at flash address base and gaps are filled with
+    erased-flash bytes. Raises ValueError if images overlap or do not
+    fit in flash_size.
+    """
+    layout = []
+    for address, path in sorted(images):
+        size = os.path.getsize(path)
+        if address < base:
+            raise ValueError(f"{path} at 0x{address:X} is below the image start 0x{base:X}")
+        if layout and address < layout[-1][0] + layout[-1][1]:
+            previous = layout[-1]
+            raise ValueError(f"{path} at 0x{address:X} overlaps {previous[2]} "
+                             f"(0x{previous[0]:X}-0x{previous[0] + previous[1]:X})")
+        layout.append((address, size, path))
+    end = layout[-1][0] + layout[-1][1] if layout else 0
+    if flash_size is not None and end > flash_size:
+        raise ValueError(f"Combined image needs 0x{end:X} bytes, flash size is 0x{flash_size:X}")
+
+    image = bytearray()
+    for address, size, path in layout:
+        image += FLASH_FILL_BYTE * (address - base - len(image))
+        with open(path, "rb") as f:
+            image += f.read()
+    write_atomic(output, bytes(image))
+    return layout
+
+def combine_flash_image_action(target, source, env):
+    """SCons action packing the MCU firmware and the bitstream into one image."""
+    if wait_for_firmware_build(env) != 0:
+        return 1
+    bitstream_address = parse_size(env.BoardConfig().get(
+        "build.fpga_bitstream_address", hex(DEFAULT_BITSTREAM_ADDRESS)))
+    images = get_firmware_images(env) + [(bitstream_address, str(source[0]))]
+    missing = [path for _, path in images if not os.path.isfile(path)]
+    if missing:
+        print(f"Error: Missing image(s) for combined flash image: {', '.join(missing)}")
+        return 1
+    try:
+        layout = pack_flash_images(images, str(target[0]), get_flash_size(env))
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+    print(f"✓ Combined flash image: {target[0]}")
+    for address, size, path in layout:
+        print(f"  0x{address:08X}  {size:>9} bytes  {path}")
+    return 0
+
+# Register the packaging helpers with the environment
+env["FPGA_START_FIRMWARE_BUILD"] = start_firmware_build
+env["FPGA_FLASH_SIZE"] = get_flash_size
+env["FPGA_PACK_FLASH_IMAGES"] = pack_flash_images
+env["FPGA_COMBINE_IMAGE_ACTION"] = combine_flash_image_action
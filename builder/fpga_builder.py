@@ -7,58 +7,394 @@ Provides SCons-compatible functions for building Gowin FPGA bitstreams.
 Import("env")
 import os
 import sys
+import re
+import json
+import time
+import base64
+import shlex
+import signal
+import socket
+import difflib
+import hashlib
+import threading
+import zlib
 import subprocess
 import shutil
 from pathlib import Path
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import xml.etree.ElementTree as ET
+from fpga_common import (TRUE_VALUES, write_atomic, write_json_atomic, get_process_group_args,
+                         kill_process_tree, get_project_fpga_environments, uses_environment_dir)
 
-def find_gowin_toolchain(env):
-    """Locate Gowin toolchain installation."""
-    # Check environment variable first
-    gowin_home = os.environ.get("GOWIN_HOME")
-    if gowin_home and os.path.exists(gowin_home):
-        gw_sh = find_gw_sh(Path(gowin_home))
-        if gw_sh:
-            return Path(gowin_home)
-    
-    # Check board config (may not exist)
-    try:
-        gowin_path = env.BoardConfig().get("build.gowin_path")
-        if gowin_path and os.path.exists(gowin_path):
-            gw_sh = find_gw_sh(Path(gowin_path))
-            if gw_sh:
-                return Path(gowin_path)
-    except KeyError:
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+# Dual-purpose pin options and the comment written above each in the Tcl script
+GPIO_OPTIONS = [
+    ("use_sspi_as_gpio", "Use SSPI pins as regular I/O"),
+    ("use_mspi_as_gpio", "Use MSPI pins as regular I/O"),
+    ("use_jtag_as_gpio", "Use JTAG pins as regular I/O"),
+    ("use_ready_as_gpio", "Use READY pin as regular I/O"),
+    ("use_done_as_gpio", "Use DONE pin as regular I/O"),
+]
+
+# Source file categories by extension, for each scanned subdirectory of fpga/
+SOURCE_EXTENSIONS = {
+    "src": {
+        ".v": "verilog", ".sv": "verilog", ".vh": "verilog", ".svh": "verilog",
+        ".vhd": "vhdl", ".vhdl": "vhdl",
+    },
+    "constraints": {".cst": "constraints"},
+}
+
+# Persisted directory listings used by scan_fpga_sources (in fpga/impl)
+SOURCE_INDEX_NAME = "source_index.json"
+SOURCE_INDEX_VERSION = 2
+
+# Listings taken this close to a directory's mtime are not trusted, as a
+# later change within the same timestamp tick would go unnoticed
+RACY_MTIME_NS = 2 * 10**9
+
+# In-process copies of the source index, keyed by FPGA directory
+SOURCE_INDEXES = {}
+
+# Callbacks that stop the gw_sh runs in progress (see cancel_gw_sh_runs)
+ACTIVE_GW_SH_RUNS = set()
+ACTIVE_GW_SH_LOCK = threading.Lock()
+
+# Value of erased flash, which pads the end of bitstreams
+ERASED_FLASH_BYTE = 0xFF
+
+# Multi-boot variants: flash slot alignment and the packed image (in $BUILD_DIR)
+VARIANT_ADDRESS_ALIGNMENT = 0x1000
+MULTIBOOT_IMAGE_NAME = "fpga_multiboot.bin"
+
+# Gowin toolchain discovery results (in the platform's .cache directory)
+TOOLCHAIN_CACHE_NAME = "gowin_toolchains.json"
+TOOLCHAIN_CACHE_VERSION = 1
+
+# Locations searched for Gowin installations and their Gowin* subdirectories
+TOOLCHAIN_ROOTS = [
+    Path("C:/Gowin"),
+    Path("/opt/gowin"),
+    Path("/usr/local/gowin"),
+    Path.home() / "Gowin",
+]
+
+# Device database directories, e.g. IDE/share/device/GW1NR-9
+DEVICE_FAMILY_PATTERN = re.compile(r"(GW\d[A-Z]*)", re.I)
+
+# Package pin databases for the constraint pre-flight check (in the
+# platform's .cache directory), and the ones loaded by this process
+PIN_DB_DIR = "pin_db"
+PIN_DB_VERSION = 1
+PIN_DATABASES = {}
+
+# Ball grid packages (e.g. PG256) and packages with numbered pins (e.g. QN88)
+BGA_PACKAGE_PATTERN = re.compile(r"^(PG|UG|MG|CS|CM)(\d+)", re.I)
+NUMBERED_PACKAGE_PATTERN = re.compile(r"^(QN|LQ|EQ|TQ)(\d+)", re.I)
+
+# JEDEC ball row letters (I, O, Q, S, X and Z are not used), continuing
+# with AA, AB, ... on large packages
+BGA_ROW_LETTERS = "ABCDEFGHJKLMNPRTUVWY"
+
+# Constraint statements checked before a build
+CST_STATEMENT_PATTERN = re.compile(r'^\s*(IO_LOC|IO_PORT)\s+"([^"]+)"\s*(.*?)\s*;', re.I)
+CST_PORT_PATTERN = re.compile(r"^([^\[\s]+)\s*(?:\[\s*(\d+)\s*\])?$")
+CST_SITE_PATTERN = re.compile(r"^([A-Z]{1,2})?\d+$")
+
+# Implementation outputs (relative to fpga/impl) kept with a cached bitstream
+CACHED_OUTPUT_DIRS = ["pnr", "gwsynthesis"]
+CACHED_OUTPUT_SUFFIXES = (
+    ".bin", ".fs", ".vg", ".log", ".rpt.txt", ".rpt.html", ".tr.html",
+    ".pin.html", ".power.html", ".timing_paths",
+)
+
+# Stages of a staged build, each a separate gw_sh run with its own cache.
+# Gowin generates the bitstream as the last step of "run pnr".
+BUILD_STAGES = {
+    "syn": {"title": "synthesis", "outputs": ["gwsynthesis"], "primary": "*.vg"},
+    "pnr": {"title": "place & route", "outputs": ["pnr"], "primary": "*.bin"},
+}
+
+# Comment written above the run command of each generated Tcl script
+RUN_COMMENTS = {
+    "all": "Run all (synthesis, place and route, bitstream generation)",
+    "syn": "Run synthesis only",
+    "pnr": "Run place and route (includes bitstream generation)",
+}
+
+# Project file types that only affect place & route
+PNR_FILE_TYPES = ("file.cst",)
+
+# gw_sh log lines announcing the start of each implementation phase
+GW_SH_PHASES = [
+    ("syn", "synthesis", re.compile(r"GowinSynthesis|Running (parser|netlist conversion|"
+                                    r"device independent optimization|inference|technical mapping)", re.I)),
+    ("pnr", "place & route", re.compile(r"Running (placement|routing|timing analysis)|"
+                                        r"Place(ment)? (Phase|start)|Rout(e|ing) (Phase|start)", re.I)),
+    ("bitgen", "bitstream generation", re.compile(r"Generate file|Bitstream generation|"
+                                                  r"Generating bitstream", re.I)),
+]
+
+# Line the persistent gw_sh worker sends after each run (see gw_sh_worker.py)
+GW_SH_WORKER_DONE = "__PIO_GW_SH_DONE__"
+
+# Protocol version and default port of remote build workers (see gw_sh_remote_worker.py)
+REMOTE_PROTOCOL_VERSION = 1
+REMOTE_DEFAULT_PORT = 7878
+
+# Seconds a remote build may overrun its timeout before the client gives
+# up on the worker, which enforces the timeout itself
+REMOTE_TIMEOUT_GRACE = 30
+
+# gw_sh log lines after which the run can no longer succeed
+GW_SH_FATAL_PATTERN = re.compile(r"^\s*(ERROR|FATAL)\b")
+
+# Timing report fields: "<clock> | <constraint>(MHz) | <actual Fmax>(MHz)" rows and slack values
+FMAX_PATTERN = re.compile(r"<td>\s*([^<]+?)\s*</td>\s*<td>\s*([\d.]+)\s*\(MHz\)\s*</td>\s*"
+                          r"<td>\s*([\d.]+)\s*\(MHz\)")
+SLACK_PATTERN = re.compile(r"Slack\s*(?:</t[dh]>\s*<t[dh]>)?\s*:?\s*(-?\d+(?:\.\d+)?)", re.I)
+
+# Resource usage rows in gw_sh reports, e.g. "Logic | 1063/8640  13%"
+UTILIZATION_PATTERN = re.compile(r"^\s*([A-Za-z][^|\n]*?)\s*\|\s*(\d+)\s*/\s*(\d+)\b", re.M)
+
+# Machine-readable build report written next to fpga_bitstream.bin
+BUILD_REPORT_NAME = "fpga_build_report.json"
+
+# Place & route option sets tried by exploration builds when none are configured
+DEFAULT_EXPLORE_STRATEGIES = """
+place_option=0 route_option=0
+place_option=1 route_option=0
+place_option=2 route_option=1
+place_option=3 route_option=2
+"""
+
+def get_peak_rss_kb(children=False):
+    """Peak resident set size in KB of this process or its waited-for children."""
+    if resource is None:
+        return None
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    peak = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+class BuildTelemetry:
+    """Records wall-clock time and memory of each build phase.
+
+    The OS only reports the peak RSS of a process so far, so each phase
+    records that running peak and how much the phase raised it.
+    """
+
+    def __init__(self):
+        self.start = time.time()
+        self.phases = []
+        self.lock = threading.Lock()
+        self.last_peak_rss_kb = get_peak_rss_kb()
+
+    def add_phase(self, name, seconds, children_peak_rss_kb=None):
+        """Record a phase that was timed elsewhere."""
+        with self.lock:
+            peak = get_peak_rss_kb()
+            increase = None
+            if peak is not None and self.last_peak_rss_kb is not None:
+                increase = peak - self.last_peak_rss_kb
+            self.last_peak_rss_kb = peak
+            self.phases.append({
+                "name": name,
+                "seconds": round(seconds, 3),
+                "peak_rss_increase_kb": increase,
+                "running_peak_rss_kb": peak,
+                "running_children_peak_rss_kb": children_peak_rss_kb,
+            })
+
+    @contextmanager
+    def phase(self, name):
+        """Time the enclosed block as a build phase."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.time() - start)
+
+    def elapsed(self):
+        return round(time.time() - self.start, 3)
+
+def get_toolchain_cache_path(env):
+    """File holding the results of Gowin toolchain discovery."""
+    return Path(os.path.dirname(env.PioPlatform().get_dir())) / ".cache" / TOOLCHAIN_CACHE_NAME
+
+def load_toolchain_cache(cache_path):
+    """Load cached toolchain discovery results, or start an empty cache."""
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+        if cache.get("version") == TOOLCHAIN_CACHE_VERSION:
+            return cache
+    except (OSError, ValueError):
         pass
+    return {"version": TOOLCHAIN_CACHE_VERSION, "installs": {}, "roots": {}}
+
+def save_toolchain_cache(cache_path, cache):
+    """Persist toolchain discovery results; failures only cost a rescan."""
+    try:
+        write_json_atomic(cache_path, cache, indent=2)
+    except OSError:
+        pass
+
+def get_mtime_ns(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+def detect_device_families(gowin_home):
+    """Device families with a device database in a Gowin installation."""
+    device_dir = Path(gowin_home) / "IDE" / "share" / "device"
+    families = set()
+    try:
+        for entry in os.scandir(device_dir):
+            match = DEVICE_FAMILY_PATTERN.match(entry.name)
+            if entry.is_dir() and match:
+                families.add(match.group(1).upper())
+    except OSError:
+        pass
+    return sorted(families)
+
+def describe_toolchain(gowin_home, cache):
+    """Details of the installation at gowin_home, or None if it has no gw_sh.
+
+    Cached entries are reused while gw_sh keeps its mtime; an upgrade
+    in place or a removed installation invalidates them.
+    """
+    key = str(gowin_home)
+    entry = cache["installs"].get(key)
+    if entry and get_mtime_ns(entry["gw_sh"]) == entry["gw_sh_mtime_ns"]:
+        return entry
     
-    # Check common installation paths and their subdirectories
-    common_paths = [
-        Path("C:/Gowin"),
-        Path("/opt/gowin"),
-        Path("/usr/local/gowin"),
-        Path.home() / "Gowin",
-    ]
+    gw_sh = find_gw_sh(Path(gowin_home))
+    if not gw_sh:
+        cache["installs"].pop(key, None)
+        return None
+    entry = {
+        "home": key,
+        "gw_sh": str(gw_sh),
+        "gw_sh_mtime_ns": get_mtime_ns(gw_sh),
+        "version": detect_toolchain_version(gowin_home, gw_sh),
+        "families": detect_device_families(gowin_home),
+    }
+    cache["installs"][key] = entry
+    cache["dirty"] = True
+    return entry
+
+def scan_toolchain_root(base_path, cache):
+    """Installations directly in base_path or in its Gowin* subdirectories.
+
+    The list of candidate directories is cached and reused while the
+    mtime of base_path is unchanged, as installing or removing a version
+    changes it.
+    """
+    key = str(base_path)
+    mtime_ns = get_mtime_ns(base_path)
+    if mtime_ns is None:
+        return []
     
-    for base_path in common_paths:
-        if not base_path.exists():
-            continue
-            
-        # First check if gw_sh is directly in this path
-        gw_sh = find_gw_sh(base_path)
-        if gw_sh:
-            return base_path
-        
-        # Search for versioned subdirectories (e.g., Gowin_V1.9.11.03_Education_x64)
+    entry = cache["roots"].get(key)
+    if not entry or entry["mtime_ns"] != mtime_ns:
+        homes = [key]
         try:
-            for subdir in base_path.iterdir():
-                if subdir.is_dir() and subdir.name.startswith("Gowin"):
-                    gw_sh = find_gw_sh(subdir)
-                    if gw_sh:
-                        return subdir
+            homes.extend(sorted(str(subdir) for subdir in base_path.iterdir()
+                                if subdir.name.startswith("Gowin") and subdir.is_dir()))
         except (PermissionError, OSError):
-            continue
+            pass
+        entry = {"mtime_ns": mtime_ns, "homes": homes}
+        # A listing taken in the same timestamp tick as a change could miss it
+        if time.time_ns() - mtime_ns >= RACY_MTIME_NS:
+            cache["roots"][key] = entry
+            cache["dirty"] = True
     
-    return None
+    installs = []
+    for home in entry["homes"]:
+        install = describe_toolchain(home, cache)
+        if install:
+            installs.append(install)
+    return installs
+
+def toolchain_version_key(install):
+    """Sort key ordering installations from oldest to newest version."""
+    match = re.match(r"\d+(?:\.\d+)*$", install["version"])
+    version = tuple(int(part) for part in match.group(0).split(".")) if match else ()
+    return (version, install["home"])
+
+def discover_gowin_toolchains(env):
+    """All Gowin installations under the common install locations, newest first."""
+    cache_path = get_toolchain_cache_path(env)
+    cache = load_toolchain_cache(cache_path)
+    installs = {}
+    for base_path in TOOLCHAIN_ROOTS:
+        for install in scan_toolchain_root(base_path, cache):
+            installs[install["home"]] = install
+    if cache.pop("dirty", False):
+        save_toolchain_cache(cache_path, cache)
+    return sorted(installs.values(), key=toolchain_version_key, reverse=True)
+
+def resolve_gowin_toolchain(env):
+    """Select the Gowin toolchain for this environment.
+
+    GOWIN_HOME takes precedence over board_build.gowin_path. Otherwise
+    board_build.gowin_version picks among the discovered installations:
+    "newest" (the default) or a version prefix such as "1.9.9". Returns
+    the installation details, or None if no toolchain was found.
+    """
+    cache_path = get_toolchain_cache_path(env)
+    cache = load_toolchain_cache(cache_path)
+    explicit = [os.environ.get("GOWIN_HOME")]
+    try:
+        explicit.append(env.BoardConfig().get("build.gowin_path"))
+    except KeyError:
+        pass
+    for gowin_home in explicit:
+        if gowin_home and os.path.exists(gowin_home):
+            install = describe_toolchain(Path(gowin_home), cache)
+            if install:
+                if cache.pop("dirty", False):
+                    save_toolchain_cache(cache_path, cache)
+                return install
+    
+    installs = discover_gowin_toolchains(env)
+    policy = env.BoardConfig().get("build.gowin_version", "newest")
+    if policy != "newest":
+        installs = [install for install in installs
+                    if f"{install['version']}.".startswith(f"{policy}.")]
+        if not installs:
+            print(f"Warning: No installed Gowin toolchain matches version {policy}")
+    return installs[0] if installs else None
+
+def find_gowin_toolchain(env):
+    """Locate Gowin toolchain installation."""
+    install = resolve_gowin_toolchain(env)
+    return Path(install["home"]) if install else None
+
+def list_toolchains_action(target, source, env):
+    """SCons action listing the installed Gowin toolchains (pio run -t toolchains)."""
+    installs = discover_gowin_toolchains(env)
+    selected = resolve_gowin_toolchain(env)
+    if selected and selected["home"] not in [install["home"] for install in installs]:
+        installs.insert(0, selected)
+    if not installs:
+        print("No Gowin toolchain found")
+        print("Set GOWIN_HOME environment variable or board_build.gowin_path")
+        return 0
+    
+    print("Installed Gowin toolchains (* = used by this environment):")
+    for install in installs:
+        marker = "*" if selected and install["home"] == selected["home"] else " "
+        families = ", ".join(install["families"]) or "unknown families"
+        print(f"  {marker} {install['version']:<12} {install['home']}  ({families})")
+    return 0
 
 def find_gw_sh(gowin_home):
     """Find gw_sh executable in Gowin installation."""
@@ -77,8 +413,104 @@ def find_gw_sh(gowin_home):
     
     return None
 
+def detect_toolchain_version(gowin_home, gw_sh):
+    """Best-effort Gowin toolchain version string for cache keys."""
+    # Installations are normally named after their version,
+    # e.g. Gowin_V1.9.11.03_Education_x64
+    for part in reversed(Path(gowin_home).parts):
+        match = re.search(r"[Vv](\d+(?:\.\d+)+)", part)
+        if match:
+            return match.group(1)
+
+    # Unversioned install path: fall back to the identity of gw_sh itself
+    try:
+        info = Path(gw_sh).stat()
+        return f"unknown-{info.st_size}-{int(info.st_mtime)}"
+    except OSError:
+        return "unknown"
+
+def load_source_index(index_path):
+    """Load the persisted source index, or start an empty one."""
+    try:
+        with open(index_path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        if index.get("version") == SOURCE_INDEX_VERSION:
+            return index
+    except (OSError, ValueError):
+        pass
+    return {"version": SOURCE_INDEX_VERSION, "dirs": {}}
+
+def save_source_index(index_path, index):
+    """Atomically persist the source index; failures only cost a rescan."""
+    try:
+        write_json_atomic(index_path, index)
+    except OSError:
+        pass
+
+def list_source_directory(dirpath, extensions, mtime_ns):
+    """List one directory: matching files with their category, and subdirectories.
+
+    Symlinked directories are not followed (a link back up the tree would
+    never end), symlinked files are. File stat data is not kept: editing a
+    file does not change its directory's mtime, so it could not be trusted
+    without a stat per file, which is what the index saves.
+    """
+    files = {}
+    subdirs = []
+    with os.scandir(dirpath) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.name)
+            elif entry.is_file():
+                category = extensions.get(os.path.normcase(os.path.splitext(entry.name)[1]))
+                if category:
+                    files[entry.name] = category
+    return {
+        "mtime_ns": mtime_ns,
+        "scanned_ns": time.time_ns(),
+        "files": files,
+        "subdirs": sorted(subdirs),
+    }
+
+def walk_source_tree(fpga_path, subdir, extensions, index, sources, visited):
+    """Collect sources below fpga_path/subdir into sources.
+
+    Directories whose mtime matches the index are not listed again.
+    Returns True if the index was modified.
+    """
+    changed = False
+    stack = [subdir]
+    while stack:
+        rel_dir = stack.pop()
+        dirpath = fpga_path / rel_dir
+        try:
+            mtime_ns = os.stat(dirpath).st_mtime_ns
+        except OSError:
+            continue
+        
+        entry = index["dirs"].get(rel_dir)
+        if (entry is None or entry["mtime_ns"] != mtime_ns
+                or entry["scanned_ns"] - mtime_ns < RACY_MTIME_NS):
+            try:
+                entry = list_source_directory(dirpath, extensions, mtime_ns)
+            except OSError:
+                continue
+            index["dirs"][rel_dir] = entry
+            changed = True
+        
+        visited.add(rel_dir)
+        for name, category in entry["files"].items():
+            sources[category].append(dirpath / name)
+        stack.extend(f"{rel_dir}/{name}" for name in entry["subdirs"])
+    return changed
+
 def scan_fpga_sources(fpga_dir):
-    """Recursively scan FPGA directory for source files."""
+    """Recursively scan FPGA directory for source files.
+
+    The src/ and constraints/ trees are walked once, classifying files by
+    extension. Directory listings are kept in fpga/impl/source_index.json
+    so an unchanged tree is revalidated by stat'ing its directories only.
+    """
     sources = {
         'verilog': [],
         'vhdl': [],
@@ -89,78 +521,129 @@ def scan_fpga_sources(fpga_dir):
     if not fpga_path.exists():
         return sources
     
-    # Scan for HDL source files
-    src_dir = fpga_path / "src"
-    if src_dir.exists():
-        # Verilog/SystemVerilog files
-        for ext in ['.v', '.sv', '.vh', '.svh']:
-            sources['verilog'].extend(src_dir.rglob(f"*{ext}"))
-        # VHDL files
-        for ext in ['.vhd', '.vhdl']:
-            sources['vhdl'].extend(src_dir.rglob(f"*{ext}"))
-    
-    # Scan for constraint files
-    constraints_dir = fpga_path / "constraints"
-    if constraints_dir.exists():
-        sources['constraints'].extend(constraints_dir.rglob("*.cst"))
+    index_path = fpga_path / "impl" / SOURCE_INDEX_NAME
+    index_key = str(fpga_path.resolve())
+    index = SOURCE_INDEXES.get(index_key)
+    if index is None:
+        index = load_source_index(index_path)
+        SOURCE_INDEXES[index_key] = index
+    
+    visited = set()
+    changed = False
+    for subdir, extensions in SOURCE_EXTENSIONS.items():
+        changed |= walk_source_tree(fpga_path, subdir, extensions, index, sources, visited)
     
+    # Forget directories that no longer exist
+    for rel_dir in set(index["dirs"]) - visited:
+        del index["dirs"][rel_dir]
+        changed = True
+    
+    if changed or not index_path.exists():
+        save_source_index(index_path, index)
+    
+    for files in sources.values():
+        files.sort()
     return sources
 
-def update_gprj_file(gprj_path, sources, fpga_dir):
-    """Update .gprj XML file with discovered source files."""
+def is_managed_gprj_entry(path):
+    """Whether a .gprj file entry is one the build system adds and removes."""
+    if any(ext in path for ext in ['.v', '.sv', '.vhd', '.vhdl', '.cst', '.sdc']):
+        return 'src/' in path or 'constraints/' in path
+    return False
+
+def get_gprj_file_entries(sources, gprj_parent):
+    """Desired (path, type) .gprj entries for the discovered source files."""
+    entries = []
+    for category, file_type in [('verilog', 'file.verilog'), ('vhdl', 'file.vhdl'),
+                                ('constraints', 'file.cst')]:
+        for source_file in sorted(sources[category]):
+            rel_path = Path(source_file).relative_to(gprj_parent)
+            entries.append((str(rel_path).replace('\\', '/'), file_type))
+    return entries
+
+def update_gprj_file(gprj_path, sources, fpga_dir, top_module=None):
+    """Update .gprj XML file with discovered source files.
+
+    The file is only rewritten (atomically) when its managed file list or
+    top module actually differ, so unchanged projects keep their mtime.
+    """
     if not os.path.exists(gprj_path):
         print(f"Warning: Project file not found: {gprj_path}")
         return False
     
     try:
-        tree = ET.parse(gprj_path)
+        # Keep comments the IDE or user put in the project
+        parser = ET.XMLParser(target=ET.TreeBuilder(insert_comments=True))
+        tree = ET.parse(gprj_path, parser)
         root = tree.getroot()
+        changed = False
         
         filelist = root.find('FileList')
         if filelist is None:
             filelist = ET.SubElement(root, 'FileList')
+            changed = True
         
-        # Remove existing auto-generated entries
-        for file_elem in list(filelist.findall('File')):
-            path = file_elem.get('path', '')
-            if any(ext in path for ext in ['.v', '.sv', '.vhd', '.vhdl', '.cst', '.sdc']):
-                if 'src/' in path or 'constraints/' in path:
-                    filelist.remove(file_elem)
-        
-        fpga_path = Path(fpga_dir)
-        gprj_parent = Path(gprj_path).parent
-        
-        # Add Verilog source files
-        for verilog_file in sorted(sources['verilog']):
-            file_elem = ET.SubElement(filelist, 'File')
-            rel_path = verilog_file.relative_to(gprj_parent)
-            file_elem.set('path', str(rel_path).replace('\\', '/'))
-            file_elem.set('type', 'file.verilog')
-            file_elem.set('enable', '1')
+        # Compare the auto-generated entries with the discovered sources
+        desired = get_gprj_file_entries(sources, Path(gprj_path).parent)
+        managed = [elem for elem in filelist.findall('File')
+                   if is_managed_gprj_entry(elem.get('path', ''))]
+        current = [(elem.get('path', ''), elem.get('type', '')) for elem in managed]
+        if current != desired or any(elem.get('enable') != '1' for elem in managed):
+            for file_elem in managed:
+                filelist.remove(file_elem)
+            for rel_path, file_type in desired:
+                file_elem = ET.SubElement(filelist, 'File')
+                file_elem.set('path', rel_path)
+                file_elem.set('type', file_type)
+                file_elem.set('enable', '1')
+            changed = True
         
-        # Add VHDL source files
-        for vhdl_file in sorted(sources['vhdl']):
-            file_elem = ET.SubElement(filelist, 'File')
-            rel_path = vhdl_file.relative_to(gprj_parent)
-            file_elem.set('path', str(rel_path).replace('\\', '/'))
-            file_elem.set('type', 'file.vhdl')
-            file_elem.set('enable', '1')
+        # Keep the project's top module in line with the board configuration
+        if top_module:
+            top_elem = root.find('OptionInfo/TopModule')
+            if top_elem is not None and top_elem.get('name') != top_module:
+                top_elem.set('name', top_module)
+                changed = True
         
-        # Add constraint files
-        for cst_file in sorted(sources['constraints']):
-            file_elem = ET.SubElement(filelist, 'File')
-            rel_path = cst_file.relative_to(gprj_parent)
-            file_elem.set('path', str(rel_path).replace('\\', '/'))
-            file_elem.set('type', 'file.cst')
-            file_elem.set('enable', '1')
+        if not changed:
+            return True
         
-        tree.write(gprj_path, encoding='utf-8', xml_declaration=True)
+        write_atomic(gprj_path, ET.tostring(root, encoding='utf-8', xml_declaration=True))
+        print(f"  Updated project file: {gprj_path}")
         return True
         
     except Exception as e:
         print(f"Error updating .gprj file: {e}")
         return False
 
+def get_fpga_environments(env):
+    """Project environments that build gateware with this platform."""
+    try:
+        config = env.GetProjectConfig()
+    except AttributeError:
+        return [env.subst("$PIOENV")]
+    return get_project_fpga_environments(config)
+
+def get_environment_dir(env, fpga_dir):
+    """Private fpga/impl/env/<name> directory of this environment, or None.
+
+    When several environments build the same gateware, each gets its own
+    copy of the .gprj and its own implementation outputs, so they can be
+    built at the same time. A single environment uses fpga/impl directly.
+    board_build.fpga_env_isolation (auto, 1 or 0) overrides the choice.
+    """
+    mode = env.BoardConfig().get("build.fpga_env_isolation", "auto")
+    if not uses_environment_dir(mode, get_fpga_environments(env)):
+        return None
+    return Path(fpga_dir) / "impl" / "env" / env.subst("$PIOENV")
+
+def select_fpga_sources(env, fpga_dir, sources, verbose=True):
+    """Prune scanned sources to the top module's dependencies, if enabled."""
+    if env.BoardConfig().get("build.fpga_prune_sources", "0") not in TRUE_VALUES:
+        return sources
+    top_module = env.BoardConfig().get("build.fpga_top_module", "top")
+    return env["FPGA_REACHABLE_SOURCES"](sources, top_module, Path(fpga_dir) / "impl", verbose)
+
 def get_fpga_sources(env):
     """Get all FPGA source files for dependency tracking."""
     project_dir = Path(env.get("PROJECT_DIR"))
@@ -176,15 +659,1857 @@ def get_fpga_sources(env):
         all_sources.append(str(gprj_path))
         
         # Scan for source files
-        sources = scan_fpga_sources(fpga_dir)
+        with env["FPGA_TELEMETRY"].phase("get_fpga_sources"):
+            sources = scan_fpga_sources(fpga_dir)
+            # Variants may have other top modules, so they depend on every source
+            if not env.BoardConfig().get("build.fpga_variants", ""):
+                sources = select_fpga_sources(env, fpga_dir, sources, verbose=False)
         all_sources.extend([str(f) for f in sources['verilog']])
         all_sources.extend([str(f) for f in sources['vhdl']])
         all_sources.extend([str(f) for f in sources['constraints']])
     
     return all_sources
 
+def get_fpga_build_options(env):
+    """Collect the board options that are passed to gw_sh."""
+    board = env.BoardConfig()
+    options = {
+        # Get top module name from board config
+        "top_module": board.get("build.fpga_top_module", "top"),
+    }
+
+    # Get dual-purpose pin configuration options
+    for name, _ in GPIO_OPTIONS:
+        options[name] = board.get(f"build.{name}", "0")
+
+    # Get multi-boot configuration options
+    options["multi_boot"] = board.get("build.multi_boot", "0")
+    options["spi_flash_address"] = board.get("build.spi_flash_address", "")
+
+    # Vendor bitstream compression
+    options["bit_compress"] = board.get("build.fpga_bitstream_compress", "0")
+
+    return options
+
+def get_package_pins(package):
+    """Pin names of a Gowin package, derived from its name, or None if unknown.
+
+    Ball grid packages give every ball of the square grid (a superset
+    where the package has depopulated balls), others pins 1 to N.
+    """
+    match = BGA_PACKAGE_PATTERN.match(package)
+    if match:
+        size = 1
+        while size * size < int(match.group(2)):
+            size += 1
+        rows = list(BGA_ROW_LETTERS)
+        rows += [a + b for a in BGA_ROW_LETTERS for b in BGA_ROW_LETTERS]
+        return [f"{row}{column}" for row in rows[:size] for column in range(1, size + 1)]
+    match = NUMBERED_PACKAGE_PATTERN.match(package)
+    if match:
+        return [str(pin) for pin in range(1, int(match.group(2)) + 1)]
+    return None
+
+def read_pin_file(path):
+    """Pin names listed in a file, separated by whitespace or commas."""
+    with open(path, "r", encoding="utf-8") as f:
+        text = re.sub(r"(#|//).*", "", f.read())
+    return [pin.upper() for pin in re.split(r"[\s,]+", text) if pin]
+
+def load_pin_database(env):
+    """Valid pins of the board's package, or None if they are not known.
+
+    board_build.fpga_pin_file lists the pins explicitly; otherwise they are
+    derived from fpga_package. The result is cached per board, so later
+    builds only compare a few fields.
+    """
+    board = env.BoardConfig()
+    package = board.get("build.fpga_package", "").upper()
+    pin_file = board.get("build.fpga_pin_file", "")
+    if pin_file and not os.path.isabs(pin_file):
+        pin_file = os.path.join(env.subst("$PROJECT_DIR"), pin_file)
+    source = {
+        "version": PIN_DB_VERSION,
+        "package": package,
+        "pin_file": pin_file,
+        "pin_file_mtime_ns": get_mtime_ns(pin_file) if pin_file else None,
+    }
+    memo_key = json.dumps(source, sort_keys=True)
+    if memo_key in PIN_DATABASES:
+        return PIN_DATABASES[memo_key]
+
+    board_id = re.sub(r"[^\w.-]", "_", env.subst("$BOARD") or package or "unknown")
+    cache_path = (Path(os.path.dirname(env.PioPlatform().get_dir())) / ".cache" / PIN_DB_DIR
+                  / f"{board_id}.json")
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+        if {key: cached.get(key) for key in source} != source:
+            raise ValueError("stale pin database")
+        database = cached["database"]
+    except (OSError, ValueError, KeyError):
+        if pin_file:
+            try:
+                database = {"pins": read_pin_file(pin_file), "complete": True}
+            except OSError as e:
+                print(f"Warning: Could not read board_build.fpga_pin_file: {e}")
+                database = None
+        else:
+            pins = get_package_pins(package)
+            database = {"pins": pins, "complete": False} if pins else None
+        try:
+            write_json_atomic(cache_path, dict(source, database=database))
+        except OSError:
+            pass
+
+    if database is not None:
+        database = {"pins": set(database["pins"]), "complete": database["complete"]}
+    PIN_DATABASES[memo_key] = database
+    return database
+
+def parse_cst_file(path):
+    """IO_LOC and IO_PORT statements of a constraint file.
+
+    Returns (keyword, port, value, line number) tuples; statements split
+    over several lines are reported at their first line.
+    """
+    statements = []
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        lines = f.read().splitlines()
+    pending, pending_line = "", 0
+    for number, line in enumerate(lines, 1):
+        line = line.split("//")[0].strip()
+        if not line:
+            continue
+        if not pending:
+            pending_line = number
+        pending = f"{pending} {line}" if pending else line
+        if ";" not in line:
+            continue
+        for statement in pending.split(";")[:-1]:
+            match = CST_STATEMENT_PATTERN.match(statement + ";")
+            if match:
+                statements.append((match.group(1).upper(), match.group(2).strip(),
+                                   match.group(3), pending_line))
+        pending = pending.rsplit(";", 1)[1].strip()
+        pending_line = number
+    return statements
+
+def get_preflight_top_modules(env):
+    """Top modules the constraints must fit: the board's, or each variant's."""
+    top_module = env.BoardConfig().get("build.fpga_top_module", "top")
+    try:
+        variants = parse_fpga_variants(env.BoardConfig().get("build.fpga_variants", ""))
+    except ValueError:
+        variants = []
+    if not variants:
+        return [top_module]
+    return list(dict.fromkeys(v["options"].get("top_module", top_module) for v in variants))
+
+def check_constraints(env, sources, constraint_files, top_modules):
+    """Check .cst files against the top module ports and the package pins.
+
+    Returns lists of error and warning messages, each prefixed with the
+    file and line it refers to.
+    """
+    errors, warnings = [], []
+    tops = []
+    for top_module in top_modules:
+        found = env["FPGA_MODULE_PORTS"](sources, top_module)
+        if found is None:
+            warnings.append(f"Top module '{top_module}' not found in the HDL sources, "
+                            "skipping port checks")
+        else:
+            tops.append(found)
+
+    def find_port(name):
+        """Ranges of the port name in the top modules it exists in."""
+        ranges = []
+        for ports, language in tops:
+            key = name.lower() if language == "vhdl" else name
+            if key in ports:
+                ranges.append(ports[key])
+        return ranges
+
+    database = load_pin_database(env)
+    top_names = "/".join(top_modules)
+    site_owners, port_sites, constrained = {}, {}, {}
+    for path in constraint_files:
+        if not str(path).lower().endswith(".cst"):
+            continue
+        for keyword, port, value, line in parse_cst_file(path):
+            where = f"{Path(path).name}:{line}"
+            match = CST_PORT_PATTERN.match(port)
+            name, index = (match.group(1), match.group(2)) if match else (port, None)
+            if tops and match:
+                ranges = find_port(name)
+                if not ranges:
+                    message = f"{where}: {keyword} \"{port}\": no port '{name}' in {top_names}"
+                    known = [p for ports, _ in tops for p in ports]
+                    close = difflib.get_close_matches(name, known, n=1)
+                    if close:
+                        message += f" (did you mean '{close[0]}'?)"
+                    (errors if keyword == "IO_LOC" else warnings).append(message)
+                elif index is not None and not any(
+                        r == "any" or (r is not None and r[0] <= int(index) <= r[1])
+                        for r in ranges):
+                    bounds = ", ".join(f"[{r[1]}:{r[0]}]" for r in ranges if r)
+                    message = (f"{where}: {keyword} \"{port}\": index {index} is outside "
+                               f"'{name}' {bounds or '(not a vector)'}")
+                    (errors if keyword == "IO_LOC" else warnings).append(message)
+            if keyword != "IO_LOC":
+                continue
+
+            for ports, language in tops:
+                key = name.lower() if language == "vhdl" else name
+                constrained.setdefault(key, set()).add(int(index) if index is not None else None)
+            sites = [site.strip().upper() for site in value.split(",") if site.strip()]
+            if not sites:
+                errors.append(f"{where}: IO_LOC \"{port}\" has no site")
+                continue
+            previous = port_sites.get(port)
+            if previous and previous[0] != sites:
+                errors.append(f"{where}: IO_LOC \"{port}\" is {','.join(sites)}, "
+                              f"but {previous[1]} already places it at {','.join(previous[0])}")
+            port_sites.setdefault(port, (sites, where))
+            for site in sites:
+                owner = site_owners.setdefault(site, (port, where))
+                if owner[0] != port:
+                    errors.append(f"{where}: IO_LOC \"{port}\" uses site {site}, "
+                                  f"already used by \"{owner[0]}\" at {owner[1]}")
+                if database and site not in database["pins"] and (
+                        database["complete"] or CST_SITE_PATTERN.match(site)):
+                    listed_in = ("board_build.fpga_pin_file" if database["complete"] else
+                                 f"package {env.BoardConfig().get('build.fpga_package', '')}")
+                    errors.append(f"{where}: IO_LOC \"{port}\": no pin {site} in {listed_in}")
+
+    # Top-level ports left to the placer
+    for ports, language in tops:
+        for name, port_range in ports.items():
+            indices = constrained.get(name, set())
+            if isinstance(port_range, tuple) and None not in indices:
+                bits = range(port_range[0], port_range[1] + 1)
+                missing = [bit for bit in bits if bit not in indices]
+                if missing:
+                    warnings.append(f"Port '{name}' has no IO_LOC for {len(missing)} of "
+                                    f"{len(bits)} bit(s)")
+            elif not indices:
+                warnings.append(f"Port '{name}' has no IO_LOC")
+    return errors, list(dict.fromkeys(warnings))
+
+def run_preflight_check(env, sources, constraint_files):
+    """Validate the constraints before gw_sh runs; returns False to stop the build.
+
+    board_build.fpga_preflight is "warn" (default) to only report errors,
+    "1" to fail the build on them, or "0" to skip the check. The check is
+    heuristic, so only a user who opts in gets failed builds from it.
+    """
+    mode = env.BoardConfig().get("build.fpga_preflight", "warn")
+    if mode not in TRUE_VALUES and mode != "warn":
+        return True
+    start = time.time()
+    try:
+        errors, warnings = check_constraints(env, sources, constraint_files,
+                                             get_preflight_top_modules(env))
+    except (OSError, UnicodeError) as e:
+        print(f"Warning: Pre-flight check skipped: {e}")
+        return True
+    elapsed_ms = (time.time() - start) * 1000
+    for message in warnings:
+        print(f"Warning: {message}")
+    for message in errors:
+        print(f"Error: {message}")
+    if errors and mode != "warn":
+        print(f"Pre-flight check found {len(errors)} constraint error(s) in {elapsed_ms:.0f} ms")
+        print("Fix them, or set board_build.fpga_preflight = warn to build anyway.")
+        return False
+    if errors:
+        print(f"Pre-flight check found {len(errors)} possible constraint error(s); "
+              "building anyway (board_build.fpga_preflight = 1 stops the build)")
+    else:
+        print(f"✓ Pre-flight check passed ({elapsed_ms:.0f} ms)")
+    return True
+
+def generate_tcl_script(gprj_path, options, run="all", strategy=None):
+    """Generate the gw_sh Tcl script for a project and its options.
+
+    run selects the flow: "all", or a single stage ("syn" or "pnr").
+    strategy holds extra place & route options for exploration runs.
+    """
+    lines = [
+        "# Auto-generated Tcl script for gw_sh",
+        "# Open project",
+        f"open_project ../{Path(gprj_path).name}",
+        "",
+        "# Set top module explicitly",
+        f"set_option -top_module {options['top_module']}",
+    ]
+
+    # Add dual-purpose pin configuration options if enabled
+    for name, comment in GPIO_OPTIONS:
+        if options.get(name) in TRUE_VALUES:
+            lines.extend(["", f"# {comment}", f"set_option -{name} 1"])
+
+    # Add multi-boot configuration if enabled
+    if options.get("multi_boot") in TRUE_VALUES:
+        lines.extend(["", "# Enable Multi Boot", "set_option -multi_boot 1"])
+
+        # Set SPI flash address if provided
+        if options.get("spi_flash_address"):
+            # Ensure address has 0x prefix if it's a hex value
+            addr = options["spi_flash_address"].strip()
+            if not addr.startswith("0x") and not addr.startswith("0X"):
+                addr = "0x" + addr
+            lines.append(f"set_option -spi_flash_addr {addr}")
+
+    # Out-of-context modules connect to other logic, not to package pins
+    if options.get("disable_insert_pad") in TRUE_VALUES:
+        lines.extend(["", "# Do not insert I/O buffers (out-of-context module)",
+                      "set_option -disable_insert_pad 1"])
+
+    # Add bitstream compression if enabled
+    if options.get("bit_compress") in TRUE_VALUES:
+        lines.extend(["", "# Compress the bitstream", "set_option -bit_compress 1"])
+
+    # Add exploration strategy options
+    if strategy:
+        lines.extend(["", "# Place & route strategy"])
+        lines.extend(f"set_option -{name} {value}" for name, value in strategy.items())
+
+    lines.extend([
+        "",
+        f"# {RUN_COMMENTS[run]}",
+        f"run {run}",
+        "",
+        "# Close project",
+        "exit",
+        "",
+    ])
+    return "\n".join(lines)
+
+def normalize_source(data):
+    """Normalize line endings and trailing whitespace of a source file."""
+    text = data.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+    lines = [line.rstrip() for line in text.split(b"\n")]
+    while lines and not lines[-1]:
+        lines.pop()
+    return b"\n".join(lines)
+
+def hash_source_file(path):
+    """SHA-256 of a source file's normalized contents."""
+    with open(path, "rb") as f:
+        return hashlib.sha256(normalize_source(f.read())).hexdigest()
+
+def read_project_inputs(gprj_path):
+    """Read the build inputs recorded in a .gprj project.
+
+    Returns a list of (path, type, enable, content hash) tuples for the
+    project files and the remaining project settings as normalized XML.
+    """
+    gprj_path = Path(gprj_path)
+    root = ET.parse(gprj_path).getroot()
+
+    # Every project file (HDL, constraints, IP cores) by content
+    entries = []
+    filelist = root.find("FileList")
+    if filelist is not None:
+        for file_elem in filelist.findall("File"):
+            rel_path = file_elem.get("path", "")
+            file_path = gprj_path.parent / rel_path
+            digest = hash_source_file(file_path) if file_path.is_file() else "missing"
+            entries.append((rel_path, file_elem.get("type", ""), file_elem.get("enable", "1"), digest))
+        root.remove(filelist)
+
+    # Remaining project settings, ignoring indentation
+    for elem in root.iter():
+        elem.text = elem.text.strip() if elem.text else None
+        elem.tail = None
+
+    return sorted(entries), ET.tostring(root, encoding="unicode")
+
+def hash_parts(parts):
+    """SHA-256 over a sequence of strings."""
+    key = hashlib.sha256()
+    for part in parts:
+        key.update(part.encode("utf-8"))
+        key.update(b"\0")
+    return key.hexdigest()
+
+def compute_bitstream_cache_key(project_inputs, tcl_text, device, toolchain_version):
+    """Hash everything that determines the bitstream gw_sh would produce."""
+    entries, settings = project_inputs
+    parts = [f"toolchain={toolchain_version}", f"device={device}", tcl_text, settings]
+    parts.extend("|".join(entry) for entry in entries)
+    return hash_parts(parts)
+
+def compute_stage_key(stage, project_inputs, options, device, toolchain_version,
+                      netlist_digest=None):
+    """Hash the inputs of a single build stage.
+
+    Synthesis depends on everything but the physical constraints; place &
+    route depends on the synthesized netlist, the constraints and the
+    pin/bitstream options.
+    """
+    entries, settings = project_inputs
+    parts = [f"stage={stage}", f"toolchain={toolchain_version}", f"device={device}", settings]
+    if stage == "syn":
+        parts.append(f"top_module={options['top_module']}")
+        parts.extend("|".join(e) for e in entries if e[1] not in PNR_FILE_TYPES)
+    else:
+        parts.append(f"netlist={netlist_digest}")
+        parts.append(generate_tcl_script("project.gprj", options, stage))
+        parts.extend("|".join(e) for e in entries if e[1] in PNR_FILE_TYPES)
+    return hash_parts(parts)
+
+def hash_netlist(impl_dir):
+    """Hash the synthesized netlist, ignoring its timestamped comment header."""
+    netlists = sorted((Path(impl_dir) / "gwsynthesis").glob("*.vg"))
+    if not netlists:
+        return None
+
+    digest = hashlib.sha256()
+    for netlist in netlists:
+        with open(netlist, "rb") as f:
+            for line in normalize_source(f.read()).split(b"\n"):
+                if not line.lstrip().startswith(b"//"):
+                    digest.update(line + b"\n")
+    return digest.hexdigest()
+
+def get_bitstream_cache_dir(env):
+    """Directory holding cached bitstreams, shared by all projects."""
+    cache_dir = env.BoardConfig().get("build.fpga_cache_dir", "")
+    if cache_dir:
+        return Path(cache_dir)
+    # Stored next to the platform like the pesptool download cache
+    return Path(os.path.dirname(env.PioPlatform().get_dir())) / ".cache" / "gowin-bitstreams"
+
+def get_stage_cache_dir(impl_dir, stage):
+    """Per-project cache directory for the outputs of one build stage."""
+    return Path(impl_dir) / "cache" / stage
+
+def get_bitstream_cache_limit(env):
+    """Maximum bitstream cache size in bytes (board_build.fpga_cache_size, in MB)."""
+    size_mb = env.BoardConfig().get("build.fpga_cache_size", "512")
+    try:
+        return int(float(size_mb) * 1024 * 1024)
+    except (TypeError, ValueError):
+        print(f"Warning: Invalid fpga_cache_size '{size_mb}', using 512 MB")
+        return 512 * 1024 * 1024
+
+def collect_impl_outputs(impl_dir, dirnames):
+    """List cacheable output files in the given impl subdirectories."""
+    files = []
+    for dirname in dirnames:
+        out_dir = Path(impl_dir) / dirname
+        if out_dir.is_dir():
+            files.extend(p for p in sorted(out_dir.iterdir())
+                         if p.is_file() and p.name.endswith(CACHED_OUTPUT_SUFFIXES))
+    return files
+
+def restore_cached_outputs(cache_dir, key, impl_dir):
+    """Restore cached implementation outputs into impl_dir.
+
+    Returns the path of the entry's primary output (bitstream or netlist),
+    or None on a cache miss.
+    """
+    entry = Path(cache_dir) / key
+    manifest_path = entry / "manifest.json"
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    files = manifest.get("files", [])
+    if not manifest.get("output") or not all((entry / "files" / rel).is_file() for rel in files):
+        return None
+
+    for rel in files:
+        dest = Path(impl_dir) / rel
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(entry / "files" / rel, dest)
+
+    # Mark the entry as recently used for LRU eviction
+    os.utime(manifest_path, None)
+    return Path(impl_dir) / manifest["output"]
+
+def store_cached_outputs(cache_dir, key, impl_dir, files, output, max_bytes):
+    """Copy implementation outputs into the cache under key."""
+    cache_dir = Path(cache_dir)
+    impl_dir = Path(impl_dir)
+    entry = cache_dir / key
+    if entry.exists():
+        return
+
+    # Populate a private staging directory, then rename it into place
+    staging = cache_dir / f".{key}.{os.getpid()}.tmp"
+    try:
+        total = 0
+        for path in files:
+            dest = staging / "files" / path.relative_to(impl_dir).as_posix()
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(path, dest)
+            total += path.stat().st_size
+
+        manifest = {
+            "key": key,
+            "created": time.time(),
+            "size": total,
+            "output": Path(output).relative_to(impl_dir).as_posix(),
+            "files": sorted(p.relative_to(impl_dir).as_posix() for p in files),
+        }
+        with open(staging / "manifest.json", "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+
+        os.replace(staging, entry)
+    except OSError as e:
+        print(f"Warning: Could not store build outputs in cache: {e}")
+    finally:
+        if staging.exists():
+            shutil.rmtree(staging, ignore_errors=True)
+
+    prune_cache(cache_dir, max_bytes)
+
+def prune_cache(cache_dir, max_bytes):
+    """Evict least recently used cache entries until the cache fits max_bytes."""
+    entries = []
+    for entry in Path(cache_dir).iterdir():
+        manifest_path = entry / "manifest.json"
+        if entry.name.startswith(".") or not manifest_path.is_file():
+            continue
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                size = json.load(f).get("size", 0)
+            entries.append((manifest_path.stat().st_mtime, size, entry))
+        except (OSError, ValueError):
+            continue
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries, key=lambda e: e[0]):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+
+def classify_gw_sh_line(line):
+    """Return the implementation phase a gw_sh log line announces, if any."""
+    for phase, _, pattern in GW_SH_PHASES:
+        if pattern.search(line):
+            return phase
+    return None
+
+def stream_gw_sh_output(lines, log, echo, abort_on_error, start):
+    """Log, echo and classify gw_sh output lines as they arrive.
+
+    Returns (phase_times, errors, aborted). Reading stops at the first
+    fatal error when abort_on_error is set.
+    """
+    titles = {phase: title for phase, title, _ in GW_SH_PHASES}
+    phase = None
+    phase_times = [("startup", start)]
+    errors = []
+    for line in lines:
+        log.write(line)
+        line = line.rstrip()
+        
+        new_phase = classify_gw_sh_line(line)
+        if new_phase and new_phase != phase:
+            phase = new_phase
+            phase_times.append((phase, time.time()))
+            if echo:
+                print(f"--- [{phase}] {titles[phase]} ({time.time() - start:.1f}s) ---")
+        if echo:
+            print(line)
+        
+        if GW_SH_FATAL_PATTERN.match(line):
+            errors.append(line)
+            if abort_on_error:
+                return phase_times, errors, True
+    return phase_times, errors, False
+
+@contextmanager
+def cancellable_gw_sh_run(stop):
+    """Register stop() to be called by cancel_gw_sh_runs while the block runs."""
+    with ACTIVE_GW_SH_LOCK:
+        ACTIVE_GW_SH_RUNS.add(stop)
+    try:
+        yield
+    finally:
+        with ACTIVE_GW_SH_LOCK:
+            ACTIVE_GW_SH_RUNS.discard(stop)
+
+def cancel_gw_sh_runs():
+    """Stop every gw_sh run in progress; they fail as cancelled."""
+    with ACTIVE_GW_SH_LOCK:
+        stops = list(ACTIVE_GW_SH_RUNS)
+    for stop in stops:
+        stop("gw_sh run cancelled")
+
+def finish_gw_sh_run(returncode, start, phase_times, errors, aborted, stop_reason,
+                     log_path, echo, telemetry):
+    """Record and report the outcome of a gw_sh run; returns its exit code."""
+    end = time.time()
+    if telemetry is not None:
+        children_peak = get_peak_rss_kb(children=True)
+        for (name, phase_start), (_, phase_end) in zip(phase_times, phase_times[1:] + [(None, end)]):
+            telemetry.add_phase(f"gw_sh:{name}", phase_end - phase_start, children_peak)
+    if echo:
+        if aborted:
+            print(f"Aborted gw_sh after {end - start:.1f}s on fatal error: {errors[0].strip()}")
+        elif stop_reason:
+            print(stop_reason)
+        print(f"Full gw_sh log: {log_path}")
+    
+    if aborted or stop_reason:
+        return 1
+    return returncode
+
+def run_gw_sh(gw_sh, tcl_script, impl_dir, log_name="gw_sh.log", timeout=600,
+              abort_on_error=True, echo=True, telemetry=None, worker=None):
+    """Run gw_sh on a Tcl script, streaming its output, and return its exit code.
+
+    The complete log is written to impl_dir/log_name and, if echo is set,
+    printed as it arrives. When abort_on_error is set, gw_sh is killed as
+    soon as it reports a fatal error. Time spent in each phase of the run
+    is recorded in telemetry, if given. With a worker (see
+    get_gw_sh_worker), the script runs in the persistent gw_sh session,
+    falling back to a new gw_sh process if the worker cannot be reached.
+    """
+    log_path = Path(impl_dir) / log_name
+    if worker is not None:
+        returncode = run_gw_sh_in_worker(worker, tcl_script, impl_dir, log_path, timeout,
+                                         abort_on_error, echo, telemetry)
+        if returncode is not None:
+            return returncode
+        print("Warning: gw_sh worker unavailable, running gw_sh directly")
+    
+    start = time.time()
+    stop_reasons = []
+    with open(log_path, "w", encoding="utf-8") as log:
+        proc = subprocess.Popen(
+            [str(gw_sh), str(tcl_script)],
+            cwd=str(impl_dir),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            errors="replace",
+            bufsize=1,
+            **get_process_group_args()
+        )
+        def stop(reason):
+            stop_reasons.append(reason)
+            kill_process_tree(proc)
+        
+        timer = threading.Timer(timeout, stop, [f"gw_sh timed out after {timeout}s"])
+        timer.start()
+        try:
+            with cancellable_gw_sh_run(stop):
+                phase_times, errors, aborted = stream_gw_sh_output(
+                    proc.stdout, log, echo, abort_on_error, start)
+                if aborted:
+                    kill_process_tree(proc)
+                proc.wait()
+        finally:
+            timer.cancel()
+            proc.stdout.close()
+    
+    return finish_gw_sh_run(proc.returncode, start, phase_times, errors, aborted,
+                            stop_reasons[0] if stop_reasons else None, log_path, echo, telemetry)
+
+def get_gw_sh_worker_dir(env):
+    """Directory holding the state files of persistent gw_sh workers."""
+    return Path(os.path.dirname(env.PioPlatform().get_dir())) / ".cache" / "gw_sh_worker"
+
+def read_gw_sh_worker_state(state_path):
+    """Connection details written by a running gw_sh worker, if any."""
+    try:
+        with open(state_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def ping_gw_sh_worker(state, timeout):
+    """Health check: the worker answers and its gw_sh session evaluates commands."""
+    try:
+        with socket.create_connection(("127.0.0.1", state["port"]), timeout=timeout) as sock:
+            sock.sendall(json.dumps({"token": state["token"], "cmd": "ping"}).encode("utf-8") + b"\n")
+            with sock.makefile("r", encoding="utf-8") as reader:
+                return reader.readline().strip() == "ok"
+    except (OSError, KeyError, TypeError):
+        return False
+
+def get_gw_sh_worker(env, gw_sh):
+    """Connection details of a healthy gw_sh worker for gw_sh, starting one if needed.
+
+    Returns None if no worker could be started.
+    """
+    worker_dir = get_gw_sh_worker_dir(env)
+    worker_dir.mkdir(parents=True, exist_ok=True)
+    state_path = worker_dir / f"{hashlib.sha256(str(gw_sh).encode('utf-8')).hexdigest()[:16]}.json"
+    
+    # The first ping of a new session waits for gw_sh to start up
+    state = read_gw_sh_worker_state(state_path)
+    if state and ping_gw_sh_worker(state, 180):
+        return state
+    
+    if state:
+        # Unresponsive worker: stop it and start over
+        try:
+            os.kill(state["pid"], signal.SIGTERM)
+        except (OSError, KeyError, TypeError):
+            pass
+        try:
+            state_path.unlink()
+        except OSError:
+            pass
+    
+    print("Starting persistent gw_sh worker...")
+    idle_timeout = env.BoardConfig().get("build.fpga_gw_sh_worker_idle", "1800")
+    worker_script = Path(env.PioPlatform().get_dir()) / "builder" / "gw_sh_worker.py"
+    with open(worker_dir / "worker.log", "a") as log:
+        subprocess.Popen(
+            [sys.executable, str(worker_script), "--gw-sh", str(gw_sh),
+             "--state", str(state_path), "--idle-timeout", str(idle_timeout)],
+            stdin=subprocess.DEVNULL,
+            stdout=log,
+            stderr=log,
+            close_fds=True,
+            **get_process_group_args(detached=True)
+        )
+    
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        state = read_gw_sh_worker_state(state_path)
+        if state:
+            break
+        time.sleep(0.1)
+    if state and ping_gw_sh_worker(state, 180):
+        return state
+    
+    print("Warning: Could not start persistent gw_sh worker")
+    return None
+
+def get_script_stage_outputs(script, impl_dir):
+    """(directory, pattern) of the primary output of each stage a Tcl script runs."""
+    stages = []
+    for run in re.findall(r"^\s*run\s+(\w+)", script, re.M):
+        stages.extend(BUILD_STAGES if run == "all" else [run])
+    return [(Path(impl_dir) / BUILD_STAGES[stage]["outputs"][0], BUILD_STAGES[stage]["primary"])
+            for stage in dict.fromkeys(stages) if stage in BUILD_STAGES]
+
+def run_gw_sh_in_worker(worker, tcl_script, impl_dir, log_path, timeout, abort_on_error,
+                        echo, telemetry):
+    """Run a Tcl script in the persistent gw_sh worker.
+
+    Returns the exit code, or None if the worker could not be reached or
+    did not take the request. Once it has the script, the build may have
+    started, so any later failure is reported as a failed build.
+    """
+    # The session must stay open after the script, so drop its final exit
+    with open(tcl_script, "r") as f:
+        script = "".join(line for line in f if line.strip() != "exit")
+    
+    request = {"token": worker["token"], "cmd": "run",
+               "cwd": str(Path(impl_dir).resolve()), "script": script}
+    # The worker's exit code only says the script raised no Tcl error, and
+    # a stage can fail without one, so stale outputs of the stages it runs
+    # are removed and must have been written again
+    expected_outputs = get_script_stage_outputs(script, impl_dir)
+    for directory, pattern in expected_outputs:
+        for path in directory.glob(pattern):
+            try:
+                path.unlink()
+            except OSError:
+                pass
+    try:
+        sock = socket.create_connection(("127.0.0.1", worker["port"]), timeout=10)
+    except OSError:
+        return None
+    try:
+        sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        # Blocking reads; the timer below bounds the whole run
+        sock.settimeout(None)
+    except OSError:
+        sock.close()
+        return None
+    
+    start = time.time()
+    result = {"returncode": None}
+    phase_times, errors, aborted = [("startup", start)], [], False
+    connection_error = None
+    stop_reasons = []
+    def stop(reason):
+        stop_reasons.append(reason)
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    
+    def read_lines(reader):
+        for line in reader:
+            if line.startswith(GW_SH_WORKER_DONE):
+                result["returncode"] = int(line.split()[1])
+                return
+            yield line
+    
+    timer = threading.Timer(timeout, stop, [f"gw_sh timed out after {timeout}s"])
+    timer.start()
+    try:
+        with cancellable_gw_sh_run(stop), sock, open(log_path, "w", encoding="utf-8") as log:
+            with sock.makefile("r", encoding="utf-8", errors="replace") as reader:
+                phase_times, errors, aborted = stream_gw_sh_output(
+                    read_lines(reader), log, echo, abort_on_error, start)
+        # Closing the connection mid-run makes the worker kill its session
+    except OSError as e:
+        connection_error = e
+    finally:
+        timer.cancel()
+    
+    returncode = result["returncode"]
+    stop_reason = stop_reasons[0] if stop_reasons else None
+    if returncode is None and not (aborted or stop_reason):
+        detail = f": {connection_error}" if connection_error else ""
+        print(f"Error: Lost connection to gw_sh worker{detail}")
+        returncode = 1
+    missing = [f"{directory.name}/{pattern}" for directory, pattern in expected_outputs
+               if not list(directory.glob(pattern))]
+    if returncode == 0 and missing:
+        print(f"Error: gw_sh reported success but wrote no {', '.join(missing)}")
+        returncode = 1
+    return finish_gw_sh_run(returncode, start, phase_times, errors, aborted,
+                            stop_reason, log_path, echo, telemetry)
+
+def send_remote_message(remote, header, payload=b""):
+    """Send one message to a remote build worker."""
+    if payload:
+        header = dict(header, size=len(payload))
+    remote["wfile"].write(json.dumps(header).encode("utf-8") + b"\n")
+    if payload:
+        remote["wfile"].write(payload)
+    remote["wfile"].flush()
+
+def read_remote_message(remote):
+    """Next message header from a remote build worker."""
+    line = remote["rfile"].readline()
+    if not line:
+        raise ConnectionError("remote worker closed the connection")
+    return json.loads(line.decode("utf-8"))
+
+def read_remote_payload(remote, size):
+    data = remote["rfile"].read(size)
+    if len(data) != size:
+        raise ConnectionError("remote worker closed the connection")
+    return data
+
+def close_remote_worker(remote):
+    """Close the connection; a build still running on the worker is killed."""
+    for stream in ("wfile", "rfile"):
+        try:
+            remote[stream].close()
+        except (OSError, ValueError):
+            pass
+    if remote.get("sock"):
+        try:
+            remote["sock"].shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        remote["sock"].close()
+    if remote.get("proc"):
+        try:
+            remote["proc"].terminate()
+        except OSError:
+            pass
+
+def get_remote_worker_command(env, host):
+    """ssh command starting gw_sh_remote_worker.py on host in stdio mode.
+
+    The worker script and the fpga_common module it imports are sent along
+    with the command, so nothing has to be installed on the build host
+    besides Python and the Gowin toolchain.
+    """
+    board = env.BoardConfig()
+    builder_dir = Path(env.PioPlatform().get_dir()) / "builder"
+    def pack(name):
+        code = base64.b64encode(zlib.compress((builder_dir / name).read_bytes())).decode("ascii")
+        return f"zlib.decompress(base64.b64decode('{code}'))"
+    bootstrap = ("import base64,sys,types,zlib;"
+                 "m=types.ModuleType('fpga_common');"
+                 f"exec({pack('fpga_common.py')},m.__dict__);"
+                 "sys.modules['fpga_common']=m;"
+                 f"exec({pack('gw_sh_remote_worker.py')})")
+    remote_args = ["--stdio"]
+    if board.get("build.fpga_remote_gowin_path", ""):
+        remote_args += ["--gowin-home", board.get("build.fpga_remote_gowin_path")]
+    if board.get("build.fpga_remote_jobs", ""):
+        remote_args += ["--jobs", str(board.get("build.fpga_remote_jobs"))]
+
+    ssh = ["ssh", "-o", "BatchMode=yes"]
+    if ":" in host:
+        host, port = host.rsplit(":", 1)
+        ssh += ["-p", port]
+    python = board.get("build.fpga_remote_python", "python3")
+    return ssh + [host, " ".join(shlex.quote(arg) for arg in [python, "-c", bootstrap] + remote_args)]
+
+def connect_remote_worker(env):
+    """Connect to the board_build.fpga_remote worker and check its toolchain.
+
+    Accepts tcp://host[:port] for a worker started with --listen, and
+    ssh://[user@]host[:port] to start a worker over SSH. Returns the
+    connection, with the remote toolchain version, or None on failure.
+    """
+    url = env.BoardConfig().get("build.fpga_remote", "")
+    scheme, _, address = url.partition("://")
+    remote = {"url": url}
+    try:
+        if scheme == "tcp":
+            host, _, port = address.rpartition(":") if ":" in address else (address, "", "")
+            sock = socket.create_connection((host, int(port or REMOTE_DEFAULT_PORT)), timeout=30)
+            # Blocking reads; builds are bounded by their own timer
+            sock.settimeout(None)
+            remote.update(sock=sock, rfile=sock.makefile("rb"), wfile=sock.makefile("wb"))
+        elif scheme == "ssh":
+            proc = subprocess.Popen(get_remote_worker_command(env, address),
+                                    stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            remote.update(proc=proc, rfile=proc.stdout, wfile=proc.stdin)
+        else:
+            print(f"Error: Unsupported board_build.fpga_remote '{url}' "
+                  "(use tcp://host:port or ssh://user@host)")
+            return None
+
+        token = env.BoardConfig().get("build.fpga_remote_token", os.environ.get("GOWIN_REMOTE_TOKEN", ""))
+        send_remote_message(remote, {"op": "hello", "version": REMOTE_PROTOCOL_VERSION, "token": token})
+        reply = read_remote_message(remote)
+    except (OSError, ValueError, ConnectionError) as e:
+        print(f"Error: Could not connect to remote worker {url}: {e}")
+        close_remote_worker(remote)
+        return None
+    if not reply.get("ok"):
+        print(f"Error: Remote worker {url} refused the build: {reply.get('error')}")
+        close_remote_worker(remote)
+        return None
+    remote["version"] = reply["toolchain_version"]
+    return remote
+
+def collect_remote_bundle(gprj_path, project_dir):
+    """Files of a remote build as {bundle path: local path}, and the bundled .gprj.
+
+    Project files keep their place relative to the project directory, so
+    relative includes still resolve; files outside it go to external/.
+    Returns (files, gprj bundle path, gprj contents).
+    """
+    gprj_path = Path(gprj_path)
+    project_dir = Path(project_dir).resolve()
+
+    def bundle_path(path):
+        try:
+            return "project/" + path.relative_to(project_dir).as_posix()
+        except ValueError:
+            return f"external/{len(files)}/{path.name}"
+
+    files = {}
+    gprj_bundle = bundle_path(gprj_path.resolve())
+    tree = ET.parse(gprj_path)
+    filelist = tree.getroot().find("FileList")
+    if filelist is not None:
+        for file_elem in filelist.findall("File"):
+            local = (gprj_path.parent / file_elem.get("path", "")).resolve()
+            if not local.is_file():
+                continue
+            path = bundle_path(local)
+            files[path] = local
+            file_elem.set("path", Path(os.path.relpath(path, os.path.dirname(gprj_bundle))).as_posix())
+    return files, gprj_bundle, ET.tostring(tree.getroot(), encoding="utf-8", xml_declaration=True)
+
+def upload_remote_bundle(remote, files, gprj_bundle, gprj_data):
+    """Send the blobs the worker does not have yet; returns {bundle path: sha256}."""
+    blobs = {}
+    manifest = {}
+    for path, local in files.items():
+        data = Path(local).read_bytes()
+        digest = hashlib.sha256(data).hexdigest()
+        blobs[digest] = data
+        manifest[path] = digest
+    digest = hashlib.sha256(gprj_data).hexdigest()
+    blobs[digest] = gprj_data
+    manifest[gprj_bundle] = digest
+
+    send_remote_message(remote, {"op": "have", "blobs": sorted(blobs)})
+    missing = read_remote_message(remote)["missing"]
+    for digest in missing:
+        send_remote_message(remote, {"op": "blob", "sha256": digest}, blobs[digest])
+    print(f"  Uploaded {len(missing)} of {len(blobs)} file(s) "
+          f"({sum(len(blobs[digest]) for digest in missing) / 1024:.1f} KB)")
+    return manifest
+
+def run_gw_sh_remote(remote, gprj_path, project_dir, tcl_text, impl_dir, log_name="gw_sh.log",
+                     timeout=600, abort_on_error=True, echo=True, telemetry=None, worker=None):
+    """Run a Tcl script on a remote build worker and fetch its outputs into impl_dir.
+
+    Takes the same options as run_gw_sh, except that a local gw_sh worker
+    does not apply. The log streams back as gw_sh writes it; pnr/ and
+    gwsynthesis/ are replaced by the remote results.
+    """
+    log_path = Path(impl_dir) / log_name
+    upload_start = time.time()
+    try:
+        files, gprj_bundle, gprj_data = collect_remote_bundle(gprj_path, project_dir)
+        manifest = upload_remote_bundle(remote, files, gprj_bundle, gprj_data)
+    except (OSError, ValueError, KeyError, ConnectionError) as e:
+        print(f"Error: Could not upload the project to {remote['url']}: {e}")
+        return 1
+    if telemetry is not None:
+        telemetry.add_phase("remote:upload", time.time() - upload_start)
+
+    start = time.time()
+    result = {"done": None}
+    stop_reasons = []
+    def stop(reason):
+        stop_reasons.append(reason)
+        close_remote_worker(remote)
+
+    def read_lines():
+        while True:
+            message = read_remote_message(remote)
+            event = message.get("event")
+            if event == "queued":
+                print(f"  Waiting for one of the {message.get('slots')} gw_sh slot(s) on the worker...")
+                result["queued"] = time.time()
+            elif event == "log":
+                if "queued" in result:
+                    if telemetry is not None:
+                        telemetry.add_phase("remote:queue", time.time() - result.pop("queued"))
+                yield message["line"] + "\n"
+            elif event == "done":
+                result["done"] = message
+                return
+
+    timer = threading.Timer(timeout + REMOTE_TIMEOUT_GRACE, stop,
+                            [f"Remote worker did not finish within {timeout}s"])
+    timer.start()
+    try:
+        with cancellable_gw_sh_run(stop), open(log_path, "w", encoding="utf-8") as log:
+            send_remote_message(remote, {"op": "build", "files": manifest, "gprj": gprj_bundle,
+                                         "tcl": tcl_text, "timeout": timeout,
+                                         "abort_on_error": abort_on_error})
+            phase_times, errors, aborted = stream_gw_sh_output(
+                read_lines(), log, echo, abort_on_error, start)
+            if aborted:
+                # Closing the connection makes the worker kill gw_sh
+                close_remote_worker(remote)
+            done = result["done"]
+            if done and done.get("error"):
+                print(f"Error: Remote worker: {done['error']}")
+            elif done:
+                download_start = time.time()
+                for name in CACHED_OUTPUT_DIRS:
+                    shutil.rmtree(Path(impl_dir) / name, ignore_errors=True)
+                for entry in done["files"]:
+                    data = read_remote_payload(remote, entry["size"])
+                    path = Path(entry["path"])
+                    if path.is_absolute() or ".." in path.parts or path.parts[0] not in CACHED_OUTPUT_DIRS:
+                        continue
+                    dest = Path(impl_dir) / path
+                    dest.parent.mkdir(parents=True, exist_ok=True)
+                    dest.write_bytes(data)
+                if telemetry is not None:
+                    telemetry.add_phase("remote:download", time.time() - download_start)
+    except (OSError, ValueError, ConnectionError) as e:
+        if not stop_reasons:
+            print(f"Error: Lost connection to remote worker {remote['url']}: {e}")
+            return 1
+        phase_times, errors, aborted = [("startup", start)], [], False
+    finally:
+        timer.cancel()
+
+    done = result["done"]
+    returncode = done["returncode"] if done and not done.get("error") else 1
+    return finish_gw_sh_run(returncode, start, phase_times, errors, aborted,
+                            stop_reasons[0] if stop_reasons else None, log_path, echo, telemetry)
+
+def get_gw_sh_run_options(env, gw_sh):
+    """Keyword arguments for run_gw_sh taken from the board options."""
+    board = env.BoardConfig()
+    try:
+        timeout = int(board.get("build.fpga_build_timeout", "600"))
+    except (TypeError, ValueError):
+        timeout = 600
+    options = {
+        "timeout": timeout,
+        "abort_on_error": board.get("build.fpga_abort_on_error", "1") in TRUE_VALUES,
+        "telemetry": env.get("FPGA_TELEMETRY"),
+        "worker": None,
+    }
+    if gw_sh is not None and board.get("build.fpga_gw_sh_worker", "0") in TRUE_VALUES:
+        options["worker"] = get_gw_sh_worker(env, gw_sh)
+    return options
+
+def run_build_stage(stage, key, gw_sh, gprj_path, options, impl_dir, max_bytes, run_options):
+    """Run one build stage, reusing its cached outputs when key matches."""
+    info = BUILD_STAGES[stage]
+    cache_dir = get_stage_cache_dir(impl_dir, stage)
+    if key and restore_cached_outputs(cache_dir, key, impl_dir):
+        print(f"✓ {info['title'].capitalize()} inputs unchanged, reusing cached outputs ({key[:12]})")
+        return 0
+    
+    print(f"Starting FPGA {info['title']}...")
+    tcl_script = Path(impl_dir) / f"{stage}_script.tcl"
+    with open(tcl_script, 'w') as f:
+        f.write(generate_tcl_script(gprj_path, options, stage))
+    
+    returncode = run_gw_sh(gw_sh, tcl_script, impl_dir, f"gw_sh_{stage}.log", **run_options)
+    if returncode != 0:
+        return returncode
+    
+    outputs = []
+    for dirname in info["outputs"]:
+        outputs.extend(sorted((Path(impl_dir) / dirname).glob(info["primary"])))
+    if key and outputs:
+        files = collect_impl_outputs(impl_dir, info["outputs"])
+        store_cached_outputs(cache_dir, key, impl_dir, files, outputs[0], max_bytes)
+    return 0
+
+def run_staged_build(gw_sh, gprj_path, options, impl_dir, project_inputs, device,
+                     toolchain_version, max_bytes, run_options):
+    """Run synthesis and place & route as separately cached gw_sh stages."""
+    syn_key = compute_stage_key("syn", project_inputs, options, device, toolchain_version)
+    returncode = run_build_stage("syn", syn_key, gw_sh, gprj_path, options, impl_dir,
+                                 max_bytes, run_options)
+    if returncode != 0:
+        return returncode
+    
+    # Place & route is keyed on the netlist, so HDL edits that synthesize
+    # to the same netlist (comments, formatting) still skip it
+    netlist_digest = hash_netlist(impl_dir)
+    pnr_key = None
+    if netlist_digest:
+        pnr_key = compute_stage_key("pnr", project_inputs, options, device,
+                                    toolchain_version, netlist_digest)
+    else:
+        print("Warning: No synthesized netlist found, place & route will not be cached")
+    return run_build_stage("pnr", pnr_key, gw_sh, gprj_path, options, impl_dir,
+                           max_bytes, run_options)
+
+def parse_ooc_modules(value):
+    """Module names from board_build.fpga_ooc_modules (space or comma separated)."""
+    return [name for name in re.split(r"[\s,]+", value) if name]
+
+def synthesize_ooc_module(module, files, gw_sh, gprj_path, ooc_dir, cache_dir, device,
+                          toolchain_version, max_bytes, run_options):
+    """Synthesize one module on its own, reusing its cached netlist if its sources are unchanged.
+
+    Returns (netlist path or None on failure, whether it came from the cache).
+    """
+    module_dir = Path(ooc_dir) / module
+    module_impl = module_dir / "impl"
+    module_impl.mkdir(parents=True, exist_ok=True)
+    module_gprj = module_dir / f"{module}.gprj"
+    module_sources = {
+        "verilog": [f for f in files if not str(f).lower().endswith((".vhd", ".vhdl"))],
+        "vhdl": [f for f in files if str(f).lower().endswith((".vhd", ".vhdl"))],
+        "constraints": [],
+    }
+    write_variant_gprj(gprj_path, module_gprj, module_sources, module)
+    
+    options = {"top_module": module, "disable_insert_pad": "1"}
+    key = hash_parts(["ooc", compute_stage_key("syn", read_project_inputs(module_gprj), options,
+                                               device, toolchain_version)])
+    netlist = restore_cached_outputs(cache_dir, key, module_impl)
+    if netlist:
+        return netlist, True
+    
+    shutil.rmtree(module_impl / "gwsynthesis", ignore_errors=True)
+    tcl_script = module_impl / "syn_script.tcl"
+    with open(tcl_script, 'w') as f:
+        f.write(generate_tcl_script(module_gprj, options, "syn"))
+    # Modules are synthesized concurrently, so they cannot share the worker session
+    run_options = dict(run_options, echo=False, telemetry=None, worker=None)
+    returncode = run_gw_sh(gw_sh, tcl_script, module_impl, "gw_sh_syn.log", **run_options)
+    netlists = sorted((module_impl / "gwsynthesis").glob("*.vg"))
+    if returncode != 0 or not netlists:
+        return None, False
+    store_cached_outputs(cache_dir, key, module_impl,
+                         collect_impl_outputs(module_impl, ["gwsynthesis"]), netlists[0], max_bytes)
+    return netlists[0], False
+
+def link_ooc_netlists(env, modules, netlists, sources, top_files, graph_dir, link_dir):
+    """Copy the module netlists into link_dir, defining every module only once.
+
+    A netlist also defines the submodules it keeps, so a leaf used by the
+    top level and a module, or by two modules, would be defined twice.
+    Each copy leaves out what the top-level sources, the other listed
+    modules or an earlier copy already define. Returns the copies' paths.
+    """
+    link_dir.mkdir(parents=True, exist_ok=True)
+    defined = env["FPGA_DEFINED_UNITS"](sources, top_files, graph_dir)
+    listed = {module.lower() for module in modules}
+    links = []
+    for module in modules:
+        text = Path(netlists[module]).read_text(encoding="utf-8", errors="replace")
+        text, kept = env["FPGA_STRIP_NETLIST_MODULES"](text, (defined | listed) - {module.lower()})
+        defined |= kept
+        link = link_dir / f"{module}.vg"
+        data = text.encode("utf-8")
+        # Unchanged copies keep their timestamps
+        if not link.exists() or link.read_bytes() != data:
+            write_atomic(link, data)
+        links.append(link)
+    return links
+
+def run_ooc_synthesis(env, modules, gw_sh, gprj_path, sources, fpga_dir, impl_dir, device,
+                      toolchain_version, max_bytes, run_options):
+    """Synthesize modules out of context and write a top-level project linking their netlists.
+
+    Each module is built from the files it needs, in parallel and cached
+    by their contents, so only edited modules are synthesized again. The
+    top level is built in impl_dir/ooc/top from its remaining sources and
+    the module netlists. Returns (gprj path, impl dir) of that build, or
+    None if a module could not be synthesized.
+    """
+    top_module = env.BoardConfig().get("build.fpga_top_module", "top")
+    graph_dir = Path(fpga_dir) / "impl"
+    try:
+        top_files = env["FPGA_MODULE_SOURCES"](sources, top_module, graph_dir, exclude=modules)
+        module_files = {module: env["FPGA_MODULE_SOURCES"](sources, module, graph_dir)
+                        for module in modules}
+    except ValueError as e:
+        print(f"Error: Cannot synthesize out of context: {e}")
+        return None
+    missing = [name for name, files in [(top_module, top_files)] + list(module_files.items())
+               if files is None]
+    if missing:
+        print(f"Error: No source in fpga/src defines {', '.join(missing)} "
+              "(board_build.fpga_ooc_modules)")
+        return None
+    
+    ooc_dir = Path(impl_dir) / "ooc"
+    cache_dir = get_stage_cache_dir(impl_dir, "ooc")
+    jobs = min(get_parallel_jobs(env, "build.fpga_ooc_jobs"), len(modules))
+    print(f"Synthesizing {len(modules)} module(s) out of context ({jobs} parallel job(s))...")
+    netlists = {}
+    # Each worker only waits on its own gw_sh process, so threads are enough
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(synthesize_ooc_module, module, module_files[module], gw_sh,
+                               gprj_path, ooc_dir, cache_dir, device, toolchain_version,
+                               max_bytes, run_options): (module, time.time())
+                   for module in modules}
+        for future in as_completed(futures):
+            module, start = futures[future]
+            netlist, cached = future.result()
+            netlists[module] = netlist
+            if netlist is None:
+                print(f"  {module}: synthesis failed, see {ooc_dir / module / 'impl' / 'gw_sh_syn.log'}")
+            elif cached:
+                print(f"  {module}: unchanged, using cached netlist")
+            else:
+                print(f"  {module}: synthesized ({time.time() - start:.1f}s)")
+    if None in netlists.values():
+        return None
+    
+    # The netlists stand in for the modules' sources in the top-level project
+    top_dir = ooc_dir / "top"
+    linked_netlists = link_ooc_netlists(env, modules, netlists, sources, top_files,
+                                        graph_dir, top_dir / "netlists")
+    top_gprj = top_dir / Path(gprj_path).name
+    top_sources = {
+        "verilog": [f for f in top_files if f in sources["verilog"]] + linked_netlists,
+        "vhdl": [f for f in top_files if f in sources["vhdl"]],
+        "constraints": sources["constraints"],
+    }
+    write_variant_gprj(gprj_path, top_gprj, top_sources, top_module)
+    return top_gprj, top_dir / "impl"
+
+def parse_timing_report(pnr_dir):
+    """Extract worst slack (ns) and per-clock Fmax (MHz) from gw_sh timing reports."""
+    timing = {"worst_slack": None, "fmax": {}}
+    slacks = []
+    for pattern in ("*.tr.html", "*.timing_paths"):
+        for report in sorted(Path(pnr_dir).glob(pattern)):
+            try:
+                text = report.read_text(encoding="utf-8", errors="replace")
+            except OSError:
+                continue
+            for clock, _, actual in FMAX_PATTERN.findall(text):
+                timing["fmax"][clock] = float(actual)
+            slacks.extend(float(value) for value in SLACK_PATTERN.findall(text))
+    if slacks:
+        timing["worst_slack"] = min(slacks)
+    return timing
+
+def parse_explore_strategies(value):
+    """Parse exploration strategies, one per line (or "|"-separated).
+
+    Each strategy is a list of name=value gw_sh options, e.g.
+    "place_option=1 route_option=2".
+    """
+    strategies = []
+    for chunk in re.split(r"[\n|]", value):
+        strategy = {}
+        for name, option_value in re.findall(r"-?(\w+)\s*=\s*([^\s,]+)", chunk):
+            strategy[name] = option_value
+        if strategy:
+            strategies.append(strategy)
+    return strategies
+
+def explore_score(timing, metric):
+    """Sort key for exploration results; higher is better."""
+    fmax = min(timing["fmax"].values()) if timing["fmax"] else None
+    if metric == "fmax":
+        order = (fmax, timing["worst_slack"])
+    else:
+        order = (timing["worst_slack"], fmax)
+    return tuple(float("-inf") if value is None else value for value in order)
+
+def get_explore_jobs(env):
+    """Number of concurrent exploration runs (board_build.fpga_explore_jobs or -j)."""
+    return get_parallel_jobs(env, "build.fpga_explore_jobs")
+
+def get_parallel_jobs(env, option):
+    """Number of concurrent gw_sh runs from a board option, else -j."""
+    jobs = env.BoardConfig().get(option, "")
+    if not jobs:
+        try:
+            # PlatformIO passes its "jobs" setting on to SCons as -j
+            jobs = env.GetOption("num_jobs")
+        except (AttributeError, KeyError):
+            jobs = os.cpu_count()
+    try:
+        return max(1, int(jobs))
+    except (TypeError, ValueError):
+        return 1
+
+def read_relocated_gprj(gprj_path):
+    """Root element of a .gprj with its file list made absolute, for a copy elsewhere."""
+    gprj_path = Path(gprj_path)
+    root = ET.parse(gprj_path).getroot()
+    filelist = root.find("FileList")
+    if filelist is not None:
+        for file_elem in filelist.findall("File"):
+            path = Path(file_elem.get("path", ""))
+            if not path.is_absolute():
+                file_elem.set("path", (gprj_path.parent / path).resolve().as_posix())
+    return root
+
+def write_gprj_copy(dest, root):
+    """Write a generated .gprj, atomically and only if its contents changed.
+
+    Returns True if the file was written. An unchanged copy keeps its
+    mtime, so gw_sh and SCons do not see a new project.
+    """
+    data = ET.tostring(root, encoding="utf-8", xml_declaration=True)
+    try:
+        if Path(dest).read_bytes() == data:
+            return False
+    except OSError:
+        pass
+    write_atomic(dest, data)
+    return True
+
+def write_relocated_gprj(gprj_path, dest):
+    """Copy a .gprj to dest with its file list made absolute."""
+    write_gprj_copy(dest, read_relocated_gprj(gprj_path))
+
+def run_explore_pnr(index, strategy, gw_sh, gprj_path, options, impl_dir, run_options):
+    """Run place & route for one strategy in its own copy of the project."""
+    run_dir = Path(impl_dir) / "explore" / f"run_{index}"
+    if run_dir.exists():
+        shutil.rmtree(run_dir)
+    run_impl = run_dir / "impl"
+    run_impl.mkdir(parents=True)
+    run_gprj = run_dir / Path(gprj_path).name
+    write_relocated_gprj(gprj_path, run_gprj)
+    
+    # Every run starts from the shared synthesis result
+    shutil.copytree(Path(impl_dir) / "gwsynthesis", run_impl / "gwsynthesis")
+    
+    tcl_script = run_impl / "pnr_script.tcl"
+    with open(tcl_script, 'w') as f:
+        f.write(generate_tcl_script(run_gprj, options, "pnr", strategy))
+    
+    start = time.time()
+    # Runs are concurrent, so they cannot share the single worker session
+    run_options = dict(run_options, echo=False, telemetry=None, worker=None)
+    returncode = run_gw_sh(gw_sh, tcl_script, run_impl, "gw_sh_pnr.log", **run_options)
+    result = {
+        "index": index,
+        "strategy": strategy,
+        "returncode": returncode,
+        "seconds": round(time.time() - start, 3),
+        "impl_dir": str(run_impl),
+        "timing": None,
+    }
+    if returncode == 0 and list((run_impl / "pnr").glob("*.bin")):
+        result["timing"] = parse_timing_report(run_impl / "pnr")
+    return result
+
+def run_explore_build(gw_sh, gprj_path, options, impl_dir, project_inputs, device,
+                      toolchain_version, max_bytes, run_options, strategies, jobs, metric):
+    """Synthesize once, then run place & route strategies concurrently and keep the best."""
+    syn_key = compute_stage_key("syn", project_inputs, options, device, toolchain_version)
+    returncode = run_build_stage("syn", syn_key, gw_sh, gprj_path, options, impl_dir,
+                                 max_bytes, run_options)
+    if returncode != 0:
+        return returncode
+    if not (Path(impl_dir) / "gwsynthesis").is_dir():
+        print("Error: No synthesis results found for place & route exploration")
+        return 1
+    
+    jobs = min(jobs, len(strategies))
+    print(f"Exploring {len(strategies)} place & route strategies ({jobs} parallel job(s))...")
+    results = []
+    # Each worker only waits on its own gw_sh process, so threads are enough
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(run_explore_pnr, index, strategy, gw_sh, gprj_path,
+                               options, impl_dir, run_options)
+                   for index, strategy in enumerate(strategies)]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            label = " ".join(f"{k}={v}" for k, v in result["strategy"].items())
+            timing = result["timing"]
+            if timing is None:
+                print(f"  run_{result['index']} [{label}]: failed (exit code {result['returncode']})")
+            else:
+                fmax = min(timing["fmax"].values()) if timing["fmax"] else None
+                print(f"  run_{result['index']} [{label}]: worst slack {timing['worst_slack']} ns, "
+                      f"Fmax {fmax} MHz ({result['seconds']:.1f}s)")
+    
+    results.sort(key=lambda r: r["index"])
+    with open(Path(impl_dir) / "explore" / "summary.json", "w", encoding="utf-8") as f:
+        json.dump({"metric": metric, "runs": results}, f, indent=2)
+    
+    successful = [r for r in results if r["timing"] is not None]
+    if not successful:
+        print("Error: All place & route strategies failed")
+        return 1
+    
+    # Promote the best run's results to the regular pnr directory
+    best = max(successful, key=lambda r: explore_score(r["timing"], metric))
+    pnr_dir = Path(impl_dir) / "pnr"
+    if pnr_dir.exists():
+        shutil.rmtree(pnr_dir)
+    shutil.copytree(Path(best["impl_dir"]) / "pnr", pnr_dir)
+    label = " ".join(f"{k}={v}" for k, v in best["strategy"].items())
+    print(f"✓ Best strategy: run_{best['index']} [{label}]")
+    return 0
+
+def parse_fpga_variants(value):
+    """Parse multi-boot variants, one per line (or "|"-separated).
+
+    Each variant is a name followed by name=value settings: its flash
+    "address" (required) and any build option, e.g.
+    "selftest address=0x200000 top_module=selftest use_sspi_as_gpio=1".
+    Raises ValueError for an invalid variant list.
+    """
+    variants = []
+    for line in re.split(r"[\n|]", value):
+        line = line.strip()
+        if not line:
+            continue
+        name, _, settings = line.partition(" ")
+        options = dict(re.findall(r"(\w+)\s*=\s*([^\s,]+)", settings))
+        if "=" in name or not re.match(r"^[\w.-]+$", name):
+            raise ValueError(f"Variant needs a name before its settings: {line}")
+        if "address" not in options:
+            raise ValueError(f"Variant '{name}' has no flash address")
+        address = int(options.pop("address"), 0)
+        if address % VARIANT_ADDRESS_ALIGNMENT:
+            raise ValueError(f"Variant '{name}' address 0x{address:X} is not aligned "
+                             f"to a 0x{VARIANT_ADDRESS_ALIGNMENT:X} flash sector")
+        variants.append({"name": name, "address": address, "options": options})
+    
+    names = [variant["name"] for variant in variants]
+    addresses = [variant["address"] for variant in variants]
+    if len(set(names)) != len(names) or len(set(addresses)) != len(addresses):
+        raise ValueError("Variant names and flash addresses must be unique")
+    return variants
+
+def get_variant_options(env, variants, variant):
+    """Build options of a variant: the board options with its overrides.
+
+    Unless the variant sets them, multi-boot is enabled and points at the
+    next variant in flash, wrapping around to the first.
+    """
+    options = get_fpga_build_options(env)
+    by_address = sorted(variants, key=lambda v: v["address"])
+    following = by_address[(by_address.index(variant) + 1) % len(by_address)]
+    options["multi_boot"] = "1"
+    options["spi_flash_address"] = f"0x{following['address']:X}"
+    options.update(variant["options"])
+    return options
+
+def write_variant_gprj(gprj_path, dest, sources, top_module):
+    """Copy a .gprj for a variant, listing the sources its top module needs.
+
+    Returns True if dest was written, False if it was already up to date.
+    """
+    root = read_relocated_gprj(gprj_path)
+    filelist = root.find("FileList")
+    if filelist is None:
+        filelist = ET.SubElement(root, "FileList")
+    for file_elem in filelist.findall("File"):
+        if is_managed_gprj_entry(file_elem.get("path", "")):
+            filelist.remove(file_elem)
+    for category, file_type in [("verilog", "file.verilog"), ("vhdl", "file.vhdl"),
+                                ("constraints", "file.cst")]:
+        for source_file in sorted(sources[category]):
+            file_elem = ET.SubElement(filelist, "File")
+            file_elem.set("path", Path(source_file).resolve().as_posix())
+            file_elem.set("type", file_type)
+            file_elem.set("enable", "1")
+    top_elem = root.find("OptionInfo/TopModule")
+    if top_elem is not None:
+        top_elem.set("name", top_module)
+    return write_gprj_copy(dest, root)
+
+def run_variant_build(variant, options, sources, gw_sh, gprj_path, impl_dir, device,
+                      toolchain_version, cache_dir, max_bytes, run_options):
+    """Build one variant in its own directory, reusing its last result if unchanged."""
+    variant_dir = Path(impl_dir) / "variants" / variant["name"]
+    variant_impl = variant_dir / "impl"
+    variant_impl.mkdir(parents=True, exist_ok=True)
+    variant_gprj = variant_dir / Path(gprj_path).name
+    write_variant_gprj(gprj_path, variant_gprj, sources, options["top_module"])
+    
+    tcl_text = generate_tcl_script(variant_gprj, options)
+    tcl_script = variant_impl / "build_script.tcl"
+    with open(tcl_script, "w") as f:
+        f.write(tcl_text)
+    
+    start = time.time()
+    key = compute_bitstream_cache_key(read_project_inputs(variant_gprj), tcl_text, device,
+                                      toolchain_version)
+    result = {
+        "name": variant["name"],
+        "address": variant["address"],
+        "top_module": options["top_module"],
+        "returncode": 0,
+        "result": "reused",
+        "bitstream": None,
+    }
+    
+    # The last build of this variant is kept next to its inputs' fingerprint
+    stamp_path = variant_dir / "variant.json"
+    try:
+        with open(stamp_path, "r", encoding="utf-8") as f:
+            stamp = json.load(f)
+        if stamp.get("key") == key and Path(stamp["bitstream"]).is_file():
+            result["bitstream"] = stamp["bitstream"]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    
+    if result["bitstream"] is None and cache_dir:
+        bitstream = restore_cached_outputs(cache_dir, key, variant_impl)
+        if bitstream:
+            result.update(result="cached", bitstream=str(bitstream))
+    
+    if result["bitstream"] is None:
+        # Variants build concurrently, so they cannot share the worker session
+        run_options = dict(run_options, echo=False, telemetry=None, worker=None)
+        result["returncode"] = run_gw_sh(gw_sh, tcl_script, variant_impl, **run_options)
+        candidates = list((variant_impl / "pnr").glob("*.bin"))
+        if result["returncode"] != 0 or not candidates:
+            result.update(result="failed", returncode=result["returncode"] or 1)
+            result["log"] = str(variant_impl / "gw_sh.log")
+            result["seconds"] = round(time.time() - start, 3)
+            return result
+        result.update(result="built", bitstream=str(candidates[0]))
+        if cache_dir:
+            store_cached_outputs(cache_dir, key, variant_impl,
+                                 collect_impl_outputs(variant_impl, CACHED_OUTPUT_DIRS),
+                                 candidates[0], max_bytes)
+    
+    with open(stamp_path, "w", encoding="utf-8") as f:
+        json.dump({"key": key, "bitstream": result["bitstream"]}, f)
+    result["seconds"] = round(time.time() - start, 3)
+    return result
+
+def run_variants_build(env, variants, sources, impl_dir, gw_sh, gprj_path, device,
+                       toolchain_version, max_bytes, report):
+    """Build all multi-boot variants in parallel and pack them into one flash image."""
+    impl_dir = Path(impl_dir)
+    board = env.BoardConfig()
+    bitstream_address = int(board.get("build.fpga_bitstream_address", "0x100000"), 0)
+    if min(variant["address"] for variant in variants) != bitstream_address:
+        print(f"Error: The first variant must be at the bitstream upload address "
+              f"0x{bitstream_address:X}")
+        return 1
+    
+    cache_dir = None
+    if board.get("build.fpga_cache", "1") in TRUE_VALUES:
+        cache_dir = get_bitstream_cache_dir(env)
+    run_options = get_gw_sh_run_options(env, gw_sh)
+    jobs = min(get_parallel_jobs(env, "build.fpga_variant_jobs"), len(variants))
+    print(f"Building {len(variants)} multi-boot variant(s) ({jobs} parallel job(s))...")
+    
+    results = []
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = []
+        for variant in variants:
+            options = get_variant_options(env, variants, variant)
+            variant_sources = sources
+            if board.get("build.fpga_prune_sources", "0") in TRUE_VALUES:
+                variant_sources = env["FPGA_REACHABLE_SOURCES"](
+                    sources, options["top_module"], impl_dir, verbose=False)
+            futures.append(pool.submit(run_variant_build, variant, options, variant_sources,
+                                       gw_sh, gprj_path, impl_dir, device, toolchain_version,
+                                       cache_dir, max_bytes, run_options))
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if result["result"] == "failed":
+                print(f"  {result['name']}: failed (exit code {result['returncode']}, "
+                      f"log: {result['log']})")
+            else:
+                print(f"  {result['name']} @ 0x{result['address']:X}: {result['result']} "
+                      f"({result['seconds']:.1f}s)")
+    
+    results.sort(key=lambda r: r["address"])
+    report["variants"] = results
+    if any(result["result"] == "failed" for result in results):
+        print("Error: Not all multi-boot variants could be built")
+        return 1
+    
+    build_dir = Path(env.subst("$BUILD_DIR"))
+    build_dir.mkdir(parents=True, exist_ok=True)
+    image_path = build_dir / MULTIBOOT_IMAGE_NAME
+    images = [(result["address"], result["bitstream"]) for result in results]
+    try:
+        env["FPGA_PACK_FLASH_IMAGES"](images, str(image_path), env["FPGA_FLASH_SIZE"](env),
+                                      base=bitstream_address)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+    print(f"✓ Multi-boot image: {image_path}")
+    
+    # Upload writes fpga_bitstream.bin at the first variant's address
+    copy_bitstream_to_build_dir(image_path, env, report)
+    reused = all(result["result"] in ("reused", "cached") for result in results)
+    report["result"] = "cached" if reused else "built"
+    report["bitstream"] = {
+        "size": image_path.stat().st_size,
+        "sha256": hashlib.sha256(image_path.read_bytes()).hexdigest(),
+    }
+    print("=" * 70)
+    print("✓ FPGA Build Complete!")
+    print("=" * 70)
+    return 0
+
+def parse_utilization_report(pnr_dir):
+    """Extract resource usage (used/total per resource) from gw_sh reports."""
+    utilization = {}
+    for report in sorted(Path(pnr_dir).glob("*.rpt.txt")):
+        try:
+            text = report.read_text(encoding="utf-8", errors="replace")
+        except OSError:
+            continue
+        for name, used, total in UTILIZATION_PATTERN.findall(text):
+            utilization[name.strip()] = {"used": int(used), "total": int(total)}
+    return utilization
+
+def get_git_revision(project_dir):
+    """Current git commit of the project, if it is a git checkout."""
+    try:
+        result = subprocess.run(["git", "rev-parse", "HEAD"], cwd=str(project_dir),
+                                capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout.strip() if result.returncode == 0 else None
+
+def write_build_report(env, telemetry, report):
+    """Write the machine-readable build report next to fpga_bitstream.bin."""
+    build_dir = Path(env.subst("$BUILD_DIR"))
+    report = dict(report)
+    report.update({
+        "environment": env.subst("$PIOENV"),
+        "git_revision": get_git_revision(env.get("PROJECT_DIR")),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "total_seconds": telemetry.elapsed(),
+        "peak_rss_kb": get_peak_rss_kb(),
+        "children_peak_rss_kb": get_peak_rss_kb(children=True),
+        "phases": telemetry.phases,
+    })
+    try:
+        build_dir.mkdir(parents=True, exist_ok=True)
+        with open(build_dir / BUILD_REPORT_NAME, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    except OSError as e:
+        print(f"Warning: Could not write build report: {e}")
+
+def start_upload_telemetry(target, source, env):
+    """SCons action marking the start of an upload."""
+    env["FPGA_UPLOAD_START"] = time.time()
+    return 0
+
+def finish_upload_telemetry(target, source, env):
+    """SCons action adding the upload time to the existing build report."""
+    seconds = time.time() - env.get("FPGA_UPLOAD_START", time.time())
+    try:
+        image_bytes = os.path.getsize(str(source[0]))
+    except (IndexError, OSError):
+        image_bytes = None
+    if image_bytes and seconds > 0:
+        print(f"Uploaded {image_bytes / 1024:.1f} KB in {seconds:.1f}s "
+              f"({image_bytes / 1024 / seconds:.1f} KB/s)")
+    report_path = Path(env.subst("$BUILD_DIR")) / BUILD_REPORT_NAME
+    try:
+        with open(report_path, "r", encoding="utf-8") as f:
+            report = json.load(f)
+    except (OSError, ValueError):
+        return 0
+    report.setdefault("phases", []).append({
+        "name": "upload",
+        "protocol": env.subst("$UPLOAD_PROTOCOL"),
+        "seconds": round(seconds, 3),
+        "image_bytes": image_bytes,
+        "compress": env.BoardConfig().get("build.fpga_upload_compress", "auto"),
+        "running_peak_rss_kb": get_peak_rss_kb(),
+        "running_children_peak_rss_kb": get_peak_rss_kb(children=True),
+    })
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    return 0
+
+def trim_bitstream_padding(data):
+    """data without the erased-flash bytes padding its end, kept word aligned.
+
+    Flash that is not written reads as erased, and the FPGA stops reading
+    at the end of the bitstream, so the padding need not be uploaded.
+    """
+    end = len(data)
+    while end and data[end - 1] == ERASED_FLASH_BYTE:
+        end -= 1
+    return data[:min(len(data), (end + 3) // 4 * 4)]
+
+def copy_bitstream_to_build_dir(bitstream, env, report=None):
+    """Copy the bitstream to $BUILD_DIR/fpga_bitstream.bin.
+
+    With board_build.fpga_bitstream_trim, trailing padding is left out of
+    the copy. The upload payload sizes are added to report, if given.
+    """
+    build_dir = Path(env.subst("$BUILD_DIR"))
+    dest = build_dir / "fpga_bitstream.bin"
+    board = env.BoardConfig()
+    with open(bitstream, "rb") as f:
+        data = f.read()
+    payload = data
+    if board.get("build.fpga_bitstream_trim", "0") in TRUE_VALUES:
+        payload = trim_bitstream_padding(data)
+    if len(payload) == len(data):
+        shutil.copy2(bitstream, dest)
+    else:
+        with open(dest, "wb") as f:
+            f.write(payload)
+    # Ensure the copied file is writable (remove read-only attribute)
+    os.chmod(dest, 0o666)
+    print(f"✓ Bitstream copied to {dest}")
+
+    # Uploaders that deflate the stream (pesptool, esptool) send about this much
+    deflated = len(zlib.compress(payload, 6))
+    summary = f"  Upload payload: {len(payload) / 1024:.1f} KB"
+    if len(payload) != len(data):
+        summary += f" ({(len(data) - len(payload)) / 1024:.1f} KB of padding trimmed)"
+    print(f"{summary}, {deflated / 1024:.1f} KB deflated")
+    if report is not None:
+        report["payload"] = {
+            "bitstream_size": len(data),
+            "size": len(payload),
+            "deflated_size": deflated,
+            "vendor_compression": board.get("build.fpga_bitstream_compress", "0") in TRUE_VALUES,
+        }
+    return dest
+
+def describe_build_results(impl_dir, bitstream, backend=None):
+    """Design metrics for the build report."""
+    with open(bitstream, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    results = {"bitstream": {"size": Path(bitstream).stat().st_size, "sha256": digest}}
+    if backend is not None:
+        results.update(backend["describe"](impl_dir))
+    else:
+        pnr_dir = Path(impl_dir) / "pnr"
+        results["utilization"] = parse_utilization_report(pnr_dir)
+        results["timing"] = parse_timing_report(pnr_dir)
+    return results
+
+def run_backend_build(env, name, backend, toolchain, sources, fpga_dir, impl_dir, telemetry,
+                      report):
+    """Build with a backend other than gw_sh, in impl_dir (fpga/impl/<name>).
+
+    Backends are registered in env["FPGA_BACKENDS"] as a dict of
+    find_toolchain(env), build(env, toolchain, sources, options, impl_dir)
+    returning the bitstream path or None, and describe(impl_dir) returning
+    the utilization and timing for the build report.
+    """
+    board = env.BoardConfig()
+    for option in ("build.fpga_variants", "build.fpga_explore", "build.fpga_staged_build"):
+        if board.get(option, "0") not in ("", "0"):
+            print(f"Warning: board_build.{option[6:]} is only supported by the gowin backend, "
+                  "ignoring it")
+    impl_dir = Path(impl_dir)
+    impl_dir.mkdir(parents=True, exist_ok=True)
+    options = get_fpga_build_options(env)
+    device = board.get("build.fpga_device_full", board.get("build.device", ""))
+    report.update({
+        "backend": name,
+        "device": device,
+        "toolchain_version": toolchain["version"],
+        "top_module": options["top_module"],
+        "impl_dir": str(impl_dir),
+    })
+
+    # Same inputs and tools give the same bitstream, as with gw_sh builds
+    cache_key = bitstream = None
+    if board.get("build.fpga_cache", "1") in TRUE_VALUES:
+        with telemetry.phase("cache_lookup"):
+            files = sources['verilog'] + sources['vhdl'] + sources['constraints']
+            cache_dir = get_bitstream_cache_dir(env)
+            cache_key = hash_parts(
+                [name, toolchain["id"], device, json.dumps(options, sort_keys=True)]
+                + [f"{Path(path).relative_to(fpga_dir).as_posix()}:{hash_source_file(path)}"
+                   for path in sorted(files)])
+            bitstream = restore_cached_outputs(cache_dir, cache_key, impl_dir)
+        if bitstream:
+            print(f"✓ FPGA bitstream restored from cache ({cache_key[:12]})")
+            report["result"] = "cached"
+    if not bitstream:
+        with telemetry.phase(name):
+            bitstream = backend["build"](env, toolchain, sources, options, impl_dir)
+        if bitstream is None:
+            print(f"FPGA build with the {name} backend failed")
+            return 1
+        print(f"✓ FPGA bitstream generated: {bitstream}")
+        report["result"] = "built"
+        if cache_key:
+            with telemetry.phase("cache_store"):
+                outputs = [path for path in impl_dir.iterdir() if path.is_file()
+                           and (path.suffix in (".bin", ".fs", ".log") or path.name == "report.json")]
+                store_cached_outputs(cache_dir, cache_key, impl_dir, outputs, bitstream,
+                                     get_bitstream_cache_limit(env))
+
+    with telemetry.phase("copy_bitstream"):
+        copy_bitstream_to_build_dir(bitstream, env, report)
+    report.update(describe_build_results(impl_dir, bitstream, backend))
+    print("=" * 70)
+    print("✓ FPGA Build Complete!")
+    print("=" * 70)
+    return 0
+
 def build_fpga_action(target, source, env):
     """SCons action for building FPGA bitstream."""
+    telemetry = env.get("FPGA_TELEMETRY")
+    if telemetry is None:
+        telemetry = env["FPGA_TELEMETRY"] = BuildTelemetry()
+    report = {"result": "failed"}
+    # Compile the MCU firmware for the combined image while the gateware builds
+    if env.get("FPGA_BUILD_FIRMWARE"):
+        env["FPGA_START_FIRMWARE_BUILD"](env)
+    try:
+        return run_fpga_build(target, source, env, telemetry, report)
+    finally:
+        write_build_report(env, telemetry, report)
+
+def run_fpga_build(target, source, env, telemetry, report):
+    """Build the FPGA bitstream, recording phases in telemetry and results in report."""
     print("=" * 70)
     print("Building FPGA Gateware...")
     print("=" * 70)
@@ -199,31 +2524,78 @@ def build_fpga_action(target, source, env):
     if not gprj_path.exists():
         print(f"Warning: FPGA project file not found: {gprj_path}")
         print("Skipping FPGA build.")
+        report["result"] = "skipped"
         return 0
     
-    # Find Gowin toolchain
-    gowin_home = find_gowin_toolchain(env)
-    if not gowin_home:
-        print("Warning: Gowin toolchain not found!")
-        print("Set GOWIN_HOME environment variable or board_build.gowin_path")
-        print("Skipping FPGA build.")
-        return 0
-    
-    gw_sh = find_gw_sh(gowin_home)
-    if not gw_sh:
-        print(f"Warning: gw_sh not found in {gowin_home}")
-        print("Skipping FPGA build.")
-        return 0
+    # Find the toolchain of the selected backend
+    backend_name = env.BoardConfig().get("build.fpga_backend", "gowin")
+    backend = None
+    if backend_name != "gowin":
+        backend = env["FPGA_BACKENDS"].get(backend_name)
+        if backend is None:
+            available = ", ".join(["gowin"] + sorted(env["FPGA_BACKENDS"]))
+            print(f"Error: Unknown board_build.fpga_backend '{backend_name}' (available: {available})")
+            return 1
+        with telemetry.phase("find_toolchain"):
+            toolchain = backend["find_toolchain"](env)
+        if not toolchain:
+            print(f"Warning: Toolchain for the {backend_name} backend not found!")
+            print("Skipping FPGA build.")
+            report["result"] = "skipped"
+            return 0
+    elif env.BoardConfig().get("build.fpga_remote", ""):
+        # gw_sh runs on a remote build worker, connected to below
+        gw_sh = None
+    else:
+        with telemetry.phase("find_gowin_toolchain"):
+            toolchain = resolve_gowin_toolchain(env)
+        if not toolchain:
+            print("Warning: Gowin toolchain not found!")
+            print("Set GOWIN_HOME environment variable or board_build.gowin_path")
+            print("Skipping FPGA build.")
+            report["result"] = "skipped"
+            return 0
+        gw_sh = Path(toolchain["gw_sh"])
     
     # Scan and update sources
     print("Scanning for FPGA source files...")
-    sources = scan_fpga_sources(fpga_dir)
+    with telemetry.phase("scan_fpga_sources"):
+        scanned_sources = scan_fpga_sources(fpga_dir)
+    with telemetry.phase("select_fpga_sources"):
+        sources = select_fpga_sources(env, fpga_dir, scanned_sources)
     print(f"  Found {len(sources['verilog'])} Verilog/SystemVerilog file(s)")
     print(f"  Found {len(sources['vhdl'])} VHDL file(s)")
     print(f"  Found {len(sources['constraints'])} constraint file(s)")
     
-    print(f"Updating project file: {gprj_path}")
-    update_gprj_file(gprj_path, sources, fpga_dir)
+    print(f"Checking project file: {gprj_path}")
+    env_dir = get_environment_dir(env, fpga_dir)
+    with telemetry.phase("update_gprj_file"):
+        if env_dir is None:
+            update_gprj_file(gprj_path, sources, fpga_dir,
+                             env.BoardConfig().get("build.fpga_top_module", "top"))
+        else:
+            # The shared project lists every source; this environment's copy
+            # has its own selection and top module
+            print(f"  Building in {env_dir.relative_to(project_dir).as_posix()}/ "
+                  "(one directory per environment, see board_build.fpga_env_isolation)")
+            update_gprj_file(gprj_path, scanned_sources, fpga_dir)
+            env_dir.mkdir(parents=True, exist_ok=True)
+            env_gprj = env_dir / gprj_path.name
+            if write_variant_gprj(gprj_path, env_gprj, sources,
+                                  env.BoardConfig().get("build.fpga_top_module", "top")):
+                print(f"  Updated project file: {env_gprj}")
+            gprj_path = env_gprj
+    
+    # Check the constraints against the top module before starting gw_sh
+    with telemetry.phase("preflight"):
+        if not run_preflight_check(env, scanned_sources, sources['constraints']):
+            return 1
+    
+    # Catch syntax errors without waiting for gw_sh; variants build every source
+    with telemetry.phase("syntax_check"):
+        checked = scanned_sources if env.BoardConfig().get("build.fpga_variants", "") else sources
+        if not env["FPGA_SYNTAX_CHECK"](env, checked, fpga_dir / "impl"):
+            return 1
     
     # Register all source files as dependencies for this build
     all_sources = sources['verilog'] + sources['vhdl'] + sources['constraints']
@@ -232,99 +2604,147 @@ def build_fpga_action(target, source, env):
     all_sources_str = [str(s) for s in all_sources]
     env.Depends(target, all_sources_str)
     
-    # Get top module name from board config
-    top_module = env.BoardConfig().get("build.fpga_top_module", "top")
+    # Create impl directory if it doesn't exist
+    impl_dir = (env_dir or fpga_dir) / "impl"
+    impl_dir.mkdir(parents=True, exist_ok=True)
     
-    # Get dual-purpose pin configuration options
-    use_sspi_as_gpio = env.BoardConfig().get("build.use_sspi_as_gpio", "0")
-    use_mspi_as_gpio = env.BoardConfig().get("build.use_mspi_as_gpio", "0")
-    use_jtag_as_gpio = env.BoardConfig().get("build.use_jtag_as_gpio", "0")
-    use_ready_as_gpio = env.BoardConfig().get("build.use_ready_as_gpio", "0")
-    use_done_as_gpio = env.BoardConfig().get("build.use_done_as_gpio", "0")
+    if backend is not None:
+        if env.BoardConfig().get("build.fpga_ooc_modules", ""):
+            print(f"Warning: The {backend_name} backend ignores board_build.fpga_ooc_modules")
+        return run_backend_build(env, backend_name, backend, toolchain, sources, fpga_dir,
+                                 impl_dir / backend_name, telemetry, report)
     
-    # Get multi-boot configuration options
-    multi_boot = env.BoardConfig().get("build.multi_boot", "0")
-    spi_flash_address = env.BoardConfig().get("build.spi_flash_address", "")
+    # Create Tcl script for gw_sh in impl directory
+    with telemetry.phase("generate_tcl_script"):
+        options = get_fpga_build_options(env)
+        tcl_text = generate_tcl_script(gprj_path, options)
+        tcl_script = impl_dir / "build_script.tcl"
+        with open(tcl_script, 'w') as f:
+            f.write(tcl_text)
     
-    # Create impl directory if it doesn't exist
-    impl_dir = fpga_dir / "impl"
-    impl_dir.mkdir(exist_ok=True)
+    if gw_sh is None:
+        # The worker's toolchain decides the version, and so the cache key
+        with telemetry.phase("connect_remote"):
+            remote = connect_remote_worker(env)
+        if remote is None:
+            return 1
+        toolchain = {"version": remote["version"]}
     
-    # Create Tcl script for gw_sh in impl directory
-    tcl_script = impl_dir / "build_script.tcl"
-    with open(tcl_script, 'w') as f:
-        f.write(f"""# Auto-generated Tcl script for gw_sh
-# Open project
-open_project ../{gprj_path.name}
-
-# Set top module explicitly
-set_option -top_module {top_module}
-""")
-        
-        # Add dual-purpose pin configuration options if enabled
-        if use_sspi_as_gpio in ("1", "true", "True", "yes", "Yes"):
-            f.write("\n# Use SSPI pins as regular I/O\n")
-            f.write("set_option -use_sspi_as_gpio 1\n")
-        
-        if use_mspi_as_gpio in ("1", "true", "True", "yes", "Yes"):
-            f.write("\n# Use MSPI pins as regular I/O\n")
-            f.write("set_option -use_mspi_as_gpio 1\n")
-        
-        if use_jtag_as_gpio in ("1", "true", "True", "yes", "Yes"):
-            f.write("\n# Use JTAG pins as regular I/O\n")
-            f.write("set_option -use_jtag_as_gpio 1\n")
-        
-        if use_ready_as_gpio in ("1", "true", "True", "yes", "Yes"):
-            f.write("\n# Use READY pin as regular I/O\n")
-            f.write("set_option -use_ready_as_gpio 1\n")
-        
-        if use_done_as_gpio in ("1", "true", "True", "yes", "Yes"):
-            f.write("\n# Use DONE pin as regular I/O\n")
-            f.write("set_option -use_done_as_gpio 1\n")
-        
-        # Add multi-boot configuration if enabled
-        if multi_boot in ("1", "true", "True", "yes", "Yes"):
-            f.write("\n# Enable Multi Boot\n")
-            f.write("set_option -multi_boot 1\n")
-            
-            # Set SPI flash address if provided
-            if spi_flash_address:
-                # Ensure address has 0x prefix if it's a hex value
-                addr = spi_flash_address.strip()
-                if not addr.startswith("0x") and not addr.startswith("0X"):
-                    addr = "0x" + addr
-                f.write(f"set_option -spi_flash_addr {addr}\n")
-        
-        f.write("""
-# Run all (synthesis, place and route, bitstream generation)
-run all
-
-# Close project
-exit
-""")
-    
-    # Build FPGA bitstream using Tcl script
-    print("Starting FPGA synthesis and place & route...")
-    result = subprocess.run(
-        [str(gw_sh), str(tcl_script)],
-        cwd=str(impl_dir),
-        capture_output=True,
-        text=True,
-        timeout=600
-    )
-    
-    if result.stdout:
-        print(result.stdout)
-    if result.stderr:
-        print(result.stderr, file=sys.stderr)
-    
-    if result.returncode != 0:
-        print(f"FPGA build failed with exit code {result.returncode}")
-        return result.returncode
+    device = env.BoardConfig().get("build.fpga_device_full", env.BoardConfig().get("build.device", ""))
+    toolchain_version = toolchain["version"]
+    report.update({
+        "device": device,
+        "toolchain_version": toolchain_version,
+        "top_module": options["top_module"],
+        "impl_dir": str(impl_dir),
+    })
+    max_bytes = get_bitstream_cache_limit(env)
+    try:
+        project_inputs = read_project_inputs(gprj_path)
+    except (OSError, ET.ParseError) as e:
+        print(f"Warning: Could not read project inputs, build caching disabled: {e}")
+        project_inputs = None
+    
+    # Several gateware variants packed into one multi-boot image
+    try:
+        variants = parse_fpga_variants(env.BoardConfig().get("build.fpga_variants", ""))
+    except ValueError as e:
+        print(f"Error: Invalid board_build.fpga_variants: {e}")
+        return 1
+    if variants and gw_sh is None:
+        print("Error: board_build.fpga_variants is not supported with board_build.fpga_remote")
+        close_remote_worker(remote)
+        return 1
+    if variants:
+        with telemetry.phase("variants"):
+            return run_variants_build(env, variants, scanned_sources, impl_dir, gw_sh,
+                                      gprj_path, device, toolchain_version, max_bytes, report)
+    
+    # Submodules synthesized on their own and linked into the top level as netlists
+    ooc_modules = parse_ooc_modules(env.BoardConfig().get("build.fpga_ooc_modules", ""))
+    if ooc_modules and gw_sh is None:
+        print("Warning: Out-of-context synthesis needs a local gw_sh, "
+              "ignoring board_build.fpga_ooc_modules")
+    elif ooc_modules:
+        with telemetry.phase("ooc_synthesis"):
+            linked = run_ooc_synthesis(env, ooc_modules, gw_sh, gprj_path, sources, fpga_dir,
+                                       impl_dir, device, toolchain_version, max_bytes,
+                                       get_gw_sh_run_options(env, gw_sh))
+        if linked is None:
+            return 1
+        gprj_path, impl_dir = linked
+        impl_dir.mkdir(parents=True, exist_ok=True)
+        tcl_text = generate_tcl_script(gprj_path, options)
+        tcl_script = impl_dir / "build_script.tcl"
+        with open(tcl_script, 'w') as f:
+            f.write(tcl_text)
+        report["impl_dir"] = str(impl_dir)
+        project_inputs = read_project_inputs(gprj_path)
+    
+    explore = env.BoardConfig().get("build.fpga_explore", "0") in TRUE_VALUES
+    staged = env.BoardConfig().get("build.fpga_staged_build", "0") in TRUE_VALUES
+    if gw_sh is None and (explore or staged):
+        print("Warning: Exploration and staged builds run locally only; "
+              "building in one remote gw_sh run")
+        explore = staged = False
+    if explore:
+        strategies = parse_explore_strategies(
+            env.BoardConfig().get("build.fpga_explore_strategies", DEFAULT_EXPLORE_STRATEGIES))
+        metric = env.BoardConfig().get("build.fpga_explore_metric", "slack")
+    
+    # Reuse a previous build of identical inputs if one is cached
+    use_cache = env.BoardConfig().get("build.fpga_cache", "1") in TRUE_VALUES
+    cache_key = None
+    if use_cache and project_inputs:
+        with telemetry.phase("cache_lookup"):
+            cache_dir = get_bitstream_cache_dir(env)
+            key_text = tcl_text
+            if explore:
+                # The chosen strategy depends on the candidates and the metric
+                key_text += json.dumps({"explore": strategies, "metric": metric})
+            cache_key = compute_bitstream_cache_key(project_inputs, key_text, device, toolchain_version)
+            bitstream = restore_cached_outputs(cache_dir, cache_key, impl_dir)
+        if bitstream:
+            if gw_sh is None:
+                close_remote_worker(remote)
+            print(f"✓ FPGA bitstream restored from cache ({cache_key[:12]})")
+            with telemetry.phase("copy_bitstream"):
+                copy_bitstream_to_build_dir(bitstream, env, report)
+            report["result"] = "cached"
+            report.update(describe_build_results(impl_dir, bitstream))
+            print("=" * 70)
+            print("✓ FPGA Build Complete!")
+            print("=" * 70)
+            return 0
+    
+    # Build FPGA bitstream, either in cached stages or with a single Tcl script
+    run_options = get_gw_sh_run_options(env, gw_sh)
+    if gw_sh is None:
+        print(f"Starting FPGA synthesis and place & route on {remote['url']}...")
+        try:
+            returncode = run_gw_sh_remote(remote, gprj_path, project_dir, tcl_text, impl_dir,
+                                          **run_options)
+        finally:
+            close_remote_worker(remote)
+    elif explore and project_inputs and strategies:
+        with telemetry.phase("explore"):
+            returncode = run_explore_build(gw_sh, gprj_path, options, impl_dir, project_inputs,
+                                           device, toolchain_version, max_bytes, run_options,
+                                           strategies, get_explore_jobs(env), metric)
+    elif staged and project_inputs:
+        returncode = run_staged_build(gw_sh, gprj_path, options, impl_dir, project_inputs,
+                                      device, toolchain_version, max_bytes, run_options)
+    else:
+        print("Starting FPGA synthesis and place & route...")
+        returncode = run_gw_sh(gw_sh, tcl_script, impl_dir, **run_options)
+    
+    if returncode != 0:
+        print(f"FPGA build failed with exit code {returncode}")
+        return returncode
     
     # Find generated bitstream
-    impl_dir = fpga_dir / "impl" / "pnr"
-    bitstream_candidates = list(impl_dir.glob("*.bin"))
+    pnr_dir = impl_dir / "pnr"
+    bitstream_candidates = list(pnr_dir.glob("*.bin"))
     
     if not bitstream_candidates:
         print("Error: No .bin bitstream found after build")
@@ -333,13 +2753,17 @@ exit
     bitstream = bitstream_candidates[0]
     print(f"✓ FPGA bitstream generated: {bitstream}")
     
+    if cache_key:
+        with telemetry.phase("cache_store"):
+            store_cached_outputs(cache_dir, cache_key, impl_dir,
+                                 collect_impl_outputs(impl_dir, CACHED_OUTPUT_DIRS),
+                                 bitstream, max_bytes)
+    
     # Copy to build directory
-    build_dir = Path(env.subst("$BUILD_DIR"))
-    dest = build_dir / "fpga_bitstream.bin"
-    shutil.copy2(bitstream, dest)
-    # Ensure the copied file is writable (remove read-only attribute)
-    os.chmod(dest, 0o666)
-    print(f"✓ Bitstream copied to {dest}")
+    with telemetry.phase("copy_bitstream"):
+        copy_bitstream_to_build_dir(bitstream, env, report)
+    report["result"] = "built"
+    report.update(describe_build_results(impl_dir, bitstream))
     
     print("=" * 70)
     print("✓ FPGA Build Complete!")
@@ -348,5 +2772,14 @@ exit
     return 0
 
 # Register the FPGA build action and source getter with the environment
+env["FPGA_TELEMETRY"] = BuildTelemetry()
 env["FPGA_BUILD_ACTION"] = build_fpga_action
 env["GET_FPGA_SOURCES"] = get_fpga_sources
+env["FPGA_SCAN_SOURCES"] = scan_fpga_sources
+env["FPGA_UPLOAD_TELEMETRY_START"] = start_upload_telemetry
+env["FPGA_UPLOAD_TELEMETRY_FINISH"] = finish_upload_telemetry
+env["FPGA_CANCEL_BUILDS"] = cancel_gw_sh_runs
+env["FPGA_LIST_TOOLCHAINS_ACTION"] = list_toolchains_action
+env["FPGA_PARALLEL_JOBS"] = get_parallel_jobs
+env["FPGA_CANCELLABLE_RUN"] = cancellable_gw_sh_run
+env["FPGA_BACKENDS"] = {}
@@ -0,0 +1,95 @@
+"""
+Shared FPGA Builder Helpers
+
+Small helpers used by several builder scripts and by the standalone gw_sh
+workers. Unlike the SConscripts, this is a plain Python module: main.py
+puts builder/ on sys.path so the scripts can import it, and the workers
+find it next to themselves.
+"""
+
+import os
+import sys
+import hmac
+import json
+import signal
+import threading
+import subprocess
+from pathlib import Path
+
+# Board option values that enable a feature
+TRUE_VALUES = ("1", "true", "True", "yes", "Yes")
+
+# Board option values that disable a feature
+FALSE_VALUES = ("0", "false", "False", "no", "No")
+
+def get_project_fpga_environments(config):
+    """Environments of a PlatformIO project configuration that use this platform."""
+    return [name for name in config.envs()
+            if "gowin" in str(config.get(f"env:{name}", "platform", ""))]
+
+def uses_environment_dir(mode, environments):
+    """Whether an environment builds in its own fpga/impl/env/<name> directory.
+
+    mode is its board_build.fpga_env_isolation: "1" or "0" to choose, or
+    "auto" to isolate the environments of a project with several of them.
+    """
+    if mode in TRUE_VALUES:
+        return True
+    if mode in FALSE_VALUES:
+        return False
+    return len(environments) > 1
+
+def check_token(sent, expected):
+    """Compare a client's access token in constant time, so timing does not leak it."""
+    if not isinstance(sent, str):
+        return False
+    return hmac.compare_digest(sent.encode("utf-8"), expected.encode("utf-8"))
+
+def write_atomic(path, data):
+    """Write str or bytes to path through a temporary file and a rename.
+
+    Readers, including concurrent builds, never see a partly written file.
+    Raises OSError on failure, after removing the temporary file.
+    """
+    path = Path(path)
+    tmp_path = Path(f"{path}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if isinstance(data, bytes):
+            tmp_path.write_bytes(data)
+        else:
+            tmp_path.write_text(data, encoding="utf-8")
+        os.replace(tmp_path, path)
+    finally:
+        try:
+            tmp_path.unlink()
+        except OSError:
+            pass
+
+def write_json_atomic(path, data, **dump_args):
+    """write_atomic for a JSON document; dump_args go to json.dumps."""
+    write_atomic(path, json.dumps(data, **dump_args))
+
+def get_process_group_args(detached=False):
+    """Popen arguments that start a process in its own process group.
+
+    kill_process_tree can then stop it with every tool it spawned, and
+    Ctrl+C in the console does not reach it directly.
+    """
+    if sys.platform.startswith("win"):
+        flags = subprocess.CREATE_NEW_PROCESS_GROUP
+        if detached:
+            flags |= subprocess.DETACHED_PROCESS
+        return {"creationflags": flags}
+    return {"start_new_session": True}
+
+def kill_process_tree(proc):
+    """Kill a process started with get_process_group_args and its children."""
+    try:
+        if sys.platform.startswith("win"):
+            subprocess.run(["taskkill", "/F", "/T", "/PID", str(proc.pid)],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        else:
+            os.killpg(proc.pid, signal.SIGKILL)
+    except OSError:
+        proc.kill()
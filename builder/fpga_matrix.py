@@ -0,0 +1,268 @@
+"""
+FPGA Build Matrix
+
+Builds several FPGA environments of a project at once (pio run -t matrix),
+each in its own PlatformIO process. The number of concurrent builds is
+limited by the job count, the memory available and the number of Gowin
+license seats.
+"""
+
+Import("env")
+import os
+import re
+import sys
+import json
+import time
+import subprocess
+from pathlib import Path
+from fpga_common import TRUE_VALUES, write_json_atomic, get_project_fpga_environments
+
+# Memory assumed for a build that has no build report yet
+DEFAULT_BUILD_MEMORY = 2 * 1024 ** 3
+
+# Seconds between checks of the running builds
+MATRIX_POLL_INTERVAL = 0.2
+
+# Per-environment results of the last matrix build (in $BUILD_DIR)
+MATRIX_RESULTS_NAME = "fpga_matrix_results.json"
+
+# The `pio run` building the matrix and the environments it has yet to
+# run the target in (in $PROJECT_BUILD_DIR)
+MATRIX_RUN_MARKER = "fpga_matrix.run"
+
+def parse_memory(value):
+    """Parse a memory size such as 2GB, 512MB or a number of bytes."""
+    match = re.match(r"(?i)^\s*(\d+(?:\.\d+)?)\s*([KMG])?B?\s*$", str(value))
+    if not match:
+        raise ValueError(f"Invalid memory size: {value}")
+    scale = {None: 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}[
+        match.group(2).upper() if match.group(2) else None]
+    return int(float(match.group(1)) * scale)
+
+def get_available_memory():
+    """Memory available to new processes in bytes, or None if it cannot be told."""
+    try:
+        with open("/proc/meminfo", "r", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.virtual_memory().available
+
+def get_matrix_environments(env, config):
+    """Environments to build: board_build.fpga_matrix_envs, or every FPGA environment."""
+    names = re.split(r"[,\s]+", env.BoardConfig().get("build.fpga_matrix_envs", "").strip())
+    names = [name for name in names if name]
+    if names:
+        unknown = [name for name in names if name not in config.envs()]
+        if unknown:
+            raise ValueError(f"Unknown environment(s): {', '.join(unknown)}")
+        return names
+    return get_project_fpga_environments(config)
+
+def read_build_report(env, name):
+    """Last build report of an environment, or None."""
+    path = Path(env.subst("$PROJECT_BUILD_DIR")) / name / "fpga_build_report.json"
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def estimate_build_memory(report, default):
+    """Peak memory of the environment's last build (PlatformIO plus gw_sh), else default."""
+    peak = ((report or {}).get("peak_rss_kb") or 0) + ((report or {}).get("children_peak_rss_kb") or 0)
+    return peak * 1024 if peak else default
+
+def uses_license_seat(config, name):
+    """Whether an environment builds with gw_sh, which may need a license seat."""
+    backend = config.get(f"env:{name}", "board_build.fpga_backend", "gowin")
+    return str(backend).strip() in ("", "gowin")
+
+def start_environment_build(env, name, log_dir):
+    """Start `pio run -e name` in the background; its output goes to a log file."""
+    log_path = Path(log_dir) / f"{name}.log"
+    log = open(log_path, "w", encoding="utf-8")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "platformio", "run", "-d", env.subst("$PROJECT_DIR"), "-e", name],
+        stdin=subprocess.DEVNULL,
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+    return {"proc": proc, "log": log, "log_path": log_path, "start": time.time()}
+
+def describe_matrix_result(report):
+    """Short timing summary from a build report."""
+    timing = (report or {}).get("timing") or {}
+    parts = []
+    if timing.get("fmax"):
+        parts.append("Fmax " + ", ".join(f"{clock} {mhz:.1f} MHz"
+                                        for clock, mhz in sorted(timing["fmax"].items())))
+    if timing.get("worst_slack") is not None:
+        parts.append(f"slack {timing['worst_slack']:.3f} ns")
+    return "; ".join(parts)
+
+def get_process_start_time(pid):
+    """Start time of a process, telling it apart from a later one with the same ID.
+
+    None if it cannot be told (no /proc and no psutil).
+    """
+    try:
+        with open(f"/proc/{pid}/stat", "r", encoding="ascii", errors="replace") as f:
+            # Field 22; the command name before it may contain spaces
+            return f.read().rsplit(")", 1)[1].split()[19]
+    except (OSError, IndexError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    try:
+        return str(psutil.Process(pid).create_time())
+    except psutil.Error:
+        return None
+
+def claim_matrix_run(env):
+    """Whether this environment builds the matrix for the current `pio run`.
+
+    Without -e, `pio run -t matrix` runs the target in every environment,
+    each in its own SCons process started by the same pio process. Only
+    the first one claims the run; the others skip the matrix, and the last
+    of them removes the marker. The pio process is identified by its ID
+    and start time, so a later run that gets the same ID is not skipped.
+    """
+    marker = Path(env.subst("$PROJECT_BUILD_DIR")) / MATRIX_RUN_MARKER
+    invocation = {"pid": os.getppid(), "started": get_process_start_time(os.getppid())}
+    name = env.subst("$PIOENV")
+    try:
+        with open(marker, "r", encoding="utf-8") as f:
+            claim = json.load(f)
+    except (OSError, ValueError):
+        claim = None
+    try:
+        if claim and {key: claim.get(key) for key in invocation} == invocation:
+            pending = [other for other in claim.get("pending", []) if other != name]
+            if pending:
+                write_json_atomic(marker, dict(claim, pending=pending))
+            else:
+                marker.unlink()
+            return False
+        pending = [other for other in get_project_fpga_environments(env.GetProjectConfig())
+                   if other != name]
+        if pending:
+            write_json_atomic(marker, dict(invocation, pending=pending))
+        elif claim is not None:
+            marker.unlink()
+    except OSError as e:
+        print(f"Warning: Could not record the matrix build: {e}")
+    return True
+
+def matrix_build_action(target, source, env):
+    """SCons action: build every FPGA environment of the project with a bounded queue.
+
+    Builds start in order as soon as a job slot, enough memory and, for
+    gw_sh builds, a license seat are free. Memory per build comes from each
+    environment's last build report. A summary of all environments is
+    printed and written to fpga_matrix_results.json.
+    """
+    if not claim_matrix_run(env):
+        print("FPGA build matrix already built by this `pio run`, skipping")
+        return 0
+    board = env.BoardConfig()
+    config = env.GetProjectConfig()
+    try:
+        names = get_matrix_environments(env, config)
+        default_memory = parse_memory(board.get("build.fpga_matrix_memory", DEFAULT_BUILD_MEMORY))
+        seats = int(board.get("build.fpga_license_seats", "0"))
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+    if not names:
+        print("Error: No FPGA environments to build")
+        return 1
+    jobs = min(env["FPGA_PARALLEL_JOBS"](env, "build.fpga_matrix_jobs"), len(names))
+
+    estimates = {name: estimate_build_memory(read_build_report(env, name), default_memory)
+                 for name in names}
+    available = get_available_memory()
+    limits = [f"{jobs} job(s)"]
+    if seats > 0:
+        limits.append(f"{seats} license seat(s)")
+    if available is not None:
+        limits.append(f"{available / 1024 ** 3:.1f} GB memory")
+    print(f"Building {len(names)} FPGA environment(s), up to {', '.join(limits)}")
+
+    log_dir = Path(env.subst("$BUILD_DIR")) / "matrix_logs"
+    log_dir.mkdir(parents=True, exist_ok=True)
+    queue = list(names)
+    running = {}
+    results = {}
+    start = time.time()
+    try:
+        while queue or running:
+            for name, job in list(running.items()):
+                returncode = job["proc"].poll()
+                if returncode is None:
+                    continue
+                job["log"].close()
+                del running[name]
+                report = read_build_report(env, name)
+                results[name] = {
+                    "ok": returncode == 0,
+                    "returncode": returncode,
+                    "seconds": round(time.time() - job["start"], 3),
+                    "result": (report or {}).get("result") if returncode == 0 else "failed",
+                    "summary": describe_matrix_result(report) if returncode == 0 else "",
+                    "log": str(job["log_path"]),
+                }
+                status = "OK" if returncode == 0 else f"FAILED (exit code {returncode})"
+                print(f"  {name}: {status} in {results[name]['seconds']:.1f}s")
+
+            # Start queued builds in order; a build waiting for a license seat
+            # lets later builds that need none go first
+            for name in list(queue):
+                if len(running) >= jobs:
+                    break
+                licensed = uses_license_seat(config, name)
+                if licensed and seats > 0 and sum(job["licensed"] for job in running.values()) >= seats:
+                    continue
+                reserved = sum(job["memory"] for job in running.values())
+                if available is not None and running and reserved + estimates[name] > available:
+                    break
+                queue.remove(name)
+                running[name] = start_environment_build(env, name, log_dir)
+                running[name].update(licensed=licensed, memory=estimates[name])
+                print(f"  {name}: started ({len(running)} running, {len(queue)} queued)")
+            time.sleep(MATRIX_POLL_INTERVAL)
+    except KeyboardInterrupt:
+        for job in running.values():
+            job["proc"].kill()
+            job["log"].close()
+        print("Matrix build cancelled")
+        return 1
+
+    failed = [name for name in names if not results[name]["ok"]]
+    print("=" * 70)
+    print(f"FPGA build matrix: {len(names) - len(failed)} of {len(names)} environment(s) "
+          f"built in {time.time() - start:.1f}s")
+    for name in names:
+        result = results[name]
+        status = result["result"] or ("built" if result["ok"] else "failed")
+        details = result["summary"] or ("" if result["ok"] else f"log: {result['log']}")
+        print(f"  {name:<20} {status:<8} {result['seconds']:>7.1f}s  {details}")
+    print("=" * 70)
+
+    try:
+        with open(Path(env.subst("$BUILD_DIR")) / MATRIX_RESULTS_NAME, "w", encoding="utf-8") as f:
+            json.dump({"environments": {name: results[name] for name in names}}, f, indent=2)
+    except OSError as e:
+        print(f"Warning: Could not write matrix results: {e}")
+    return 1 if failed else 0
+
+# Register the matrix action with the environment
+env["FPGA_MATRIX_ACTION"] = matrix_build_action
@@ -0,0 +1,372 @@
+"""
+HDL Simulation
+
+Runs the testbenches in fpga/test (pio run -t sim) with iverilog,
+verilator or ghdl. Each testbench is compiled into a simulation model
+that is reused until one of its sources changes, testbenches run in
+parallel, and the results are written as a JUnit XML report.
+"""
+
+Import("env")
+import os
+import re
+import time
+import shutil
+import fnmatch
+import hashlib
+import threading
+import subprocess
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from fpga_common import write_atomic
+
+# Directory of fpga/ holding testbenches and simulation-only models
+SIM_TEST_DIR = "test"
+
+# Testbench file names (board_build.fpga_sim_testbenches)
+DEFAULT_TESTBENCH_PATTERNS = "*_tb.* tb_*.*"
+
+HDL_EXTENSIONS = {".v": "verilog", ".sv": "verilog", ".vh": "verilog", ".svh": "verilog",
+                  ".vhd": "vhdl", ".vhdl": "vhdl"}
+VERILOG_HEADER_EXTENSIONS = (".vh", ".svh")
+
+# Simulators, in order of preference, by language
+SIMULATORS = {"verilog": ("iverilog", "verilator"), "vhdl": ("ghdl",)}
+
+# Bumped when the compile commands change, invalidating cached models
+SIM_MODEL_VERSION = 1
+
+# Seconds a testbench may take to compile
+SIM_COMPILE_TIMEOUT = 600
+
+# JUnit report of the last run (in $BUILD_DIR)
+SIM_RESULTS_NAME = "fpga_sim_results.xml"
+
+# Lines of simulator output kept in failure messages
+SIM_OUTPUT_TAIL = 20
+
+# Design unit a testbench file defines first
+TESTBENCH_TOP_PATTERN = re.compile(
+    r"^\s*(?:module\s+([A-Za-z_][\w$]*)|entity\s+(\w+)\s+is\b)", re.M | re.I)
+
+# Messages of $error/$fatal, assertions and "FAILED" prints in simulator output
+SIM_FAILURE_PATTERN = re.compile(r"^\s*%?(?:ERROR|Error|FATAL|Fatal|FAIL|FAILED)\b"
+                                 r"|\((?:assertion )?(?:error|failure)\)")
+
+def find_testbenches(env, test_dir):
+    """Testbench files in fpga/test matching board_build.fpga_sim_testbenches and fpga_sim_filter."""
+    board = env.BoardConfig()
+    patterns = board.get("build.fpga_sim_testbenches", DEFAULT_TESTBENCH_PATTERNS).split()
+    filters = re.split(r"[,\s]+", board.get("build.fpga_sim_filter", "").strip())
+    filters = [f for f in filters if f]
+    testbenches = []
+    for path in sorted(Path(test_dir).rglob("*")):
+        suffix = path.suffix.lower()
+        if suffix not in HDL_EXTENSIONS or suffix in VERILOG_HEADER_EXTENSIONS:
+            continue
+        if not any(fnmatch.fnmatch(path.name, pattern) for pattern in patterns):
+            continue
+        if filters and not any(fnmatch.fnmatch(path.stem, f) for f in filters):
+            continue
+        testbenches.append(path)
+    return testbenches
+
+def scan_test_files(test_dir):
+    """Every HDL file in fpga/test, by language, for testbenches to draw on."""
+    files = {"verilog": [], "vhdl": []}
+    for path in sorted(Path(test_dir).rglob("*")):
+        language = HDL_EXTENSIONS.get(path.suffix.lower())
+        if language:
+            files[language].append(path)
+    return files
+
+def get_testbench_top(path):
+    """Name of the first module or entity a testbench file defines, or None."""
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        match = TESTBENCH_TOP_PATTERN.search(f.read())
+    if not match:
+        return None
+    return match.group(1) or match.group(2).lower()
+
+def find_simulators(env):
+    """Simulator path for each language (None if not installed), from board_build.fpga_simulator."""
+    mode = env.BoardConfig().get("build.fpga_simulator", "auto")
+    simulators = {}
+    for language, names in SIMULATORS.items():
+        if mode not in ("", "auto"):
+            names = [name for name in names if name == mode]
+        simulators[language] = next((shutil.which(name) for name in names if shutil.which(name)),
+                                    None)
+    return simulators
+
+def get_simulator_id(simulator):
+    """Identifies the models a simulator built; changes when the tool is replaced."""
+    try:
+        return f"{Path(simulator).name}-{os.stat(simulator).st_mtime_ns}"
+    except OSError:
+        return Path(simulator).name
+
+def get_model_commands(simulator, top, files, include_dirs):
+    """(compile commands, run command) for a testbench, run inside its model directory."""
+    name = Path(simulator).stem.lower()
+    files = [str(path) for path in files]
+    if name == "ghdl":
+        workdir = "--workdir=."
+        return ([[simulator, "-i", "--std=08", workdir] + files,
+                 [simulator, "-m", "--std=08", workdir, top]],
+                [simulator, "-r", "--std=08", workdir, top, "--assert-level=error"])
+    includes = [f"-I{include_dir}" for include_dir in include_dirs]
+    if name == "verilator":
+        return ([[simulator, "--binary", "-Wno-fatal", "-Wno-lint", "-Wno-style",
+                  "--top-module", top, "-Mdir", "obj", "-o", "sim"] + includes + files],
+                [str(Path("obj") / "sim")])
+    vvp = shutil.which("vvp", path=str(Path(simulator).parent)) or shutil.which("vvp") or "vvp"
+    return ([[simulator, "-g2012", "-s", top, "-o", "model.vvp"] + includes + files],
+            [vvp, "-n", "model.vvp"])
+
+def compute_model_key(simulator, top, files):
+    """Hash of everything a compiled model depends on."""
+    digest = hashlib.sha256()
+    digest.update(f"{SIM_MODEL_VERSION}\0{get_simulator_id(simulator)}\0{top}\0".encode())
+    for path in sorted(str(path) for path in files):
+        with open(path, "rb") as f:
+            digest.update(f"{path}\0{hashlib.sha256(f.read()).hexdigest()}\0".encode())
+    return digest.hexdigest()
+
+def run_sim_process(env, command, cwd, log_path, timeout, cancelled):
+    """Run one simulator command into log_path; returns (returncode, timed_out).
+
+    The process is killed when it runs over timeout or the run is cancelled.
+    """
+    stop_reasons = []
+    with open(log_path, "a", encoding="utf-8") as log:
+        log.write(" ".join(str(part) for part in command) + "\n")
+        log.flush()
+        try:
+            proc = subprocess.Popen([str(part) for part in command], cwd=cwd,
+                                    stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT)
+        except OSError as e:
+            log.write(f"Could not run {command[0]}: {e}\n")
+            return 1, False
+
+        def stop(reason):
+            stop_reasons.append(reason)
+            proc.kill()
+
+        with env["FPGA_CANCELLABLE_RUN"](stop):
+            if cancelled.is_set():
+                stop("cancelled")
+            try:
+                returncode = proc.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                stop("timeout")
+                returncode = proc.wait()
+    return returncode, stop_reasons == ["timeout"]
+
+def read_log_lines(log_path):
+    try:
+        with open(log_path, "r", encoding="utf-8", errors="replace") as f:
+            return f.read().splitlines()
+    except OSError:
+        return []
+
+def select_testbench_design(env, testbench, sources, sim_dir):
+    """(top unit, files) a testbench needs, or (None, message) if it cannot be simulated."""
+    top = get_testbench_top(testbench)
+    if top is None:
+        return None, "no module or entity found in the testbench"
+    design = {"verilog": sources["verilog"], "vhdl": sources["vhdl"], "constraints": []}
+    design = env["FPGA_REACHABLE_SOURCES"](design, top, sim_dir, False)
+    if design["verilog"] and design["vhdl"]:
+        return None, "uses both Verilog and VHDL, which the supported simulators cannot mix"
+    return top, design
+
+def run_testbench(env, testbench, top, design, simulators, sim_dir, timeout, cancelled):
+    """Compile (unless cached) and run one testbench; returns its result dict."""
+    result = {"name": testbench.stem, "path": str(testbench), "status": "error",
+              "message": "", "output": [], "compile_seconds": 0.0, "seconds": 0.0,
+              "cached": False}
+    if top is None:
+        result["message"] = design
+        return result
+    if cancelled.is_set():
+        result.update(status="skipped", message="cancelled")
+        return result
+    language = "vhdl" if testbench.suffix.lower() in (".vhd", ".vhdl") else "verilog"
+    simulator = simulators[language]
+    if simulator is None:
+        result.update(status="skipped", message=f"no {language.upper()} simulator installed")
+        return result
+    result["simulator"] = Path(simulator).name
+
+    files = design[language]
+    compile_files = [path for path in files
+                     if not str(path).lower().endswith(VERILOG_HEADER_EXTENSIONS)]
+    include_dirs = sorted({str(Path(path).parent) for path in files})
+    compile_commands, run_command = get_model_commands(simulator, top, compile_files, include_dirs)
+
+    tb_dir = Path(sim_dir) / testbench.stem
+    model_dir = tb_dir / "model"
+    key_path = tb_dir / "model.key"
+    key = compute_model_key(simulator, top, files)
+    try:
+        result["cached"] = key_path.read_text(encoding="ascii") == key and model_dir.is_dir()
+    except OSError:
+        result["cached"] = False
+
+    if not result["cached"]:
+        start = time.time()
+        if model_dir.exists():
+            shutil.rmtree(model_dir)
+        model_dir.mkdir(parents=True)
+        log_path = tb_dir / "compile.log"
+        log_path.write_text("", encoding="utf-8")
+        for command in compile_commands:
+            returncode, timed_out = run_sim_process(env, command, model_dir, log_path,
+                                                    SIM_COMPILE_TIMEOUT, cancelled)
+            if returncode != 0:
+                result["compile_seconds"] = round(time.time() - start, 3)
+                result["output"] = read_log_lines(log_path)
+                result["message"] = ("compilation timed out" if timed_out
+                                     else f"compilation failed, see {log_path}")
+                if cancelled.is_set():
+                    result.update(status="skipped", message="cancelled")
+                return result
+        key_path.write_text(key, encoding="ascii")
+        result["compile_seconds"] = round(time.time() - start, 3)
+
+    start = time.time()
+    log_path = tb_dir / "run.log"
+    log_path.write_text("", encoding="utf-8")
+    returncode, timed_out = run_sim_process(env, run_command, model_dir, log_path,
+                                            timeout, cancelled)
+    result["seconds"] = round(time.time() - start, 3)
+    # The first line of the log is the command itself
+    result["output"] = read_log_lines(log_path)[1:]
+    failures = [line for line in result["output"] if SIM_FAILURE_PATTERN.search(line)]
+    if cancelled.is_set():
+        result.update(status="skipped", message="cancelled")
+    elif timed_out:
+        result.update(status="failed", message=f"timed out after {timeout}s")
+    elif returncode != 0 or failures:
+        message = failures[0].strip() if failures else f"exit code {returncode}"
+        result.update(status="failed", message=message)
+    else:
+        result["status"] = "passed"
+    return result
+
+def write_junit_report(path, results, elapsed):
+    """Write the results in the JUnit XML format CI systems read."""
+    counts = {status: sum(1 for r in results if r["status"] == status)
+              for status in ("failed", "error", "skipped")}
+    suites = ET.Element("testsuites")
+    suite = ET.SubElement(suites, "testsuite", name="fpga-sim", tests=str(len(results)),
+                          failures=str(counts["failed"]), errors=str(counts["error"]),
+                          skipped=str(counts["skipped"]), time=f"{elapsed:.3f}")
+    for result in results:
+        case = ET.SubElement(suite, "testcase", name=result["name"], classname="fpga.test",
+                             file=result["path"],
+                             time=f"{result['compile_seconds'] + result['seconds']:.3f}")
+        tail = "\n".join(result["output"][-SIM_OUTPUT_TAIL:])
+        if result["status"] == "failed":
+            ET.SubElement(case, "failure", message=result["message"]).text = tail
+        elif result["status"] == "error":
+            ET.SubElement(case, "error", message=result["message"]).text = tail
+        elif result["status"] == "skipped":
+            ET.SubElement(case, "skipped", message=result["message"])
+        if result["output"]:
+            ET.SubElement(case, "system-out").text = "\n".join(result["output"])
+    write_atomic(path, ET.tostring(suites, encoding="utf-8", xml_declaration=True))
+
+def sim_action(target, source, env):
+    """SCons action: run every testbench in fpga/test and report the results.
+
+    Testbenches run in parallel (board_build.fpga_sim_jobs or -j), each
+    limited to board_build.fpga_sim_timeout seconds. Models whose sources
+    are unchanged are not compiled again.
+    """
+    board = env.BoardConfig()
+    fpga_dir = Path(env.get("PROJECT_DIR")) / "fpga"
+    test_dir = fpga_dir / SIM_TEST_DIR
+    try:
+        timeout = float(board.get("build.fpga_sim_timeout", "60"))
+    except (TypeError, ValueError):
+        print("Error: board_build.fpga_sim_timeout must be a number of seconds")
+        return 1
+
+    testbenches = find_testbenches(env, test_dir)
+    if not testbenches:
+        print(f"No testbenches found in {test_dir}")
+        return 0
+    simulators = find_simulators(env)
+    if not any(simulators.values()):
+        print("Error: No HDL simulator found (install iverilog, verilator or ghdl)")
+        return 1
+
+    sources = env["FPGA_SCAN_SOURCES"](fpga_dir)
+    test_files = scan_test_files(test_dir)
+    for language in ("verilog", "vhdl"):
+        sources[language] = sources[language] + test_files[language]
+    sim_dir = fpga_dir / "impl" / "sim"
+    sim_dir.mkdir(parents=True, exist_ok=True)
+
+    jobs = min(env["FPGA_PARALLEL_JOBS"](env, "build.fpga_sim_jobs"), len(testbenches))
+    tools = sorted({Path(path).name for path in simulators.values() if path})
+    print(f"Running {len(testbenches)} testbench(es) with {', '.join(tools)}, {jobs} at a time")
+
+    start = time.time()
+    cancelled = threading.Event()
+    results = {}
+    executor = ThreadPoolExecutor(max_workers=jobs)
+    # Designs are resolved up front, as the dependency graph cache is shared
+    designs = {testbench: select_testbench_design(env, testbench, sources, sim_dir)
+               for testbench in testbenches}
+    futures = {executor.submit(run_testbench, env, testbench, *designs[testbench], simulators,
+                               sim_dir, timeout, cancelled): testbench
+               for testbench in testbenches}
+    try:
+        for future in futures:
+            result = results[futures[future]] = future.result()
+            line = f"  {result['name']}: {result['status'].upper()}"
+            if result["status"] in ("passed", "failed"):
+                compiled = ("cached model" if result["cached"]
+                            else f"compiled in {result['compile_seconds']:.1f}s")
+                line += f" in {result['seconds']:.1f}s ({compiled})"
+            if result["message"]:
+                line += f": {result['message']}"
+            print(line)
+    except KeyboardInterrupt:
+        cancelled.set()
+        env["FPGA_CANCEL_BUILDS"]()
+        executor.shutdown(wait=True)
+        print("Simulation cancelled")
+        return 1
+    executor.shutdown()
+    elapsed = time.time() - start
+
+    results = [results[testbench] for testbench in testbenches]
+    for result in results:
+        if result["status"] in ("failed", "error") and result["output"]:
+            print(f"--- {result['name']} ---")
+            for line in result["output"][-SIM_OUTPUT_TAIL:]:
+                print(f"  {line}")
+
+    report_path = Path(env.subst("$BUILD_DIR")) / SIM_RESULTS_NAME
+    try:
+        report_path.parent.mkdir(parents=True, exist_ok=True)
+        write_junit_report(report_path, results, elapsed)
+    except OSError as e:
+        print(f"Warning: Could not write simulation results: {e}")
+
+    counts = {status: sum(1 for r in results if r["status"] == status)
+              for status in ("passed", "failed", "error", "skipped")}
+    print("=" * 70)
+    print(f"Simulation: {counts['passed']} passed, {counts['failed']} failed, "
+          f"{counts['error']} error(s), {counts['skipped']} skipped in {elapsed:.1f}s")
+    print(f"JUnit report: {report_path}")
+    print("=" * 70)
+    return 1 if counts["failed"] or counts["error"] else 0
+
+# Register the simulation action with the environment
+env["FPGA_SIM_ACTION"] = sim_action
@@ -0,0 +1,329 @@
+"""
+FPGA Upload Helpers
+
+Upload actions that go beyond a single uploader command line, such as
+differential flashing of the bitstream through pesptool.
+"""
+
+Import("env")
+import os
+import re
+import glob
+import json
+import time
+import shutil
+import fnmatch
+import hashlib
+import subprocess
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from fpga_common import TRUE_VALUES, FALSE_VALUES, write_json_atomic
+
+try:
+    from serial.tools import list_ports
+except ImportError:  # pyserial is only used to identify boards by serial number
+    list_ports = None
+
+# Flash address of the FPGA bitstream behind the ESP32 bridge
+FPGA_FLASH_ADDRESS = 0x100000
+
+# Erase granularity of the SPI flash
+FLASH_SECTOR_SIZE = 4096
+
+# Per-board record of the last image flashed (in the platform's .cache directory)
+FLASH_MANIFEST_DIR = "flash_manifests"
+FLASH_MANIFEST_VERSION = 1
+
+# USB vendor IDs of the bridges boards are programmed through: Espressif
+# native USB, Silicon Labs CP210x, WCH CH34x and FTDI (also emulated by the
+# Tang Nano BL702)
+BRIDGE_USB_VIDS = (0x303A, 0x10C4, 0x1A86, 0x0403)
+
+# Option selecting the port or device for each multi-board upload protocol
+PORT_OPTIONS = {
+    "pesptool": "--port",
+    "openfpgaloader": "-d",
+    "gowin": "--location",
+}
+
+# write-flash options for board_build.fpga_upload_compress; with "auto"
+# pesptool picks, which is to deflate whenever its flasher stub runs
+UPLOAD_COMPRESS_FLAGS = {"1": ["--compress"], "0": ["--no-compress"]}
+
+# Per-board results of the last multi-board upload (in $BUILD_DIR)
+UPLOAD_RESULTS_NAME = "fpga_upload_results.json"
+
+def get_board_identity(port):
+    """Stable name for the board on port: its USB serial number if known, else the port."""
+    if list_ports is not None:
+        try:
+            for info in list_ports.comports():
+                if info.device == port and info.serial_number:
+                    return f"serial-{info.serial_number}"
+        except Exception:
+            pass
+    return f"port-{port}"
+
+def safe_name(text):
+    """text with characters that are unsafe in file names replaced."""
+    return re.sub(r"[^\w.-]", "_", text)
+
+def get_flash_state_dir(env, identity):
+    """Directory holding the flash manifest and last image of one board."""
+    return (Path(os.path.dirname(env.PioPlatform().get_dir())) / ".cache" / FLASH_MANIFEST_DIR
+            / safe_name(identity))
+
+def hash_sectors(image):
+    """SHA-256 of each flash sector covered by image."""
+    return [hashlib.sha256(image[offset:offset + FLASH_SECTOR_SIZE]).hexdigest()
+            for offset in range(0, len(image), FLASH_SECTOR_SIZE)]
+
+def load_flash_manifest(state_dir, address):
+    """Sector hashes of the last image flashed at address, or None if unknown."""
+    try:
+        with open(state_dir / "manifest.json", "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (manifest.get("version") != FLASH_MANIFEST_VERSION
+            or manifest.get("address") != address
+            or manifest.get("sector_size") != FLASH_SECTOR_SIZE
+            or not (state_dir / "last_image.bin").exists()):
+        return None
+    return manifest
+
+def save_flash_manifest(state_dir, address, image_path, sectors):
+    """Record the image now in flash; failures only cost a full write next time."""
+    try:
+        state_dir.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(image_path, state_dir / "last_image.bin")
+        write_json_atomic(state_dir / "manifest.json", {
+            "version": FLASH_MANIFEST_VERSION,
+            "address": address,
+            "sector_size": FLASH_SECTOR_SIZE,
+            "sectors": sectors,
+        })
+    except OSError as e:
+        print(f"Warning: Could not save flash manifest: {e}")
+
+def forget_flash_manifest(state_dir):
+    """Discard the manifest once the flash contents are no longer known."""
+    try:
+        os.remove(state_dir / "manifest.json")
+    except OSError:
+        pass
+
+def find_changed_ranges(old_sectors, new_sectors):
+    """Contiguous runs of sectors that differ, as (first, count) pairs."""
+    ranges = []
+    for index, digest in enumerate(new_sectors):
+        if index < len(old_sectors) and old_sectors[index] == digest:
+            continue
+        if ranges and ranges[-1][0] + ranges[-1][1] == index:
+            ranges[-1][1] += 1
+        else:
+            ranges.append([index, 1])
+    return [tuple(r) for r in ranges]
+
+def get_compress_flags(env):
+    """pesptool write-flash options selected by board_build.fpga_upload_compress."""
+    value = env.BoardConfig().get("build.fpga_upload_compress", "auto")
+    if value in TRUE_VALUES:
+        return UPLOAD_COMPRESS_FLAGS["1"]
+    if value in FALSE_VALUES:
+        return UPLOAD_COMPRESS_FLAGS["0"]
+    return []
+
+def run_uploader(command):
+    print(" ".join(command))
+    try:
+        return subprocess.call(command)
+    except OSError as e:
+        print(f"Error: Could not run {command[0]}: {e}")
+        return 1
+
+def delta_upload_action(target, source, env):
+    """SCons action: flash only the sectors that changed since the last upload.
+
+    The previous image is kept per board. Before writing a delta, the
+    flash is checked against it with pesptool verify-flash (an on-chip
+    checksum), so a board flashed by other means gets a full write.
+    """
+    return delta_upload(env, env.subst("$UPLOADER"), env.subst("$UPLOAD_PORT"), str(source[0]),
+                        get_upload_address(env))
+
+def get_upload_address(env):
+    """Flash address images are uploaded to: the bitstream's, or 0x0 for a combined image."""
+    return env.get("FPGA_UPLOAD_ADDRESS", FPGA_FLASH_ADDRESS)
+
+def delta_upload(env, uploader, port, image_path, address):
+    """Write image_path at address on the board on port, skipping unchanged sectors."""
+    with open(image_path, "rb") as f:
+        image = f.read()
+    sectors = hash_sectors(image)
+    if not port:
+        print("Warning: Delta upload needs upload_port to identify the board, writing full image")
+        return run_uploader([uploader, "write-flash"] + get_compress_flags(env)
+                            + [hex(address), image_path])
+
+    base = [uploader, "--port", port]
+    state_dir = get_flash_state_dir(env, get_board_identity(port))
+    manifest = load_flash_manifest(state_dir, address)
+    ranges = None
+    if manifest is None:
+        print("No flash manifest for this board, writing full image")
+    elif run_uploader(base + ["verify-flash", hex(address), str(state_dir / "last_image.bin")]) != 0:
+        print("Flash contents differ from the last upload, writing full image")
+    else:
+        ranges = find_changed_ranges(manifest["sectors"], sectors)
+
+    if ranges is None:
+        forget_flash_manifest(state_dir)
+        returncode = run_uploader(base + ["write-flash"] + get_compress_flags(env)
+                                  + [hex(address), image_path])
+    elif not ranges:
+        print("✓ FPGA flash already up to date")
+        return 0
+    else:
+        changed = sum(count for _, count in ranges)
+        print(f"Writing {changed} of {len(sectors)} sector(s) "
+              f"({changed * FLASH_SECTOR_SIZE // 1024} KB of {len(image) // 1024} KB)")
+        forget_flash_manifest(state_dir)
+        state_dir.mkdir(parents=True, exist_ok=True)
+        command = base + ["write-flash"] + get_compress_flags(env)
+        for first, count in ranges:
+            offset = first * FLASH_SECTOR_SIZE
+            chunk_path = state_dir / f"delta_{address + offset:08x}.bin"
+            chunk_path.write_bytes(image[offset:offset + count * FLASH_SECTOR_SIZE])
+            command += [hex(address + offset), str(chunk_path)]
+        returncode = run_uploader(command)
+        for chunk_path in state_dir.glob("delta_*.bin"):
+            chunk_path.unlink()
+
+    if returncode == 0:
+        save_flash_manifest(state_dir, address, image_path, sectors)
+    return returncode
+
+def list_bridge_ports():
+    """Serial ports of attached USB bridges, found with pyserial."""
+    if list_ports is None:
+        print("Warning: pyserial is not installed, cannot enumerate upload ports")
+        return []
+    return sorted(info.device for info in list_ports.comports() if info.vid in BRIDGE_USB_VIDS)
+
+def resolve_upload_ports(value):
+    """Expand board_build.fpga_upload_ports into a list of ports.
+
+    Entries are separated by commas or newlines and may be glob patterns
+    (matched against device files and the ports pyserial reports), or
+    "auto" for every attached USB bridge.
+    """
+    ports = []
+    for entry in re.split(r"[,\n]", value):
+        entry = entry.strip()
+        if not entry:
+            continue
+        if entry == "auto":
+            ports.extend(list_bridge_ports())
+        elif glob.has_magic(entry):
+            matches = glob.glob(entry)
+            if not matches and list_ports is not None:
+                matches = [info.device for info in list_ports.comports()
+                           if fnmatch.fnmatch(info.device, entry)]
+            ports.extend(sorted(matches))
+        else:
+            ports.append(entry)
+    return list(dict.fromkeys(ports))
+
+def get_port_upload_command(env, protocol, port, image_path):
+    """Uploader command line writing image_path to the board on port."""
+    uploader = env.subst("$UPLOADER")
+    if protocol == "pesptool":
+        return ([uploader, "--port", port, "write-flash"] + get_compress_flags(env)
+                + [hex(get_upload_address(env)), image_path])
+    flags = [env.subst(flag) for flag in env.get("UPLOADERFLAGS", [])]
+    return [uploader, PORT_OPTIONS[protocol], port] + flags + [image_path]
+
+def upload_to_port(command, log_path, retries):
+    """Run an upload, retrying on failure; the output goes to log_path."""
+    start = time.time()
+    attempts = 0
+    with open(log_path, "w", encoding="utf-8") as log:
+        while True:
+            attempts += 1
+            log.write(f"$ {' '.join(command)}\n")
+            log.flush()
+            try:
+                returncode = subprocess.call(command, stdout=log, stderr=subprocess.STDOUT)
+            except OSError as e:
+                log.write(f"Error: Could not run {command[0]}: {e}\n")
+                returncode = 1
+            if returncode == 0 or attempts > retries:
+                break
+            log.write(f"Attempt {attempts} failed with exit code {returncode}, retrying\n")
+    return {
+        "ok": returncode == 0,
+        "returncode": returncode,
+        "attempts": attempts,
+        "seconds": round(time.time() - start, 3),
+        "log": str(log_path),
+    }
+
+def multi_upload_action(target, source, env):
+    """SCons action: flash the bitstream to every board in board_build.fpga_upload_ports.
+
+    Boards are programmed in parallel by a bounded pool of uploader
+    processes. A failed board is retried without holding up the others;
+    per-board results are printed and written to fpga_upload_results.json.
+    """
+    board = env.BoardConfig()
+    protocol = env.subst("$UPLOAD_PROTOCOL")
+    ports = resolve_upload_ports(board.get("build.fpga_upload_ports", ""))
+    if not ports:
+        print("Error: No boards found for board_build.fpga_upload_ports")
+        return 1
+    try:
+        jobs = int(board.get("build.fpga_upload_jobs", "8"))
+        retries = int(board.get("build.fpga_upload_retries", "1"))
+    except (TypeError, ValueError):
+        jobs, retries = 8, 1
+    jobs = max(1, min(jobs, len(ports)))
+
+    image_path = str(source[0])
+    log_dir = Path(env.subst("$BUILD_DIR")) / "upload_logs"
+    log_dir.mkdir(parents=True, exist_ok=True)
+    print(f"Uploading to {len(ports)} board(s), {jobs} at a time...")
+
+    results = {}
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {}
+        for port in ports:
+            command = get_port_upload_command(env, protocol, port, image_path)
+            log_path = log_dir / f"{safe_name(port)}.log"
+            futures[executor.submit(upload_to_port, command, log_path, retries)] = port
+        for future in as_completed(futures):
+            port = futures[future]
+            result = results[port] = future.result()
+            status = "OK" if result["ok"] else f"FAILED (exit code {result['returncode']})"
+            retried = f", {result['attempts']} attempts" if result["attempts"] > 1 else ""
+            print(f"  {port}: {status} in {result['seconds']:.1f}s{retried}")
+
+    failed = [port for port in ports if not results[port]["ok"]]
+    print(f"Uploaded {len(ports) - len(failed)} of {len(ports)} board(s) "
+          f"in {time.time() - start:.1f}s")
+    for port in failed:
+        print(f"  Failed: {port} (log: {results[port]['log']})")
+
+    try:
+        with open(Path(env.subst("$BUILD_DIR")) / UPLOAD_RESULTS_NAME, "w", encoding="utf-8") as f:
+            json.dump({"protocol": protocol, "boards": {port: results[port] for port in ports}},
+                      f, indent=2)
+    except OSError as e:
+        print(f"Warning: Could not write upload results: {e}")
+    return 1 if failed else 0
+
+# Register the upload actions with the environment
+env["FPGA_DELTA_UPLOAD_ACTION"] = delta_upload_action
+env["FPGA_MULTI_UPLOAD_ACTION"] = multi_upload_action
+env["FPGA_UPLOAD_COMPRESS_FLAGS"] = get_compress_flags
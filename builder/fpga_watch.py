@@ -0,0 +1,156 @@
+"""
+FPGA Watch Mode
+
+Rebuilds the FPGA bitstream whenever sources under fpga/src or
+fpga/constraints change (pio run -t watch), reusing this PlatformIO
+process instead of starting a new one for every save.
+"""
+
+Import("env")
+import os
+import time
+import threading
+from pathlib import Path
+from fpga_common import TRUE_VALUES
+
+# Subdirectories of fpga/ whose files trigger a rebuild
+WATCH_DIRS = ("src", "constraints")
+
+# Seconds between checks for changed files
+WATCH_POLL_INTERVAL = 0.5
+
+def snapshot_watched_files(fpga_dir):
+    """Map every watched file to its (size, mtime_ns).
+
+    Hidden files and editor backups are ignored, so swap files written
+    while saving do not trigger builds of their own.
+    """
+    snapshot = {}
+    for subdir in WATCH_DIRS:
+        for dirpath, dirnames, filenames in os.walk(Path(fpga_dir) / subdir):
+            dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+            for name in filenames:
+                if name.startswith(".") or name.endswith("~"):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    info = os.stat(path)
+                except OSError:
+                    continue
+                snapshot[path] = (info.st_size, info.st_mtime_ns)
+    return snapshot
+
+def wait_for_quiet(fpga_dir, snapshot, debounce):
+    """Wait until no watched file has changed for debounce seconds."""
+    while True:
+        time.sleep(debounce)
+        settled = snapshot_watched_files(fpga_dir)
+        if settled == snapshot:
+            return snapshot
+        snapshot = settled
+
+def describe_changes(old, new, fpga_dir):
+    """Short list of the files that differ between two snapshots."""
+    changed = sorted(path for path in set(old) | set(new) if old.get(path) != new.get(path))
+    names = [os.path.relpath(path, fpga_dir) for path in changed[:3]]
+    if len(changed) > 3:
+        names.append(f"and {len(changed) - 3} more")
+    return ", ".join(names)
+
+class WatchBuilder:
+    """Runs builds in the background, restarting them when sources change again."""
+
+    def __init__(self, env, upload_actions):
+        self.env = env
+        self.upload_actions = upload_actions
+        self.lock = threading.Lock()
+        self.pending = False
+        self.thread = None
+
+    def request(self):
+        """Start a build, cancelling the one in progress if there is one."""
+        with self.lock:
+            self.pending = True
+            if self.thread is not None and self.thread.is_alive():
+                print("Cancelling obsolete FPGA build...")
+                self.env["FPGA_CANCEL_BUILDS"]()
+                return
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def cancel(self):
+        with self.lock:
+            self.pending = False
+        self.env["FPGA_CANCEL_BUILDS"]()
+
+    def run(self):
+        while True:
+            with self.lock:
+                if not self.pending:
+                    return
+                self.pending = False
+
+            # Each build gets its own timings in the build report
+            self.env["FPGA_TELEMETRY"] = None
+            try:
+                returncode = self.env["FPGA_BUILD_ACTION"]([], [], self.env)
+            except Exception as e:
+                print(f"Error: FPGA build failed: {e}")
+                returncode = 1
+
+            with self.lock:
+                if self.pending:
+                    # Sources changed during the build; its result is stale
+                    continue
+            if returncode == 0 and self.upload_actions:
+                self.upload()
+            print("Watching for changes...")
+
+    def upload(self):
+        bitstream = self.env.File(os.path.join(self.env.subst("$BUILD_DIR"),
+                                               self.env.subst("$PROGNAME$PROGSUFFIX")))
+        for action in self.upload_actions:
+            try:
+                returncode = action([], [bitstream], self.env)
+            except Exception as e:
+                print(f"Error: Upload failed: {e}")
+                return
+            if returncode:
+                print(f"Upload failed with exit code {returncode}")
+                return
+
+def watch_fpga_action(target, source, env):
+    """SCons action: rebuild (and optionally upload) the bitstream on every change."""
+    board = env.BoardConfig()
+    fpga_dir = Path(env.get("PROJECT_DIR")) / "fpga"
+    try:
+        debounce = float(board.get("build.fpga_watch_debounce", "0.5"))
+    except (TypeError, ValueError):
+        debounce = 0.5
+    upload_actions = []
+    if board.get("build.fpga_watch_upload", "0") in TRUE_VALUES:
+        upload_actions = env.get("FPGA_UPLOAD_ACTIONS") or []
+        if not upload_actions:
+            print("Warning: No upload_protocol configured, watch mode will not upload")
+
+    print(f"Watching {', '.join(str(fpga_dir / d) for d in WATCH_DIRS)} (Ctrl+C to stop)")
+    builder = WatchBuilder(env, upload_actions)
+    snapshot = snapshot_watched_files(fpga_dir)
+    builder.request()
+    try:
+        while True:
+            time.sleep(WATCH_POLL_INTERVAL)
+            current = snapshot_watched_files(fpga_dir)
+            if current == snapshot:
+                continue
+            current = wait_for_quiet(fpga_dir, current, debounce)
+            print(f"Changed: {describe_changes(snapshot, current, fpga_dir)}")
+            snapshot = current
+            builder.request()
+    except KeyboardInterrupt:
+        builder.cancel()
+        print("Stopped watching")
+    return 0
+
+# Register the watch action with the environment
+env["FPGA_WATCH_ACTION"] = watch_fpga_action
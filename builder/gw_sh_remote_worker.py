@@ -0,0 +1,378 @@
+"""
+Remote gw_sh Build Worker
+
+Runs gw_sh builds for other machines, so laptops can hand place & route to
+a faster build box. Sources are kept in a content-addressed blob store, so
+clients only upload files the worker has not seen. Builds from several
+clients queue for a fixed number of gw_sh slots.
+
+Serve over TCP (anyone who can connect can run Tcl, so keep it on a
+trusted network and set a token):
+  python3 gw_sh_remote_worker.py --listen 0.0.0.0:7878 --token SECRET --gowin-home /opt/gowin
+Or let clients start it through SSH, speaking the protocol on stdin/stdout:
+  python3 gw_sh_remote_worker.py --stdio --gowin-home /opt/gowin
+
+Protocol: each message is a JSON line, followed by "size" bytes of payload
+if it has a size.
+  hello {"token", "version"}        -> {"ok", "toolchain_version"} or {"ok": false, "error"}
+  have  {"blobs": [sha256, ...]}    -> {"missing": [sha256, ...]}
+  blob  {"sha256", "size"} + data   (no reply)
+  build {"files": {path: sha256}, "gprj": path, "tcl", "timeout", "abort_on_error"}
+        -> {"event": "queued"}, {"event": "log", "line"} ...,
+           {"event": "done", "returncode", "files": [{"path", "size"}]} + file data
+If the client disconnects during a build, gw_sh is killed.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+import threading
+import subprocess
+import socketserver
+from pathlib import Path
+
+from fpga_common import write_atomic, get_process_group_args, kill_process_tree, check_token
+
+try:
+    import fcntl
+    msvcrt = None
+except ImportError:  # Windows locks the slot files with msvcrt instead
+    fcntl = None
+    import msvcrt
+
+PROTOCOL_VERSION = 1
+
+# Output directories of a gw_sh run sent back to the client
+OUTPUT_DIRS = ("pnr", "gwsynthesis")
+
+# gw_sh log lines after which the run can no longer succeed
+FATAL_PATTERN = re.compile(r"^\s*(ERROR|FATAL)\b")
+
+# Seconds between attempts to get a free gw_sh slot
+SLOT_POLL_INTERVAL = 0.5
+
+# Blobs not used for this many days are removed at startup
+BLOB_MAX_AGE_DAYS = 30
+
+
+def read_message(rfile):
+    """Next message as (header, payload), or (None, b"") at end of stream."""
+    line = rfile.readline()
+    if not line:
+        return None, b""
+    header = json.loads(line.decode("utf-8"))
+    size = header.get("size", 0)
+    payload = rfile.read(size) if size else b""
+    if len(payload) != size:
+        raise ConnectionError("connection closed in the middle of a message")
+    return header, payload
+
+
+def send_message(wfile, header, payload=b""):
+    if payload:
+        header = dict(header, size=len(payload))
+    wfile.write(json.dumps(header).encode("utf-8") + b"\n")
+    if payload:
+        wfile.write(payload)
+    wfile.flush()
+
+
+def detect_toolchain_version(gowin_home):
+    """Version from the installation directory name, e.g. Gowin_V1.9.11.03_Education_x64.
+
+    Matches what fpga_builder.py derives locally, so local and remote
+    builds share bitstream cache entries.
+    """
+    for part in reversed(Path(gowin_home).parts):
+        match = re.search(r"[Vv](\d+(?:\.\d+)+)", part)
+        if match:
+            return match.group(1)
+    try:
+        info = find_gw_sh(gowin_home).stat()
+        return f"unknown-{info.st_size}-{int(info.st_mtime)}"
+    except (AttributeError, OSError):
+        return "unknown"
+
+
+def find_gw_sh(gowin_home):
+    for name in ("gw_sh.exe", "gw_sh"):
+        path = Path(gowin_home) / "IDE" / "bin" / name
+        if path.exists():
+            return path
+    return None
+
+
+def try_lock(lock_file):
+    """Lock an open file exclusively without waiting; False if another holder has it.
+
+    Separate opens of the file conflict, also within one process.
+    """
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def unlock(lock_file):
+    if fcntl is not None:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+    else:
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def is_safe_path(path):
+    """Whether a bundle path stays inside the job directory."""
+    parts = Path(path).parts
+    return bool(parts) and not Path(path).is_absolute() and ".." not in parts and ":" not in path
+
+
+class BlobStore:
+    """Files by SHA-256, shared by all builds of the worker."""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def path(self, digest):
+        return self.root / digest[:2] / digest[2:]
+
+    def has(self, digest):
+        path = self.path(digest)
+        if not path.exists():
+            return False
+        # Keep blobs in use from being pruned
+        os.utime(path)
+        return True
+
+    def add(self, digest, data):
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f"blob {digest[:12]} does not match its hash")
+        write_atomic(self.path(digest), data)
+
+    def prune(self, max_age_days):
+        cutoff = time.time() - max_age_days * 86400
+        for path in self.root.glob("*/*"):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except OSError:
+                pass
+
+
+class Slot:
+    """One of the worker's gw_sh slots, held for the duration of a build.
+
+    Slots are lock files, so workers started per SSH session share them.
+    """
+
+    def __init__(self, slot_dir, jobs, notify):
+        self.slot_dir = Path(slot_dir)
+        self.jobs = jobs
+        self.notify = notify
+        self.file = None
+
+    def __enter__(self):
+        self.slot_dir.mkdir(parents=True, exist_ok=True)
+        notified = False
+        while True:
+            for index in range(self.jobs):
+                lock_file = open(self.slot_dir / f"{index}.lock", "a")
+                if try_lock(lock_file):
+                    self.file = lock_file
+                    return self
+                lock_file.close()
+            if not notified:
+                self.notify()
+                notified = True
+            time.sleep(SLOT_POLL_INTERVAL)
+
+    def __exit__(self, *exc):
+        try:
+            unlock(self.file)
+        except OSError:
+            pass
+        self.file.close()
+
+
+class Worker:
+    """Blob store, gw_sh and slot settings shared by all client sessions."""
+
+    def __init__(self, gowin_home, work_dir, jobs, token):
+        self.gowin_home = Path(gowin_home)
+        self.gw_sh = find_gw_sh(gowin_home)
+        self.work_dir = Path(work_dir)
+        self.blobs = BlobStore(self.work_dir / "blobs")
+        self.jobs = jobs
+        self.token = token
+        self.toolchain_version = detect_toolchain_version(gowin_home)
+
+    def serve(self, rfile, wfile):
+        """Handle one client session until it disconnects.
+
+        Nothing but hello is served until hello has checked the token.
+        """
+        authenticated = False
+        while True:
+            header, payload = read_message(rfile)
+            if header is None:
+                return
+            op = header.get("op")
+            if op != "hello" and not authenticated:
+                send_message(wfile, {"ok": False, "error": "not authenticated, send hello first"})
+                return
+            if op == "hello":
+                if self.token and not check_token(header.get("token"), self.token):
+                    send_message(wfile, {"ok": False, "error": "invalid token"})
+                    return
+                if header.get("version") != PROTOCOL_VERSION or self.gw_sh is None:
+                    error = (f"gw_sh not found in {self.gowin_home}" if self.gw_sh is None
+                             else f"protocol version {PROTOCOL_VERSION} required")
+                    send_message(wfile, {"ok": False, "error": error})
+                    return
+                authenticated = True
+                send_message(wfile, {"ok": True, "toolchain_version": self.toolchain_version})
+            elif op == "have":
+                missing = [digest for digest in header["blobs"] if not self.blobs.has(digest)]
+                send_message(wfile, {"missing": missing})
+            elif op == "blob":
+                self.blobs.add(header["sha256"], payload)
+            elif op == "build":
+                self.build(header, wfile)
+            else:
+                return
+
+    def build(self, request, wfile):
+        """Run gw_sh on a bundle, streaming its log; the outputs follow the done message."""
+        self.work_dir.joinpath("jobs").mkdir(parents=True, exist_ok=True)
+        job_dir = Path(tempfile.mkdtemp(prefix="job-", dir=self.work_dir / "jobs"))
+        try:
+            for path, digest in request["files"].items():
+                if not is_safe_path(path) or not self.blobs.has(digest):
+                    send_message(wfile, {"event": "done", "returncode": 1, "files": [],
+                                         "error": f"invalid or missing file {path}"})
+                    return
+                dest = job_dir / path
+                dest.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copyfile(self.blobs.path(digest), dest)
+            if not is_safe_path(request["gprj"]) or request["gprj"] not in request["files"]:
+                send_message(wfile, {"event": "done", "returncode": 1, "files": [],
+                                     "error": "project file missing from the bundle"})
+                return
+            # The Tcl script opens the project as ../<name>.gprj
+            impl_dir = (job_dir / request["gprj"]).parent / "impl"
+            impl_dir.mkdir(exist_ok=True)
+            script = impl_dir / "build_script.tcl"
+            script.write_text(request["tcl"], encoding="utf-8")
+
+            with Slot(self.work_dir / "slots", self.jobs,
+                      lambda: send_message(wfile, {"event": "queued", "slots": self.jobs})):
+                returncode = self.run_gw_sh(script, impl_dir, request, wfile)
+
+            outputs = sorted(path for name in OUTPUT_DIRS
+                             for path in (impl_dir / name).rglob("*") if path.is_file())
+            send_message(wfile, {
+                "event": "done",
+                "returncode": returncode,
+                "files": [{"path": path.relative_to(impl_dir).as_posix(),
+                           "size": path.stat().st_size} for path in outputs],
+            })
+            for path in outputs:
+                with open(path, "rb") as f:
+                    shutil.copyfileobj(f, wfile)
+            wfile.flush()
+        finally:
+            shutil.rmtree(job_dir, ignore_errors=True)
+
+    def run_gw_sh(self, script, impl_dir, request, wfile):
+        proc = subprocess.Popen([str(self.gw_sh), str(script)], cwd=str(impl_dir),
+                                stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT, text=True, errors="replace",
+                                bufsize=1, **get_process_group_args())
+        stop_reasons = []
+
+        def stop(reason):
+            stop_reasons.append(reason)
+            kill_process_tree(proc)
+
+        timer = threading.Timer(request.get("timeout", 600), stop,
+                                [f"gw_sh timed out after {request.get('timeout', 600)}s"])
+        timer.start()
+        try:
+            for line in proc.stdout:
+                try:
+                    send_message(wfile, {"event": "log", "line": line.rstrip("\n")})
+                except OSError:
+                    stop("client disconnected")
+                    raise
+                if request.get("abort_on_error", True) and FATAL_PATTERN.match(line):
+                    stop(f"Aborted on fatal error: {line.strip()}")
+                    break
+            proc.wait()
+        finally:
+            timer.cancel()
+            proc.stdout.close()
+        if stop_reasons:
+            send_message(wfile, {"event": "log", "line": stop_reasons[0]})
+            return 1
+        return proc.returncode
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        try:
+            self.server.worker.serve(self.rfile, self.wfile)
+        except (OSError, ValueError, KeyError, ConnectionError) as e:
+            print(f"Session from {self.client_address[0]} ended: {e}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--gowin-home", default=os.environ.get("GOWIN_HOME", ""),
+                        help="Gowin installation (default: $GOWIN_HOME)")
+    parser.add_argument("--work-dir", default=os.path.expanduser("~/.cache/gowin-remote"),
+                        help="blob store and job directory")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1,
+                        help="concurrent gw_sh runs (default: CPU count)")
+    parser.add_argument("--listen", help="serve over TCP on host:port")
+    parser.add_argument("--stdio", action="store_true", help="serve one client on stdin/stdout")
+    parser.add_argument("--token", default=os.environ.get("GOWIN_REMOTE_TOKEN", ""),
+                        help="token clients must send (default: $GOWIN_REMOTE_TOKEN)")
+    args = parser.parse_args()
+    if not args.gowin_home:
+        parser.error("--gowin-home or GOWIN_HOME is required")
+    if bool(args.listen) == args.stdio:
+        parser.error("use either --listen or --stdio")
+
+    worker = Worker(args.gowin_home, args.work_dir, max(1, args.jobs), args.token)
+    if args.stdio:
+        worker.serve(sys.stdin.buffer, sys.stdout.buffer)
+        return
+    worker.blobs.prune(BLOB_MAX_AGE_DAYS)
+    host, _, port = args.listen.rpartition(":")
+    socketserver.ThreadingTCPServer.daemon_threads = True
+    socketserver.ThreadingTCPServer.allow_reuse_address = True
+    server = socketserver.ThreadingTCPServer((host or "127.0.0.1", int(port)), RequestHandler)
+    server.worker = worker
+    print(f"Serving gw_sh {worker.toolchain_version} builds on {host or '127.0.0.1'}:{port}, "
+          f"{worker.jobs} at a time", file=sys.stderr)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
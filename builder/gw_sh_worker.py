@@ -0,0 +1,250 @@
+"""
+Persistent gw_sh Worker
+
+Keeps one interactive gw_sh session alive and runs Tcl scripts in it on
+behalf of successive builds, so the toolchain runtime and device database
+are only loaded once. Started and managed by fpga_builder.py; it listens
+on a localhost port recorded, with an access token, in a state file and
+exits after a period without requests.
+
+Protocol: the client sends one JSON line, {"token", "cmd", ...}.
+  ping: the worker checks gw_sh responds and replies "ok" or "error".
+  run:  {"cwd", "script"}; gw_sh output is streamed back line by line,
+        followed by "<DONE_MARKER> <exit code>". If the client disconnects
+        mid-run, the gw_sh session is killed and restarted on next use.
+"""
+
+import os
+import json
+import time
+import queue
+import select
+import socket
+import secrets
+import argparse
+import threading
+import subprocess
+import socketserver
+from pathlib import Path
+
+from fpga_common import write_json_atomic, get_process_group_args, kill_process_tree, check_token
+
+# Must match GW_SH_WORKER_DONE in fpga_builder.py
+DONE_MARKER = "__PIO_GW_SH_DONE__"
+PING_MARKER = "__PIO_GW_SH_PING__"
+
+# gw_sh loads its runtime and device database on first use
+STARTUP_TIMEOUT = 120
+PING_TIMEOUT = 10
+
+
+class GwShSession:
+    """An interactive gw_sh process driven over stdin/stdout."""
+
+    def __init__(self, gw_sh):
+        self.proc = subprocess.Popen(
+            [gw_sh],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            errors="replace",
+            bufsize=1,
+            **get_process_group_args()
+        )
+        self.lines = queue.Queue()
+        self.ping_count = 0
+        threading.Thread(target=self.read_output, daemon=True).start()
+
+    def read_output(self):
+        for line in self.proc.stdout:
+            self.lines.put(line)
+        self.lines.put(None)
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def send(self, text):
+        self.proc.stdin.write(text)
+        self.proc.stdin.flush()
+
+    def kill(self):
+        """Kill gw_sh together with any tools it is running."""
+        kill_process_tree(self.proc)
+
+    def ping(self, timeout):
+        """Check that gw_sh still evaluates commands."""
+        if not self.alive():
+            return False
+        self.ping_count += 1
+        marker = f"{PING_MARKER} {self.ping_count}"
+        try:
+            self.send(f'puts "{marker}"\nflush stdout\n')
+        except OSError:
+            return False
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                line = self.lines.get(timeout=max(0.1, deadline - time.time()))
+            except queue.Empty:
+                break
+            if line is None:
+                return False
+            if marker in line:
+                return True
+        return False
+
+    def run(self, cwd, script, send_line, client_gone):
+        """Source a Tcl script in cwd, forwarding output; returns the exit code.
+
+        The code is 1 only if the script raised a Tcl error; the client
+        checks that the stages it ran wrote their outputs.
+        """
+        script_path = Path(cwd) / ".gw_sh_worker_script.tcl"
+        script_path.write_text(script, encoding="utf-8")
+        self.send(
+            f"cd {{{Path(cwd).as_posix()}}}\n"
+            f"if {{[catch {{source {{{script_path.as_posix()}}}}} pio_error]}} {{\n"
+            f'    puts "ERROR: $pio_error"\n'
+            f'    puts "{DONE_MARKER} 1"\n'
+            f"}} else {{\n"
+            f'    puts "{DONE_MARKER} 0"\n'
+            f"}}\n"
+            f"flush stdout\n"
+        )
+        while True:
+            try:
+                line = self.lines.get(timeout=1)
+            except queue.Empty:
+                if client_gone():
+                    raise ConnectionError("client disconnected")
+                continue
+            if line is None:
+                return 1
+            if DONE_MARKER in line:
+                return int(line.split(DONE_MARKER, 1)[1].split()[0])
+            send_line(line)
+
+
+class Worker:
+    """Owns the gw_sh session and serializes requests to it."""
+
+    def __init__(self, gw_sh, idle_timeout):
+        self.gw_sh = gw_sh
+        self.idle_timeout = idle_timeout
+        self.token = secrets.token_hex(16)
+        self.session = None
+        self.lock = threading.Lock()
+        self.last_activity = time.time()
+
+    def ensure_session(self):
+        if self.session is not None and self.session.ping(PING_TIMEOUT):
+            return True
+        if self.session is not None:
+            self.session.kill()
+        self.session = GwShSession(self.gw_sh)
+        if self.session.ping(STARTUP_TIMEOUT):
+            return True
+        self.session.kill()
+        self.session = None
+        return False
+
+    def shutdown(self):
+        if self.session is not None:
+            self.session.kill()
+            self.session = None
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        worker = self.server.worker
+        try:
+            request = json.loads(self.rfile.readline().decode("utf-8"))
+        except ValueError:
+            return
+        if not check_token(request.get("token"), worker.token):
+            return
+
+        with worker.lock:
+            worker.last_activity = time.time()
+            try:
+                if request.get("cmd") == "ping":
+                    self.send_line("ok\n" if worker.ensure_session() else "error\n")
+                elif request.get("cmd") == "run":
+                    if not worker.ensure_session():
+                        self.send_line("ERROR: gw_sh worker session failed to start\n")
+                        self.send_line(f"{DONE_MARKER} 1\n")
+                        return
+                    try:
+                        code = worker.session.run(request["cwd"], request["script"],
+                                                  self.send_line, self.client_gone)
+                    except (OSError, ConnectionError):
+                        # The build gave up on this run (fatal error or timeout)
+                        worker.shutdown()
+                        return
+                    self.send_line(f"{DONE_MARKER} {code}\n")
+            finally:
+                worker.last_activity = time.time()
+
+    def send_line(self, line):
+        self.wfile.write(line.encode("utf-8"))
+        self.wfile.flush()
+
+    def client_gone(self):
+        readable, _, _ = select.select([self.connection], [], [], 0)
+        if not readable:
+            return False
+        try:
+            return self.connection.recv(1, socket.MSG_PEEK) == b""
+        except OSError:
+            return True
+
+
+def watch_idle(server, worker, state_path):
+    """Shut the worker down once it has been idle for idle_timeout seconds."""
+    while True:
+        time.sleep(5)
+        if worker.lock.locked():
+            continue
+        if time.time() - worker.last_activity > worker.idle_timeout:
+            break
+    try:
+        os.remove(state_path)
+    except OSError:
+        pass
+    worker.shutdown()
+    server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--gw-sh", required=True)
+    parser.add_argument("--state", required=True)
+    parser.add_argument("--idle-timeout", type=float, default=1800)
+    args = parser.parse_args()
+
+    worker = Worker(args.gw_sh, args.idle_timeout)
+    socketserver.ThreadingTCPServer.daemon_threads = True
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), RequestHandler)
+    server.worker = worker
+
+    state = {
+        "pid": os.getpid(),
+        "port": server.server_address[1],
+        "token": worker.token,
+        "gw_sh": args.gw_sh,
+        "started": time.time(),
+    }
+    write_json_atomic(args.state, state)
+
+    threading.Thread(target=watch_idle, args=(server, worker, args.state), daemon=True).start()
+    try:
+        server.serve_forever()
+    finally:
+        worker.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
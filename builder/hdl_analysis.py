@@ -0,0 +1,430 @@
+"""
+HDL Source Analysis Helpers
+
+Lightweight parsing of Verilog/SystemVerilog and VHDL sources, used to
+work out which files a design actually depends on.
+"""
+
+Import("env")
+import os
+import re
+import json
+from pathlib import Path
+from fpga_common import write_json_atomic
+
+# Verilog comments; string literals are matched so they are left intact
+VERILOG_COMMENT_PATTERN = re.compile(r'"(?:\\.|[^"\\\n])*"|//[^\n]*|/\*.*?\*/', re.S)
+VERILOG_DEFINE_PATTERN = re.compile(
+    r"\b(?:module|macromodule|interface|program|package|primitive)\s+"
+    r"(?:(?:automatic|static)\s+)?([A-Za-z_][\w$]*)")
+VERILOG_INCLUDE_PATTERN = re.compile(r'`include\s+"([^"]+)"')
+VERILOG_IDENTIFIER_PATTERN = re.compile(r"[A-Za-z_][\w$]*")
+
+# VHDL is matched on lower-cased text with comments removed
+VHDL_COMMENT_PATTERN = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+VHDL_ENTITY_PATTERN = re.compile(r"\bentity\s+(\w+)\s+is\b")
+VHDL_PACKAGE_PATTERN = re.compile(r"\bpackage\s+(?!body\b)(\w+)\s+is\b")
+VHDL_COMPANION_PATTERN = re.compile(
+    r"\barchitecture\s+\w+\s+of\s+(\w+)\s+is\b|\bpackage\s+body\s+(\w+)\s+is\b")
+VHDL_IDENTIFIER_PATTERN = re.compile(r"[a-z_]\w*")
+
+VHDL_EXTENSIONS = (".vhd", ".vhdl")
+
+# Port declarations of a top module
+VERILOG_DIRECTION_PATTERN = re.compile(r"\b(input|output|inout)\b")
+VERILOG_RANGE_PATTERN = re.compile(r"\[([^:\]]+):([^\]]+)\]")
+VERILOG_PORT_KEYWORDS = {"input", "output", "inout", "wire", "reg", "logic", "tri", "var",
+                         "signed", "unsigned", "integer", "bit", "byte"}
+VHDL_RANGE_PATTERN = re.compile(r"\(\s*(\d+)\s+(?:downto|to)\s+(\d+)\s*\)")
+VHDL_SCALAR_TYPES = {"std_logic", "std_ulogic", "bit", "boolean"}
+
+# Module definitions in a synthesized Verilog netlist
+NETLIST_MODULE_PATTERN = re.compile(
+    r"^[ \t]*module\s+([A-Za-z_][\w$]*).*?^[ \t]*endmodule\b[^\n]*\n?", re.S | re.M)
+
+# Parsed file summaries kept in fpga/impl
+HDL_GRAPH_NAME = "hdl_graph.json"
+HDL_GRAPH_VERSION = 1
+
+def strip_verilog_comments(text):
+    """Remove Verilog comments, keeping string literals."""
+    def replace(match):
+        token = match.group(0)
+        return token if token.startswith('"') else " "
+    return VERILOG_COMMENT_PATTERN.sub(replace, text)
+
+def parse_hdl_file(path):
+    """Summarize one HDL file for dependency resolution.
+
+    Returns a dict with the design units the file defines, the units whose
+    companion (VHDL architecture or package body) it contains, its
+    `include targets and every identifier it uses. Names are lower-cased
+    because VHDL is case-insensitive.
+    """
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        text = f.read()
+
+    if str(path).lower().endswith(VHDL_EXTENSIONS):
+        text = VHDL_COMMENT_PATTERN.sub(" ", text.lower())
+        defines = VHDL_ENTITY_PATTERN.findall(text) + VHDL_PACKAGE_PATTERN.findall(text)
+        companions = [arch or body for arch, body in VHDL_COMPANION_PATTERN.findall(text)]
+        includes = []
+        identifiers = set(VHDL_IDENTIFIER_PATTERN.findall(text))
+    else:
+        text = strip_verilog_comments(text)
+        defines = [name.lower() for name in VERILOG_DEFINE_PATTERN.findall(text)]
+        companions = []
+        includes = VERILOG_INCLUDE_PATTERN.findall(text)
+        identifiers = {name.lower() for name in VERILOG_IDENTIFIER_PATTERN.findall(text)}
+
+    return {
+        "defines": sorted(set(defines)),
+        "companions": sorted(set(companions)),
+        "includes": sorted(set(includes)),
+        "identifiers": sorted(identifiers),
+    }
+
+def load_hdl_graph(cache_path, files):
+    """Parse files, reusing cached summaries of files whose size and mtime are unchanged.
+
+    Returns ({path: summary}, changed) where changed says whether the
+    cache needs to be saved.
+    """
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+        if cache.get("version") != HDL_GRAPH_VERSION:
+            cache = None
+    except (OSError, ValueError):
+        cache = None
+    cached_files = cache["files"] if cache else {}
+
+    summaries = {}
+    changed = cache is None
+    for path in files:
+        key = str(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entry = cached_files.get(key)
+        if entry is None or entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+            entry = dict(parse_hdl_file(path), size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+            changed = True
+        summaries[key] = entry
+
+    if set(cached_files) - set(summaries):
+        changed = True
+    return summaries, changed
+
+def save_hdl_graph(cache_path, summaries):
+    """Persist parsed file summaries; failures only cost a reparse."""
+    try:
+        write_json_atomic(cache_path, {"version": HDL_GRAPH_VERSION, "files": summaries})
+    except OSError:
+        pass
+
+def load_source_summaries(sources, impl_dir):
+    """Summaries of the scanned HDL sources, using and updating the cache in impl_dir."""
+    hdl_files = sources['verilog'] + sources['vhdl']
+    cache_path = Path(impl_dir) / HDL_GRAPH_NAME
+    summaries, changed = load_hdl_graph(cache_path, hdl_files)
+    if changed:
+        save_hdl_graph(cache_path, summaries)
+    return summaries
+
+def resolve_reachable_files(summaries, top_module, exclude=()):
+    """Files needed to build top_module, or None if no file defines it.
+
+    Design units named in exclude are treated as black boxes: their files
+    are only included if something else needs them. Raises ValueError if
+    a needed file defines one of them.
+    """
+    excluded = {name.lower() for name in exclude}
+    definers = {}
+    companions = {}
+    headers = {}
+    for path, summary in summaries.items():
+        for name in summary["defines"]:
+            definers.setdefault(name, []).append(path)
+        for name in summary["companions"]:
+            companions.setdefault(name, []).append(path)
+        headers.setdefault(os.path.basename(path), []).append(path)
+
+    queue = list(definers.get(top_module.lower(), []))
+    if not queue:
+        return None
+
+    reachable = set()
+    while queue:
+        path = queue.pop()
+        if path in reachable:
+            continue
+        reachable.add(path)
+        summary = summaries[path]
+        for name in excluded.intersection(summary["defines"]):
+            raise ValueError(f"{os.path.basename(path)} defines '{name}' along with other "
+                             f"design units needed by '{top_module}'; move it to its own file")
+
+        for include in summary["includes"]:
+            queue.extend(headers.get(os.path.basename(include), []))
+        # A VHDL entity or package needs its architectures and package bodies
+        for name in summary["defines"]:
+            queue.extend(companions.get(name, []))
+        # Any identifier naming a design unit counts as a use of it. This
+        # over-approximates instantiations, which is the safe direction.
+        for name in summary["identifiers"]:
+            if name not in excluded:
+                queue.extend(definers.get(name, []))
+        for name in summary["companions"]:
+            queue.extend(definers.get(name, []))
+
+    return reachable
+
+def find_reachable_sources(sources, top_module, impl_dir, verbose=True):
+    """Restrict scanned HDL sources to those reachable from top_module.
+
+    Constraint files are always kept. If no source defines top_module
+    (e.g. it comes from an IP core outside src/), sources are returned
+    unchanged.
+    """
+    hdl_files = sources['verilog'] + sources['vhdl']
+    summaries = load_source_summaries(sources, impl_dir)
+
+    reachable = resolve_reachable_files(summaries, top_module)
+    if reachable is None:
+        if verbose:
+            print(f"Warning: Top module '{top_module}' not found in fpga/src, using all sources")
+        return sources
+
+    pruned = {
+        'verilog': [f for f in sources['verilog'] if str(f) in reachable],
+        'vhdl': [f for f in sources['vhdl'] if str(f) in reachable],
+        'constraints': list(sources['constraints']),
+    }
+    unused = len(hdl_files) - len(pruned['verilog']) - len(pruned['vhdl'])
+    if unused and verbose:
+        print(f"  Skipping {unused} HDL file(s) not used by top module '{top_module}'")
+    return pruned
+
+def find_module_sources(sources, module, impl_dir, exclude=()):
+    """HDL files needed to build module, or None if no scanned source defines it.
+
+    Modules named in exclude are left out as black boxes (see
+    resolve_reachable_files, which also raises ValueError).
+    """
+    hdl_files = sources['verilog'] + sources['vhdl']
+    summaries = load_source_summaries(sources, impl_dir)
+
+    reachable = resolve_reachable_files(summaries, module, exclude)
+    if reachable is None:
+        return None
+    return [f for f in hdl_files if str(f) in reachable]
+
+def find_vhdl_dependencies(sources, impl_dir):
+    """Project VHDL files to analyze before each VHDL file, in analysis order.
+
+    Returns {path: [paths]}. A file needs the files defining the entities
+    and packages it names and, for an architecture or package body, the
+    file declaring its entity or package. The cache is read, not updated,
+    as sources may be a subset of the scanned files.
+    """
+    vhdl_files = {str(f): f for f in sources['vhdl']}
+    summaries, _ = load_hdl_graph(Path(impl_dir) / HDL_GRAPH_NAME, list(vhdl_files.values()))
+    definers = {}
+    for path, summary in summaries.items():
+        for name in summary["defines"]:
+            definers.setdefault(name, []).append(path)
+    uses = {}
+    for path, summary in summaries.items():
+        names = set(summary["identifiers"]) | set(summary["companions"])
+        uses[path] = sorted({dep for name in names for dep in definers.get(name, [])
+                             if dep != path})
+
+    dependencies = {}
+    for path in summaries:
+        order, seen = [], {path}
+        def visit(current):
+            for dep in uses[current]:
+                if dep not in seen:
+                    seen.add(dep)
+                    visit(dep)
+                    order.append(dep)
+        visit(path)
+        dependencies[vhdl_files[path]] = [vhdl_files[dep] for dep in order]
+    return dependencies
+
+def find_defined_units(sources, files, impl_dir):
+    """Lower-cased names of the design units that files, a subset of sources, define."""
+    summaries = load_source_summaries(sources, impl_dir)
+    return {name for f in files for name in summaries.get(str(f), {}).get("defines", [])}
+
+def strip_netlist_modules(text, names):
+    """Remove the modules named in names (lower-cased) from a Verilog netlist.
+
+    Returns (text, lower-cased names of the modules it still defines).
+    """
+    kept = set()
+    def replace(match):
+        name = match.group(1).lower()
+        if name in names:
+            return ""
+        kept.add(name)
+        return match.group(0)
+    return NETLIST_MODULE_PATTERN.sub(replace, text), kept
+
+def find_closing_paren(text, start):
+    """Index of the parenthesis closing the one at text[start], or -1."""
+    depth = 0
+    for index in range(start, len(text)):
+        if text[index] == "(":
+            depth += 1
+        elif text[index] == ")":
+            depth -= 1
+            if depth == 0:
+                return index
+    return -1
+
+def split_top_level(text, separator):
+    """Split text on separator, ignoring separators inside brackets."""
+    parts, depth, start = [], 0, 0
+    for index, char in enumerate(text):
+        if char in "([{":
+            depth += 1
+        elif char in ")]}":
+            depth -= 1
+        elif char == separator and depth == 0:
+            parts.append(text[start:index])
+            start = index + 1
+    parts.append(text[start:])
+    return parts
+
+def parse_verilog_range(text):
+    """Bit indices covered by a [msb:lsb] range, or None if not constant."""
+    try:
+        msb, lsb = int(text[0].strip()), int(text[1].strip())
+    except ValueError:
+        return None
+    return (min(msb, lsb), max(msb, lsb))
+
+def parse_verilog_ports(text, top_module):
+    """Ports of a Verilog module as {name: range}, or None if it is not defined here.
+
+    A range is None for scalar ports, a (low, high) pair for constant
+    vectors and "any" for vectors whose bounds depend on parameters.
+    """
+    text = strip_verilog_comments(text)
+    match = re.search(r"\bmodule\s+%s\b" % re.escape(top_module), text)
+    if not match:
+        return None
+    position = match.end()
+    header = re.match(r"\s*(?:import\s+[^;]*;\s*)*(#\s*)?\(", text[position:])
+    if not header:
+        return {}
+    start = position + header.end() - 1
+    if header.group(1):
+        # Skip the parameter list
+        end = find_closing_paren(text, start)
+        following = re.match(r"\s*\(", text[end + 1:])
+        if end < 0 or not following:
+            return {}
+        start = end + following.end()
+    end = find_closing_paren(text, start)
+    port_list = text[start + 1:end]
+    body = text[end:text.find("endmodule", end)]
+
+    def declare(ports, declaration):
+        range_match = VERILOG_RANGE_PATTERN.search(declaration)
+        declaration = VERILOG_RANGE_PATTERN.sub(" ", declaration.split("=")[0])
+        names = [word for word in re.findall(r"[A-Za-z_][\w$]*", declaration)
+                 if word not in VERILOG_PORT_KEYWORDS]
+        if names:
+            port_range = None
+            if range_match:
+                port_range = parse_verilog_range(range_match.groups()) or "any"
+            ports[names[-1]] = port_range
+        return range_match
+
+    ports = {}
+    if VERILOG_DIRECTION_PATTERN.search(port_list):
+        # ANSI header: "input wire [7:0] a, b" gives b the same range as a
+        last_range = None
+        for item in split_top_level(port_list, ","):
+            if VERILOG_DIRECTION_PATTERN.search(item):
+                last_range = declare(ports, item)
+            else:
+                names = re.findall(r"[A-Za-z_][\w$]*", item)
+                if names:
+                    ports[names[-1]] = (parse_verilog_range(last_range.groups()) or "any") \
+                        if last_range else None
+    else:
+        # Port names in the header, directions and ranges in the body
+        names = set(re.findall(r"[A-Za-z_][\w$]*", port_list))
+        for statement in body.split(";"):
+            if not VERILOG_DIRECTION_PATTERN.search(statement):
+                continue
+            range_match = VERILOG_RANGE_PATTERN.search(statement)
+            for item in split_top_level(VERILOG_RANGE_PATTERN.sub(" ", statement), ","):
+                words = [word for word in re.findall(r"[A-Za-z_][\w$]*", item)
+                         if word not in VERILOG_PORT_KEYWORDS]
+                if words and words[-1] in names:
+                    ports[words[-1]] = (parse_verilog_range(range_match.groups()) or "any") \
+                        if range_match else None
+        for name in names - set(ports):
+            ports[name] = None
+    return ports
+
+def parse_vhdl_ports(text, top_module):
+    """Ports of a VHDL entity as {name: range}, like parse_verilog_ports."""
+    text = VHDL_COMMENT_PATTERN.sub(" ", text.lower())
+    match = re.search(r"\bentity\s+%s\s+is\b" % re.escape(top_module.lower()), text)
+    if not match:
+        return None
+    end_match = re.search(r"\bend\b", text[match.end():])
+    port_match = re.search(r"\bport\s*\(", text[match.end():])
+    if not port_match or (end_match and end_match.start() < port_match.start()):
+        return {}
+    start = match.end() + port_match.end() - 1
+    port_list = text[start + 1:find_closing_paren(text, start)]
+
+    ports = {}
+    for declaration in split_top_level(port_list, ";"):
+        names, _, port_type = declaration.partition(":")
+        port_type = re.sub(r"^\s*(in|out|inout|buffer)\b", "", port_type).split(":=")[0].strip()
+        range_match = VHDL_RANGE_PATTERN.search(port_type)
+        if range_match:
+            low, high = sorted(int(bound) for bound in range_match.groups())
+            port_range = (low, high)
+        elif port_type.split("(")[0].strip() in VHDL_SCALAR_TYPES:
+            port_range = None
+        else:
+            port_range = "any"
+        for name in names.split(","):
+            if name.strip():
+                ports[name.strip()] = port_range
+    return ports
+
+def find_module_ports(sources, top_module):
+    """Ports of top_module and its language ("verilog" or "vhdl"), or None.
+
+    VHDL port names are returned lower-cased, as VHDL is case-insensitive.
+    """
+    for path in sources['verilog'] + sources['vhdl']:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            text = f.read()
+        language = "vhdl" if str(path).lower().endswith(VHDL_EXTENSIONS) else "verilog"
+        if language == "vhdl":
+            ports = parse_vhdl_ports(text, top_module)
+        else:
+            ports = parse_verilog_ports(text, top_module)
+        if ports is not None:
+            return ports, language
+    return None
+
+# Register the analysis helpers with the environment
+env["FPGA_REACHABLE_SOURCES"] = find_reachable_sources
+env["FPGA_MODULE_PORTS"] = find_module_ports
+env["FPGA_MODULE_SOURCES"] = find_module_sources
+env["FPGA_DEFINED_UNITS"] = find_defined_units
+env["FPGA_VHDL_DEPENDENCIES"] = find_vhdl_dependencies
+env["FPGA_STRIP_NETLIST_MODULES"] = strip_netlist_modules
@@ -0,0 +1,335 @@
+"""
+HDL Syntax Pre-check
+
+Checks Verilog/SystemVerilog and VHDL sources for syntax errors before
+gw_sh is started, using iverilog, verilator or ghdl when installed and a
+bundled structural checker otherwise. Results are cached per file content,
+so only files that changed are checked again.
+"""
+
+Import("env")
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import subprocess
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from fpga_common import TRUE_VALUES, FALSE_VALUES, write_json_atomic
+
+# Check results kept in fpga/impl, keyed by checker and file content hash
+HDL_CHECK_CACHE_NAME = "hdl_check.json"
+HDL_CHECK_CACHE_VERSION = 1
+
+# Bumped when the bundled checker changes, invalidating its cached results
+BUILTIN_CHECKER_VERSION = 1
+
+# External checkers, in order of preference
+VERILOG_CHECKERS = ("iverilog", "verilator")
+VHDL_CHECKERS = ("ghdl",)
+
+# Seconds an external checker may take for one file
+CHECKER_TIMEOUT = 30
+
+VHDL_EXTENSIONS = (".vhd", ".vhdl")
+
+# Tool messages such as "top.v:12: syntax error" or "%Error: top.v:12:5: ..."
+CHECKER_MESSAGE_PATTERN = re.compile(r"^(?:%Error:\s*)?(.+?):(\d+):(?:\d+:)?\s*(.*)$")
+
+# Verilog messages that come from parsing rather than elaboration; a
+# single file cannot be elaborated without the modules it instantiates
+VERILOG_SYNTAX_PATTERN = re.compile(r"syntax error|unexpected|unterminated|unmatched", re.I)
+
+# Bundled Verilog checker: block keywords and the keywords closing them
+VERILOG_BLOCK_CLOSERS = {
+    "endmodule": ("module", "macromodule"),
+    "end": ("begin",),
+    "endcase": ("case", "casex", "casez", "randcase"),
+    "endfunction": ("function",),
+    "endtask": ("task",),
+    "endgenerate": ("generate",),
+}
+VERILOG_BLOCK_OPENERS = {opener for openers in VERILOG_BLOCK_CLOSERS.values() for opener in openers}
+BRACKET_PAIRS = {")": "(", "]": "[", "}": "{"}
+
+# Keywords declaring a function or task without a body
+VERILOG_PROTOTYPE_KEYWORDS = {"extern", "import", "export", "pure"}
+
+VERILOG_TOKEN_PATTERN = re.compile(
+    r'(?P<comment>//[^\n]*|/\*.*?\*/)|(?P<open_comment>/\*)'
+    r'|(?P<string>"(?:\\.|[^"\\\n])*")|(?P<open_string>")'
+    r"|(?P<word>[A-Za-z_][\w$]*)|(?P<bracket>[()\[\]{}])|(?P<semicolon>;)|(?P<newline>\n)", re.S)
+VERILOG_DIRECTIVE_PATTERN = re.compile(r"^\s*`(\w+)")
+
+VHDL_TOKEN_PATTERN = re.compile(
+    r"(?P<comment>--[^\n]*|/\*.*?\*/)|(?P<open_comment>/\*)"
+    r'|(?P<string>"(?:""|[^"\n])*")|(?P<open_string>")'
+    r"|(?P<char>(?<![\w)])'.')|(?P<bracket>[()])|(?P<newline>\n)", re.S)
+
+def strip_inactive_branches(lines):
+    """Blank out `else/`elsif branches and `define bodies, keeping line numbers.
+
+    Only the first branch of each `ifdef is checked, since the others
+    may not be complete on their own.
+    """
+    active = [True]
+    in_define = False
+    result = []
+    for line in lines:
+        directive = VERILOG_DIRECTIVE_PATTERN.match(line)
+        keep = active[-1] and not in_define
+        if in_define:
+            in_define = line.rstrip().endswith("\\")
+        elif directive:
+            name = directive.group(1)
+            if name in ("ifdef", "ifndef"):
+                active.append(active[-1])
+            elif name in ("else", "elsif") and len(active) > 1:
+                active[-1] = False
+            elif name == "endif" and len(active) > 1:
+                active.pop()
+            elif name == "define":
+                in_define = line.rstrip().endswith("\\")
+            keep = False
+        result.append(line if keep else "")
+    return result
+
+def check_verilog_structure(text):
+    """Bundled Verilog check: unbalanced blocks, brackets, comments and strings.
+
+    Returns (line, message) pairs; only the first structural error is
+    reported, as the ones after it are usually consequences.
+    """
+    text = "\n".join(strip_inactive_branches(text.split("\n")))
+    stack = []
+    statement_words = set()
+    line = 1
+    for match in VERILOG_TOKEN_PATTERN.finditer(text):
+        kind = match.lastgroup
+        token = match.group(0)
+        if kind == "newline":
+            line += 1
+        elif kind == "comment":
+            line += token.count("\n")
+        elif kind == "open_comment":
+            return [(line, "unterminated /* comment")]
+        elif kind == "open_string":
+            return [(line, "unterminated string")]
+        elif kind == "semicolon":
+            statement_words = set()
+        elif kind == "bracket":
+            if token in BRACKET_PAIRS:
+                if not stack or stack[-1][0] != BRACKET_PAIRS[token]:
+                    return [unmatched_closer(token, line, stack)]
+                stack.pop()
+            else:
+                stack.append((token, line))
+        elif kind == "word":
+            if token in VERILOG_BLOCK_CLOSERS:
+                if not stack or stack[-1][0] not in VERILOG_BLOCK_CLOSERS[token]:
+                    return [unmatched_closer(token, line, stack)]
+                stack.pop()
+            elif token in VERILOG_BLOCK_OPENERS and not (
+                    token in ("function", "task")
+                    and statement_words & VERILOG_PROTOTYPE_KEYWORDS):
+                stack.append((token, line))
+            statement_words.add(token)
+    if stack:
+        opener, opened_at = stack[-1]
+        return [(opened_at, f"'{opener}' is never closed")]
+    return []
+
+def unmatched_closer(token, line, stack):
+    if not stack:
+        return (line, f"'{token}' without a matching opening")
+    opener, opened_at = stack[-1]
+    return (line, f"'{token}' does not match '{opener}' at line {opened_at}")
+
+def check_vhdl_structure(text):
+    """Bundled VHDL check: unbalanced parentheses, comments and strings."""
+    stack = []
+    line = 1
+    for match in VHDL_TOKEN_PATTERN.finditer(text):
+        kind = match.lastgroup
+        token = match.group(0)
+        if kind == "newline":
+            line += 1
+        elif kind == "comment":
+            line += token.count("\n")
+        elif kind == "open_comment":
+            return [(line, "unterminated /* comment")]
+        elif kind == "open_string":
+            return [(line, "unterminated string")]
+        elif token == "(":
+            stack.append((token, line))
+        elif token == ")":
+            if not stack:
+                return [unmatched_closer(token, line, stack)]
+            stack.pop()
+    if stack:
+        return [(stack[-1][1], "'(' is never closed")]
+    return []
+
+def find_checkers(mode):
+    """Checker for each language: an external tool path, or None for the bundled one."""
+    if mode == "builtin":
+        return {"verilog": None, "vhdl": None}
+    checkers = {}
+    for language, names in (("verilog", VERILOG_CHECKERS), ("vhdl", VHDL_CHECKERS)):
+        if mode not in TRUE_VALUES and mode != "auto":
+            names = [name for name in names if name == mode]
+        checkers[language] = next((shutil.which(name) for name in names if shutil.which(name)),
+                                  None)
+    return checkers
+
+def get_checker_id(checker):
+    """Identifies checker results in the cache; changes when the tool is replaced."""
+    if checker is None:
+        return f"builtin-{BUILTIN_CHECKER_VERSION}"
+    try:
+        return f"{Path(checker).name}-{os.stat(checker).st_mtime_ns}"
+    except OSError:
+        return Path(checker).name
+
+def run_external_checker(checker, path, work_dir, dependencies=()):
+    """Run an installed checker on one file; returns (line, message) pairs.
+
+    ghdl analyzes the project VHDL files the file uses (dependencies, in
+    analysis order) first, into a library of its own, so their packages
+    and entities are known; only messages about the file itself count.
+    """
+    name = Path(checker).stem.lower()
+    if name == "ghdl":
+        library = tempfile.mkdtemp(prefix="ghdl-", dir=work_dir)
+        command = ([checker, "-a", "--std=08", f"--workdir={library}"]
+                   + [str(dep) for dep in dependencies] + [str(path)])
+    elif name == "verilator":
+        command = [checker, "--lint-only", "-Wno-fatal", "-Wno-lint", "-Wno-style",
+                   f"-I{Path(path).parent}", str(path)]
+    else:
+        command = [checker, "-g2012", "-t", "null", "-I", str(Path(path).parent), str(path)]
+    try:
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                text=True, errors="replace", timeout=CHECKER_TIMEOUT,
+                                cwd=library if name == "ghdl" else work_dir)
+    finally:
+        if name == "ghdl":
+            shutil.rmtree(library, ignore_errors=True)
+    if result.returncode == 0:
+        return []
+    messages = []
+    for output_line in result.stdout.splitlines():
+        match = CHECKER_MESSAGE_PATTERN.match(output_line.strip())
+        if not match or Path(match.group(1)).name != Path(path).name:
+            continue
+        message = match.group(3)
+        if name != "ghdl" and not VERILOG_SYNTAX_PATTERN.search(message):
+            continue
+        messages.append((int(match.group(2)), message))
+    return messages
+
+def check_file(path, checker, work_dir, dependencies=()):
+    """Syntax errors of one file as (line, message) pairs."""
+    if checker is not None:
+        try:
+            return run_external_checker(checker, path, work_dir, dependencies)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            print(f"Warning: {Path(checker).name} failed on {Path(path).name} ({e}), "
+                  "using the bundled checker")
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        text = f.read()
+    if str(path).lower().endswith(VHDL_EXTENSIONS):
+        return check_vhdl_structure(text)
+    return check_verilog_structure(text)
+
+def load_check_cache(cache_path):
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+        if cache.get("version") == HDL_CHECK_CACHE_VERSION:
+            return cache["results"]
+    except (OSError, ValueError, KeyError):
+        pass
+    return {}
+
+def save_check_cache(cache_path, results):
+    """Persist check results; failures only cost a recheck."""
+    try:
+        write_json_atomic(cache_path, {"version": HDL_CHECK_CACHE_VERSION, "results": results})
+    except OSError:
+        pass
+
+def run_syntax_check(env, sources, impl_dir):
+    """Check HDL sources for syntax errors; returns False to stop the build.
+
+    Enabled by board_build.fpga_syntax_check: "1" (or "auto") uses the
+    first installed tool and falls back to the bundled checker, "builtin"
+    always uses the bundled checker, and a tool name selects that tool.
+    Files not in the cache are checked in parallel.
+    """
+    mode = str(env.BoardConfig().get("build.fpga_syntax_check", "0")).strip()
+    if not mode or mode in FALSE_VALUES:
+        return True
+    start = time.time()
+    checkers = find_checkers(mode)
+    work_dir = Path(impl_dir) / "hdl_check"
+    work_dir.mkdir(parents=True, exist_ok=True)
+    cache_path = Path(impl_dir) / HDL_CHECK_CACHE_NAME
+    cached = load_check_cache(cache_path)
+
+    contents = {}
+    for path in sources['verilog'] + sources['vhdl']:
+        with open(path, "rb") as f:
+            contents[path] = f.read()
+    # ghdl needs the project packages and entities a file uses
+    dependencies = {}
+    if checkers["vhdl"] is not None:
+        dependencies = env["FPGA_VHDL_DEPENDENCIES"](sources, impl_dir)
+
+    files, results, pending = [], {}, {}
+    for path, content in contents.items():
+        language = "vhdl" if str(path).lower().endswith(VHDL_EXTENSIONS) else "verilog"
+        checker = checkers[language]
+        deps = dependencies.get(path, [])
+        digest = hashlib.sha256(content)
+        for dep in deps:
+            digest.update(hashlib.sha256(contents[dep]).digest())
+        key = f"{get_checker_id(checker)}:{digest.hexdigest()}"
+        files.append((path, key))
+        # `include targets are not part of the key, so such files are always checked
+        if key in cached and b"`include" not in content:
+            results[key] = cached[key]
+        else:
+            pending[key] = (path, checker, deps)
+
+    if pending:
+        jobs = env["FPGA_PARALLEL_JOBS"](env, "build.fpga_syntax_check_jobs")
+        with ThreadPoolExecutor(max_workers=min(jobs, len(pending))) as executor:
+            futures = {key: executor.submit(check_file, path, checker, work_dir, deps)
+                       for key, (path, checker, deps) in pending.items()}
+            for key, future in futures.items():
+                results[key] = future.result()
+    save_check_cache(cache_path, results)
+
+    errors = [(path, line, message) for path, key in files for line, message in results[key]]
+    elapsed_ms = (time.time() - start) * 1000
+    tools = sorted({Path(c).name for c in checkers.values() if c} or {"bundled checker"})
+    if errors:
+        project_dir = Path(env.get("PROJECT_DIR"))
+        for path, line, message in errors:
+            try:
+                path = Path(path).relative_to(project_dir)
+            except ValueError:
+                pass
+            print(f"Error: {path}:{line}: {message}")
+        print(f"Syntax check found {len(errors)} error(s) in {elapsed_ms:.0f} ms")
+        return False
+    print(f"✓ Syntax check passed ({len(pending)} file(s) checked, "
+          f"{len(files) - len(pending)} cached, {', '.join(tools)}, {elapsed_ms:.0f} ms)")
+    return True
+
+# Register the syntax check with the environment
+env["FPGA_SYNTAX_CHECK"] = run_syntax_check
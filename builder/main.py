@@ -5,15 +5,30 @@ SCons-based build script for Gowin FPGA projects.
 Supports both pure FPGA projects and dual-target projects (MCU + FPGA).
 """
 
+import sys
 from os.path import join
-from SCons.Script import (AlwaysBuild, Builder, Default, DefaultEnvironment)
+from SCons.Script import (AlwaysBuild, Builder, COMMAND_LINE_TARGETS, Default,
+                          DefaultEnvironment)
 
 env = DefaultEnvironment()
 platform = env.PioPlatform()
 board = env.BoardConfig()
 
+# Let the builder scripts import their shared helpers (fpga_common.py)
+if join(platform.get_dir(), "builder") not in sys.path:
+    sys.path.insert(0, join(platform.get_dir(), "builder"))
+from fpga_common import TRUE_VALUES, FALSE_VALUES
+
 # Import FPGA build functions from scripts
 env.SConscript(join(platform.get_dir(), "builder", "fpga_builder.py"), exports="env")
+env.SConscript(join(platform.get_dir(), "builder", "hdl_analysis.py"), exports="env")
+env.SConscript(join(platform.get_dir(), "builder", "hdl_check.py"), exports="env")
+env.SConscript(join(platform.get_dir(), "builder", "apicula_backend.py"), exports="env")
+env.SConscript(join(platform.get_dir(), "builder", "fpga_watch.py"), exports="env")
+env.SConscript(join(platform.get_dir(), "builder", "fpga_matrix.py"), exports="env")
+env.SConscript(join(platform.get_dir(), "builder", "fpga_sim.py"), exports="env")
+env.SConscript(join(platform.get_dir(), "builder", "fpga_upload.py"), exports="env")
+env.SConscript(join(platform.get_dir(), "builder", "flash_image.py"), exports="env")
 
 # Get framework
 frameworks = env.get("PIOFRAMEWORK", [])
@@ -35,6 +50,12 @@ env.Replace(
     UPLOADCMD="$UPLOADER $UPLOADERFLAGS $SOURCE"
 )
 
+# Only the esptool-based uploaders can deflate the bitstream in transit
+if (upload_protocol in ("openfpgaloader", "gowin")
+        and board.get("build.fpga_upload_compress", "auto") not in ("auto",) + FALSE_VALUES):
+    print(f"Warning: {upload_protocol} cannot send a compressed stream, "
+          "ignoring board_build.fpga_upload_compress")
+
 if upload_protocol == "pesptool":
     # Download pesptool.exe on Windows if not already available
     import sys
@@ -92,10 +113,10 @@ if upload_protocol == "pesptool":
     upload_port = env.get("UPLOAD_PORT")
     if upload_port:
         flags.extend(["--port", upload_port])
-    flags.extend([
-        "write-flash",
-        "0x100000"  # FPGA flash address
-    ])
+    flags.append("write-flash")
+    # Deflate the stream for decompression on the board, or not
+    flags.extend(env["FPGA_UPLOAD_COMPRESS_FLAGS"](env))
+    flags.append("0x100000")  # FPGA flash address
     
     env.Replace(
         UPLOADER=pesptool_cmd,
@@ -104,6 +125,12 @@ if upload_protocol == "pesptool":
     upload_actions = [
         env.VerboseAction("$UPLOADCMD", "Uploading FPGA bitstream via pesptool...")
     ]
+    if board.get("build.fpga_delta_upload", "0") in TRUE_VALUES:
+        # Only write the flash sectors that changed since the last upload
+        upload_actions = [
+            env.VerboseAction(env["FPGA_DELTA_UPLOAD_ACTION"],
+                              "Uploading changed FPGA flash sectors via pesptool...")
+        ]
     
 elif upload_protocol == "openfpgaloader":
     board_type = board.get("build.fpga_board_type", "tangnano9k")
@@ -149,5 +176,56 @@ elif upload_protocol == "esptool":
         env.VerboseAction("$UPLOADCMD", "Uploading ESP32 firmware...")
     ]
 
+# Dual-target: pack the MCU firmware and the bitstream into one flash image
+upload_source = "$BUILD_DIR/${PROGNAME}.bin"
+if board.get("build.fpga_firmware", "") or board.get("build.fpga_firmware_env", ""):
+    combined_image = env.Command(
+        join("$BUILD_DIR", "combined_flash.bin"),
+        join("$BUILD_DIR", "${PROGNAME}.bin"),
+        env.VerboseAction(env["FPGA_COMBINE_IMAGE_ACTION"], "Packing combined flash image...")
+    )
+    # The firmware is built outside SCons, so repack whenever the image is
+    # a target; it is not a default target, so `pio run` skips the firmware
+    AlwaysBuild(combined_image)
+    env.Alias("combined", combined_image)
+    
+    if upload_protocol in ("pesptool", "esptool"):
+        # Program firmware and bitstream in one connection
+        env.Replace(UPLOADERFLAGS=env["UPLOADERFLAGS"][:-1] + ["0x0"])
+        env["FPGA_UPLOAD_ADDRESS"] = 0x0
+        upload_source = "$BUILD_DIR/combined_flash.bin"
+    
+    # The gateware build starts the firmware build when the image is needed
+    if "combined" in COMMAND_LINE_TARGETS or (
+            "upload" in COMMAND_LINE_TARGETS and upload_source.endswith("combined_flash.bin")):
+        env["FPGA_BUILD_FIRMWARE"] = True
+
+# Flash several boards at once (production programming)
+if board.get("build.fpga_upload_ports", "") and upload_protocol in ("pesptool", "openfpgaloader", "gowin"):
+    upload_actions = [
+        env.VerboseAction(env["FPGA_MULTI_UPLOAD_ACTION"], "Uploading FPGA bitstream to multiple boards...")
+    ]
+
+# Record upload time in the FPGA build report
+if upload_actions:
+    upload_actions = (
+        [env.Action(env["FPGA_UPLOAD_TELEMETRY_START"], None)]
+        + upload_actions
+        + [env.Action(env["FPGA_UPLOAD_TELEMETRY_FINISH"], None)]
+    )
+
 # Create upload target
-AlwaysBuild(env.Alias("upload", "$BUILD_DIR/${PROGNAME}.bin", upload_actions))
+AlwaysBuild(env.Alias("upload", upload_source, upload_actions))
+
+# Rebuild on every source change (pio run -t watch), optionally uploading
+env["FPGA_UPLOAD_ACTIONS"] = upload_actions
+AlwaysBuild(env.Alias("watch", None, env.Action(env["FPGA_WATCH_ACTION"], None)))
+
+# Build every FPGA environment of the project concurrently (pio run -t matrix)
+AlwaysBuild(env.Alias("matrix", None, env.Action(env["FPGA_MATRIX_ACTION"], None)))
+
+# Run the testbenches in fpga/test (pio run -t sim)
+AlwaysBuild(env.Alias("sim", None, env.Action(env["FPGA_SIM_ACTION"], None)))
+
+# List the installed Gowin toolchains (pio run -t toolchains)
+AlwaysBuild(env.Alias("toolchains", None, env.Action(env["FPGA_LIST_TOOLCHAINS_ACTION"], None)))
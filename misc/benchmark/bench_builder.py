@@ -0,0 +1,438 @@
+"""
+Builder Overhead Benchmark
+
+Measures the time the platform's own build code takes, apart from the
+vendor tools. Synthetic projects of 10 to 10,000 HDL/CST files are built
+through the real builder scripts (scan_fpga_sources, update_gprj_file,
+get_fpga_sources, Tcl generation and build_fpga_action) with a stand-in
+gw_sh (fake_gw_sh.py), so no Gowin installation is needed.
+
+Scenarios:
+  cold    first build: no impl/ directory and no caches
+  noop    nothing changed: the dependency scan every `pio run` does
+          (SCons skips the build action itself)
+  touch   one HDL file changed: dependency scan and build action
+
+Usage:
+  python misc/benchmark/bench_builder.py [--sizes 10,100,1000,10000]
+      [--repeat 3] [--json results.json] [--baseline old.json]
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+import contextlib
+from pathlib import Path
+
+PLATFORM_DIR = Path(__file__).resolve().parents[2]
+BENCHMARK_DIR = Path(__file__).resolve().parent
+
+# Builder scripts loaded into the stand-in environment, in main.py order
+BUILDER_SCRIPTS = ("fpga_builder.py", "hdl_analysis.py", "hdl_check.py")
+
+# The builder scripts import their shared helpers from builder/
+sys.path.insert(0, str(PLATFORM_DIR / "builder"))
+
+DEFAULT_BOARD = "papilio_retrocade_fpga"
+DEFAULT_SIZES = "10,100,1000,10000"
+SCENARIOS = ("cold", "noop", "touch")
+
+# Generated layout: HDL files per src/ subdirectory, files per .cst file
+FILES_PER_GROUP = 100
+FILES_PER_CONSTRAINT = 50
+
+# Overhead increases below this many milliseconds are not regressions
+REGRESSION_SLACK_MS = 20.0
+
+# Ball names of a 16x16 grid package (PG256), skipping I, O, Q and S
+BGA_ROWS = "ABCDEFGHJKLMNPRT"
+
+GPRJ_TEMPLATE = """<?xml version='1.0' encoding='utf-8'?>
+<Project>
+    <Template>FPGA</Template>
+    <Version>5</Version>
+    <Device name="GW2A-18C" pn="GW2A-LV18PG256C8/I7">gw2a18c-011</Device>
+    <FileList>
+{files}
+    </FileList>
+    <OptionInfo>
+        <TopModule name="top" />
+        <Gowin>
+            <GowinSynthesis>
+                <Goal>Speed</Goal>
+                <Verilog2001>true</Verilog2001>
+                <SystemVerilog2017>true</SystemVerilog2017>
+                <Frequency>Auto</Frequency>
+            </GowinSynthesis>
+            <GowinBitstream>
+                <BitstreamMode>Regular</BitstreamMode>
+                <Format>Binary</Format>
+            </GowinBitstream>
+        </Gowin>
+    </OptionInfo>
+    <Impl>
+        <FPGADevice>
+            <DeviceName>GW2A-18C</DeviceName>
+            <PackageName>PG256</PackageName>
+            <SpeedGrade>C8/I7</SpeedGrade>
+        </FPGADevice>
+    </Impl>
+</Project>
+"""
+
+VERILOG_BLOCK = """module block_{index} (
+    input  wire       clk,
+    input  wire [7:0] din,
+    output reg  [7:0] dout
+);
+    wire [7:0] left, right;
+{children}
+    always @(posedge clk)
+        dout <= left ^ right ^ 8'd{constant};
+endmodule
+"""
+
+VHDL_BLOCK = """library ieee;
+use ieee.std_logic_1164.all;
+use ieee.numeric_std.all;
+
+entity block_{index} is
+    port (
+        clk  : in  std_logic;
+        din  : in  std_logic_vector(7 downto 0);
+        dout : out std_logic_vector(7 downto 0)
+    );
+end entity;
+
+architecture rtl of block_{index} is
+begin
+    process(clk)
+    begin
+        if rising_edge(clk) then
+            dout <= din xor std_logic_vector(to_unsigned({constant}, 8));
+        end if;
+    end process;
+end architecture;
+"""
+
+TOP_MODULE = """module top (
+    input  wire       clk,
+    input  wire [7:0] sw,
+    output wire [7:0] led,
+    inout  wire [{gpio_high}:0] gpio
+);
+    wire [7:0] left, right;
+{children}
+    assign led = left ^ right;
+    assign gpio = {{{gpio_width}{{1'bz}}}};
+endmodule
+"""
+
+class BenchBoard:
+    """BoardConfig stand-in holding "build.*" options."""
+
+    def __init__(self, options):
+        self.options = options
+
+    def get(self, key, default=None):
+        if key in self.options:
+            return self.options[key]
+        if default is None:
+            raise KeyError(key)
+        return default
+
+class BenchPlatform:
+    def __init__(self, platform_dir):
+        self.platform_dir = platform_dir
+
+    def get_dir(self):
+        return str(self.platform_dir)
+
+class BenchEnv(dict):
+    """The parts of the SCons/PlatformIO environment the builder scripts use."""
+
+    def __init__(self, project_dir, board_options, platform_dir):
+        super().__init__()
+        self.board = BenchBoard(board_options)
+        self.platform = BenchPlatform(platform_dir)
+        self.update({
+            "PROJECT_DIR": str(project_dir),
+            "PROJECT_BUILD_DIR": str(Path(project_dir) / ".pio" / "build"),
+            "BUILD_DIR": str(Path(project_dir) / ".pio" / "build" / "bench"),
+            "PIOENV": "bench",
+            "BOARD": DEFAULT_BOARD,
+            "PROGNAME": "fpga_bitstream",
+            "PROGSUFFIX": ".bin",
+            "UPLOAD_PROTOCOL": "",
+        })
+
+    def BoardConfig(self):
+        return self.board
+
+    def PioPlatform(self):
+        return self.platform
+
+    def GetOption(self, name):
+        if name == "num_jobs":
+            return os.cpu_count() or 1
+        raise KeyError(name)
+
+    def Depends(self, target, dependencies):
+        pass
+
+    def subst(self, text):
+        for name in sorted(self, key=len, reverse=True):
+            if isinstance(self[name], str):
+                text = text.replace("${%s}" % name, self[name]).replace("$" + name, self[name])
+        return text
+
+def load_builder(env):
+    """Run the builder scripts against env, as a new `pio run` process would."""
+    for name in BUILDER_SCRIPTS:
+        path = PLATFORM_DIR / "builder" / name
+        code = compile(path.read_text(encoding="utf-8"), str(path), "exec")
+        exec(code, {"Import": lambda *names: None, "env": env, "__file__": str(path),
+                    "__name__": f"bench_{path.stem}"})
+
+def get_board_options(work_dir, gowin_home):
+    with open(PLATFORM_DIR / "boards" / f"{DEFAULT_BOARD}.json", "r", encoding="utf-8") as f:
+        board = json.load(f)
+    options = {f"build.{key}": str(value) for key, value in board["build"].items()}
+    options.update({
+        "build.fpga_project": "fpga/project.gprj",
+        "build.fpga_top_module": "top",
+        "build.gowin_path": str(gowin_home),
+        "build.fpga_cache_dir": str(Path(work_dir) / "bitstream-cache"),
+    })
+    return options
+
+def install_fake_gw_sh(gowin_home):
+    """Put a gw_sh launching fake_gw_sh.py where the builder looks for it."""
+    bin_dir = Path(gowin_home) / "IDE" / "bin"
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    gw_sh = bin_dir / "gw_sh"
+    gw_sh.write_text(f"#!{sys.executable}\nimport runpy\n"
+                     f"runpy.run_path({str(BENCHMARK_DIR / 'fake_gw_sh.py')!r}, "
+                     "run_name='__main__')\n", encoding="utf-8")
+    gw_sh.chmod(0o755)
+
+def bga_pin(index):
+    return f"{BGA_ROWS[index // 16]}{index % 16 + 1}"
+
+def generate_project(project_dir, file_count):
+    """Write a project of file_count HDL and .cst files under project_dir/fpga.
+
+    Modules form a binary tree below top; every tenth one is VHDL. Each
+    .cst file constrains a few bits of the gpio bus, with real sites
+    while the package has free pins.
+    """
+    fpga_dir = Path(project_dir) / "fpga"
+    if fpga_dir.exists():
+        shutil.rmtree(fpga_dir)
+    cst_count = max(1, file_count // FILES_PER_CONSTRAINT)
+    hdl_count = max(1, file_count - cst_count)
+    gpio_width = 4 * max(1, cst_count - 1)
+
+    def children(index):
+        lines = []
+        for child, wire in ((2 * index + 1, "left"), (2 * index + 2, "right")):
+            if child < hdl_count:
+                lines.append(f"    block_{child} u_{child} (.clk(clk), .din({{4'd{child % 16}, "
+                             f"4'd{index % 16}}}), .dout({wire}));")
+            else:
+                lines.append(f"    assign {wire} = 8'd{child % 256};")
+        return "\n".join(lines)
+
+    files = []
+    for index in range(hdl_count):
+        if index == 0:
+            rel_path = "src/top.v"
+            text = TOP_MODULE.format(children=children(0), gpio_high=gpio_width - 1,
+                                     gpio_width=gpio_width)
+        elif index % 10 == 9:
+            rel_path = f"src/group_{index // FILES_PER_GROUP:03d}/block_{index}.vhd"
+            text = VHDL_BLOCK.format(index=index, constant=index % 256)
+        else:
+            rel_path = f"src/group_{index // FILES_PER_GROUP:03d}/block_{index}.v"
+            text = VERILOG_BLOCK.format(index=index, children=children(index),
+                                        constant=index % 256)
+        files.append(rel_path)
+        path = fpga_dir / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(text, encoding="utf-8")
+
+    # Fixed pins for the board I/O, the rest of the package for gpio bits
+    lines = ['IO_LOC "clk" A1;', 'IO_PORT "clk" IO_TYPE=LVCMOS33;']
+    for bit in range(8):
+        lines += [f'IO_LOC "sw[{bit}]" {bga_pin(16 + bit)};',
+                  f'IO_LOC "led[{bit}]" {bga_pin(32 + bit)};',
+                  f'IO_PORT "led[{bit}]" IO_TYPE=LVCMOS33 DRIVE=8;']
+    constraints = {"constraints/pins.cst": lines}
+    for group in range(1, cst_count):
+        lines = []
+        for bit in range(4 * (group - 1), 4 * group):
+            if 48 + bit < len(BGA_ROWS) * 16:
+                lines.append(f'IO_LOC "gpio[{bit}]" {bga_pin(48 + bit)};')
+            lines.append(f'IO_PORT "gpio[{bit}]" IO_TYPE=LVCMOS33 PULL_MODE=UP;')
+        constraints[f"constraints/io/io_{group:03d}.cst"] = lines
+    for rel_path, lines in constraints.items():
+        path = fpga_dir / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+    entries = [(path, "file.vhdl" if path.endswith(".vhd") else "file.verilog") for path in files]
+    entries += [(path, "file.cst") for path in constraints]
+    file_list = "\n".join(f'        <File path="{path}" type="{file_type}" enable="1" />'
+                          for path, file_type in entries)
+    (fpga_dir / "project.gprj").write_text(GPRJ_TEMPLATE.format(files=file_list),
+                                           encoding="utf-8")
+    # The leaf edited by the touch scenario
+    return fpga_dir / files[-1]
+
+def run_build(env, run_action):
+    """Load the builder, scan dependencies and optionally run the build action.
+
+    Returns (milliseconds, telemetry phases); the builder's output is
+    only shown if the build fails.
+    """
+    # PlatformIO creates the build directory before SCons runs
+    Path(env["BUILD_DIR"]).mkdir(parents=True, exist_ok=True)
+    output = io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+        load_builder(env)
+        env["GET_FPGA_SOURCES"](env)
+        returncode = env["FPGA_BUILD_ACTION"]([], [], env) if run_action else 0
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    if returncode != 0:
+        print(output.getvalue())
+        raise RuntimeError(f"Build action failed with exit code {returncode}")
+    return elapsed_ms, env["FPGA_TELEMETRY"].phases
+
+def measure(env, run_action):
+    """Timing of one run: total, stand-in gw_sh time and the builder's own overhead."""
+    total_ms, phases = run_build(env, run_action)
+    tool_ms = sum(phase["seconds"] for phase in phases
+                  if phase["name"].startswith("gw_sh:")) * 1000
+    builder_phases = [phase for phase in phases if not phase["name"].startswith("gw_sh:")]
+    slowest = max(builder_phases, key=lambda phase: phase["seconds"], default=None)
+    return {
+        "total_ms": total_ms,
+        "gw_sh_ms": tool_ms,
+        "overhead_ms": total_ms - tool_ms,
+        "slowest_phase": slowest["name"] if slowest else "",
+        "slowest_phase_ms": slowest["seconds"] * 1000 if slowest else 0.0,
+    }
+
+def clean_build_state(work_dir, project_dir):
+    """Remove everything a previous build left behind."""
+    for path in (Path(project_dir) / "fpga" / "impl", Path(project_dir) / ".pio",
+                 Path(work_dir) / "bitstream-cache", Path(work_dir) / ".cache"):
+        if path.exists():
+            shutil.rmtree(path)
+
+def median_result(runs):
+    result = {key: statistics.median(run[key] for run in runs)
+              for key in ("total_ms", "gw_sh_ms", "overhead_ms", "slowest_phase_ms")}
+    result["slowest_phase"] = statistics.mode(run["slowest_phase"] for run in runs)
+    return result
+
+def benchmark_size(work_dir, file_count, repeat):
+    """Median cold, no-op and touch results for one project size."""
+    size_dir = Path(work_dir) / f"files_{file_count}"
+    project_dir = size_dir / "project"
+    gowin_home = size_dir / "Gowin_V1.9.11.03_Education_x64"
+    install_fake_gw_sh(gowin_home)
+    edited = generate_project(project_dir, file_count)
+    # Caches live next to the platform directory; keep them in the work directory
+    env = BenchEnv(project_dir, get_board_options(size_dir, gowin_home), size_dir / "platform")
+
+    runs = {scenario: [] for scenario in SCENARIOS}
+    for _ in range(repeat):
+        clean_build_state(size_dir, project_dir)
+        runs["cold"].append(measure(env, True))
+    for _ in range(repeat):
+        runs["noop"].append(measure(env, False))
+    for attempt in range(repeat):
+        with open(edited, "a", encoding="utf-8") as f:
+            f.write(f"// edit {attempt}\n")
+        runs["touch"].append(measure(env, True))
+    return {scenario: median_result(runs[scenario]) for scenario in SCENARIOS}
+
+def find_regressions(results, baseline, tolerance):
+    """Overheads more than tolerance (a fraction) above the baseline's."""
+    regressions = []
+    for size, scenarios in results.items():
+        for scenario, result in scenarios.items():
+            previous = baseline.get(size, {}).get(scenario)
+            if not previous:
+                continue
+            limit = previous["overhead_ms"] * (1 + tolerance) + REGRESSION_SLACK_MS
+            if result["overhead_ms"] > limit:
+                regressions.append(f"{size} files, {scenario}: {result['overhead_ms']:.1f} ms "
+                                   f"(baseline {previous['overhead_ms']:.1f} ms)")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the build overhead of platform-gowin "
+                                                 "with a stand-in gw_sh.")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES,
+                        help=f"project sizes in files, comma-separated (default: {DEFAULT_SIZES})")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="runs per scenario, the median is reported (default: 3)")
+    parser.add_argument("--gw-sh-delay", type=float, default=0.0,
+                        help="seconds the stand-in gw_sh spends per stage (default: 0)")
+    parser.add_argument("--work-dir", help="directory for the generated projects "
+                                           "(default: a temporary directory)")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed overhead increase over the baseline (default: 0.25)")
+    args = parser.parse_args()
+
+    if sys.platform.startswith("win"):
+        print("Error: The stand-in gw_sh needs a POSIX system")
+        return 1
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    # A real installation found through GOWIN_HOME would take precedence
+    os.environ.pop("GOWIN_HOME", None)
+    os.environ["BENCH_GW_SH_DELAY"] = str(args.gw_sh_delay)
+
+    work_dir = Path(args.work_dir or tempfile.mkdtemp(prefix="gowin-bench-"))
+    results = {}
+    print(f"{'files':>7}  {'scenario':<8} {'total ms':>10} {'gw_sh ms':>10} "
+          f"{'overhead ms':>12}  slowest builder phase")
+    try:
+        for size in sizes:
+            results[str(size)] = benchmark_size(work_dir, size, args.repeat)
+            for scenario, result in results[str(size)].items():
+                print(f"{size:>7}  {scenario:<8} {result['total_ms']:>10.1f} "
+                      f"{result['gw_sh_ms']:>10.1f} {result['overhead_ms']:>12.1f}  "
+                      f"{result['slowest_phase']} ({result['slowest_phase_ms']:.1f} ms)")
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"sizes": results, "repeat": args.repeat,
+                       "gw_sh_delay": args.gw_sh_delay}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["sizes"]
+        regressions = find_regressions(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            return 1
+        print(f"✓ No overhead regressions against {args.baseline}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""
+Stand-in for Gowin's gw_sh, used by bench_builder.py.
+
+Runs the Tcl scripts the builder generates without synthesizing
+anything: it prints log lines like those of a real run and writes the
+outputs the builder reads (netlist, reports and a pnr/*.bin bitstream).
+BENCH_GW_SH_DELAY adds seconds of simulated tool time per stage.
+"""
+
+import os
+import re
+import sys
+import time
+import hashlib
+from pathlib import Path
+
+# Size of the generated bitstream, about that of a GW2A-18
+BITSTREAM_SIZE = 512 * 1024
+
+SYNTHESIS_LOG = """\
+GowinSynthesis start
+Running parser ...
+Analyzing Verilog file '{top}.v'
+Running netlist conversion ...
+Running device independent optimization ...
+Running inference ...
+Running technical mapping ...
+Running timing analysis ...
+Generate netlist file "{name}.vg" completed
+GowinSynthesis finish
+"""
+
+PNR_LOG = """\
+Reading netlist file: "{name}.vg"
+Running placement:
+    Placement Phase 0: CPU time = 0h 0m 0.1s
+    Placement Phase 1: CPU time = 0h 0m 0.2s
+Running routing:
+    Routing Phase 0: CPU time = 0h 0m 0.1s
+    Routing Phase 1: CPU time = 0h 0m 0.3s
+Running timing analysis:
+Generate file "{name}.rpt.txt" completed
+Generate file "{name}.tr.html" completed
+Generate file "{name}.bin" completed
+"""
+
+UTILIZATION_REPORT = """\
+Resource Usage Summary:
+  Logic                       | 1063/20736  | 5%
+  Register                    | 512/15915   | 3%
+  BSRAM                       | 2/46        | 4%
+  I/O Port                    | 25/207      | 12%
+"""
+
+TIMING_REPORT = ("<table><tr><td>1</td><td>clk</td><td>27.000(MHz)</td>"
+                 "<td>{fmax:.3f}(MHz)</td><td>4</td></tr></table>")
+
+def emit(text, **fields):
+    for line in text.format(**fields).splitlines():
+        print(line, flush=True)
+
+def main():
+    tcl = Path(sys.argv[-1]).read_text(encoding="utf-8")
+    delay = float(os.environ.get("BENCH_GW_SH_DELAY", "0"))
+    project = re.search(r"^open_project\s+(\S+)", tcl, re.M)
+    name = Path(project.group(1)).stem if project else "project"
+    top = re.search(r"-top_module\s+(\S+)", tcl)
+    top = top.group(1) if top else "top"
+    run = re.search(r"^run\s+(\w+)", tcl, re.M)
+    run = run.group(1) if run else "all"
+    print("*** GOWIN Tcl Command Line Console (stand-in) ***", flush=True)
+
+    if run in ("all", "syn"):
+        emit(SYNTHESIS_LOG, name=name, top=top)
+        time.sleep(delay)
+        Path("gwsynthesis").mkdir(exist_ok=True)
+        Path(f"gwsynthesis/{name}.vg").write_text(
+            f"// Created Time: {time.ctime()}\nmodule {top}; endmodule\n", encoding="utf-8")
+        Path(f"gwsynthesis/{name}_syn.rpt.html").write_text("<html>synthesis report</html>",
+                                                            encoding="utf-8")
+    if run in ("all", "pnr"):
+        emit(PNR_LOG, name=name)
+        time.sleep(delay)
+        # Derive the bitstream from the script, so equal inputs give equal outputs
+        seed = hashlib.sha256(tcl.encode("utf-8")).digest()
+        Path("pnr").mkdir(exist_ok=True)
+        Path(f"pnr/{name}.bin").write_bytes((seed * (BITSTREAM_SIZE // len(seed) + 1))[:BITSTREAM_SIZE])
+        Path(f"pnr/{name}.rpt.txt").write_text(UTILIZATION_REPORT, encoding="utf-8")
+        Path(f"pnr/{name}.tr.html").write_text(TIMING_REPORT.format(fmax=120 + seed[0] / 10),
+                                               encoding="utf-8")
+        Path(f"pnr/{name}.timing_paths").write_text(f"Slack : {seed[1] / 100:.3f}\n",
+                                                    encoding="utf-8")
+    print("All done", flush=True)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
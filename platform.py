@@ -5,9 +5,72 @@ Supports Gowin FPGA devices with the Gowin EDA toolchain.
 """
 
 from platformio.public import PlatformBase
+import os
+import sys
+import stat
+import time
 import shutil
+import subprocess
 from pathlib import Path
 
+# Shared helpers live with the builder scripts
+BUILDER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "builder")
+if BUILDER_DIR not in sys.path:
+    sys.path.insert(0, BUILDER_DIR)
+from fpga_common import get_process_group_args, get_project_fpga_environments, uses_environment_dir
+
+# Entries of fpga/impl that only speed up later builds; a plain clean keeps
+# them and fullclean removes them too
+IMPL_CACHE_ENTRIES = {
+    "cache",              # Staged build results (synthesis and P&R)
+    "gwsynthesis",        # Last synthesized netlist
+    "variants",           # Multi-boot variant builds
+    "sim",                # Compiled simulation models
+    "hdl_check",          # Syntax check work files
+    "ooc",                # Out-of-context module builds
+    "explore",            # Place & route strategy exploration runs
+    "env",                # Directories of the project's other FPGA environments
+    "hdl_check.json",
+    "hdl_graph.json",
+    "source_index.json",
+}
+
+# Directory in fpga/impl that cleaned entries are moved to before deletion
+IMPL_TRASH_DIR = ".trash"
+
+# File in fpga/impl listing what the last background deletion could not remove
+IMPL_TRASH_LOG = ".trash.log"
+
+# Removes directory trees in the background, making read-only files
+# writable first (Windows refuses to delete them). Nothing it deletes may
+# stop it, and it has no console, so failures are appended to the log
+# given as its first argument; the next clean reports them and retries.
+BACKGROUND_REMOVE_SCRIPT = """
+import os, sys, stat, shutil
+log_path = sys.argv[1]
+def log_error(path, error):
+    try:
+        with open(log_path, "a", encoding="utf-8") as log:
+            log.write(f"{path}: {error}\\n")
+    except OSError:
+        pass
+def make_writable(func, path, exc):
+    try:
+        os.chmod(path, stat.S_IWRITE)
+        func(path)
+    except OSError as e:
+        log_error(path, e)
+for path in sys.argv[2:]:
+    try:
+        shutil.rmtree(path, onerror=make_writable)
+    except OSError as e:
+        log_error(path, e)
+    try:
+        os.rmdir(os.path.dirname(path))
+    except OSError:
+        pass
+"""
+
 
 class GowinPlatform(PlatformBase):
     """
@@ -85,39 +148,153 @@ class GowinPlatform(PlatformBase):
         
         return board
 
+    def _uses_environment_dir(self, project_config, pioenv):
+        """
+        Check whether an environment builds in fpga/impl/env/<name>.
+        
+        Args:
+            project_config: Path to platformio.ini
+            pioenv: Environment name
+            
+        Returns:
+            True if the environment has its own implementation directory
+        """
+        from platformio.project.config import ProjectConfig
+        
+        config = ProjectConfig.get_instance(project_config)
+        mode = str(config.get(f"env:{pioenv}", "board_build.fpga_env_isolation", "auto"))
+        return uses_environment_dir(mode.strip(), get_project_fpga_environments(config))
+
+    def _clean_impl_dir(self, impl_path, trash_root, full, silent):
+        """
+        Remove the outputs in an FPGA implementation directory.
+        
+        Args:
+            impl_path: fpga/impl, or an environment's directory in it
+            trash_root: Directory that entries are moved to for deletion
+            full: Also remove the entries in IMPL_CACHE_ENTRIES
+            silent: Do not print what is removed
+        """
+        entries = [path for path in impl_path.iterdir()
+                   if path.name not in (IMPL_TRASH_DIR, IMPL_TRASH_LOG)
+                   and (full or path.name not in IMPL_CACHE_ENTRIES)]
+        if not full:
+            # Temporary files left behind by interrupted cache writes
+            for name in IMPL_CACHE_ENTRIES:
+                entries.extend((impl_path / name).rglob("*.tmp"))
+        if not entries:
+            return
+        if not silent:
+            kept = "" if full else " (keeping build caches, use fullclean to remove them)"
+            print(f"Removing outputs in {impl_path}{kept}")
+        
+        # Renaming is instant, so the clean returns before the files are gone
+        trash = trash_root / f"{os.getpid()}-{time.time_ns()}"
+        stuck = []
+        for index, path in enumerate(entries):
+            try:
+                trash.mkdir(parents=True, exist_ok=True)
+                path.rename(trash / f"{index}-{path.name}")
+            except OSError:
+                # Open files cannot be moved on Windows; delete them here
+                stuck.append(path)
+        
+        for path in stuck:
+            try:
+                if path.is_dir():
+                    shutil.rmtree(path, onerror=self._remove_readonly)
+                else:
+                    try:
+                        path.unlink()
+                    except PermissionError:
+                        os.chmod(path, stat.S_IWRITE)
+                        path.unlink()
+            except OSError as e:
+                if not silent:
+                    print(f"Warning: Could not fully remove {path}: {e}")
+        if full:
+            try:
+                impl_path.rmdir()
+            except OSError:
+                pass
+
+    @staticmethod
+    def _remove_readonly(func, path, exc):
+        """Error handler for Windows read-only files"""
+        if not os.access(path, os.W_OK):
+            # Make the file writable and try again
+            os.chmod(path, stat.S_IWRITE)
+            func(path)
+        else:
+            raise
+
+    def _empty_trash(self, trash_root, silent):
+        """
+        Delete everything in the trash directory in a detached process.
+        
+        Also picks up what an earlier, interrupted or failed deletion left
+        behind, reporting the errors the failed one logged.
+        """
+        log_path = trash_root.parent / IMPL_TRASH_LOG
+        try:
+            errors = log_path.read_text(encoding="utf-8", errors="replace").splitlines()
+            log_path.unlink()
+        except OSError:
+            errors = []
+        if errors and not silent:
+            print(f"Warning: The last background clean could not remove {len(errors)} "
+                  f"path(s) in {trash_root}, retrying:")
+            for line in errors[:5]:
+                print(f"  {line}")
+        
+        try:
+            batches = [str(path) for path in trash_root.iterdir()]
+        except OSError:
+            return
+        if not batches:
+            return
+        
+        try:
+            subprocess.Popen(
+                [sys.executable, "-c", BACKGROUND_REMOVE_SCRIPT, str(log_path)] + batches,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                close_fds=True,
+                **get_process_group_args(detached=True)
+            )
+        except OSError:
+            for batch in batches:
+                shutil.rmtree(batch, ignore_errors=True)
+
     def run(self, variables, targets, silent, verbose, jobs):
         """
         Override run method to add custom clean logic for FPGA builds.
+        
+        clean removes the outputs in fpga/impl but keeps the caches that
+        speed up the next build; fullclean removes those as well.
         """
-        # If cleaning, also clean the fpga/impl directory
-        if "clean" in targets:
+        if "clean" in targets or "fullclean" in targets:
             project_config = variables.get("project_config")
             if project_config:
                 # Get project directory from the platformio.ini path
-                import os
-                import stat
-                
                 project_dir = os.path.dirname(project_config)
-                impl_path = Path(project_dir) / "fpga" / "impl"
+                impl_root = Path(project_dir) / "fpga" / "impl"
+                impl_path = impl_root
+                # With several FPGA environments, only clean this one's
+                # directory; the others may be building at the same time
+                pioenv = variables.get("pioenv")
+                if pioenv and self._uses_environment_dir(project_config, pioenv):
+                    impl_path = impl_path / "env" / pioenv
                 if impl_path.exists():
-                    if not silent:
-                        print(f"Removing {impl_path}")
-                    
-                    # Handle permission errors on Windows for read-only files
-                    def handle_remove_readonly(func, path, exc):
-                        """Error handler for Windows read-only files"""
-                        if not os.access(path, os.W_OK):
-                            # Make the file writable and try again
-                            os.chmod(path, stat.S_IWRITE)
-                            func(path)
-                        else:
-                            raise
-                    
+                    trash_root = impl_root / IMPL_TRASH_DIR
                     try:
-                        shutil.rmtree(impl_path, onerror=handle_remove_readonly)
-                    except Exception as e:
+                        self._clean_impl_dir(impl_path, trash_root,
+                                             "fullclean" in targets, silent)
+                    except OSError as e:
                         if not silent:
                             print(f"Warning: Could not fully remove {impl_path}: {e}")
+                    self._empty_trash(trash_root, silent)
         
         # Call parent run method
         return super().run(variables, targets, silent, verbose, jobs)
@@ -0,0 +1,159 @@
+"""
+Test fixtures for the builder scripts.
+
+The builder scripts are SConscripts that run inside `pio run`. FakeEnv
+provides the parts of the SCons/PlatformIO environment they use and
+load_builder runs them against it the way main.py does, so the tests need
+neither SCons, PlatformIO nor a Gowin installation. Stand-ins for the
+vendor tools are in tests/tools/.
+"""
+
+import os
+import sys
+import shutil
+from pathlib import Path
+
+import pytest
+
+PLATFORM_DIR = Path(__file__).resolve().parents[1]
+TOOLS_DIR = Path(__file__).resolve().parent / "tools"
+
+# Builder scripts loaded by default, in main.py order
+BUILDER_SCRIPTS = ("fpga_builder.py", "hdl_analysis.py", "hdl_check.py", "apicula_backend.py")
+
+# Example project most tests build: one Verilog and one VHDL file
+EXAMPLE_PROJECT = PLATFORM_DIR / "examples" / "fpga-mixed-hdl"
+
+# Installation directory name the toolchain version is read from
+GOWIN_HOME_NAME = "Gowin_V1.9.11.03_Education_x64"
+
+# The builder scripts import their shared helpers from builder/
+sys.path.insert(0, str(PLATFORM_DIR / "builder"))
+
+class FakeBoard:
+    """BoardConfig stand-in holding "build.*" options."""
+
+    def __init__(self, options):
+        self.options = options
+
+    def get(self, key, default=None):
+        if key in self.options:
+            return self.options[key]
+        if default is None:
+            raise KeyError(key)
+        return default
+
+class FakePlatform:
+    def __init__(self, platform_dir):
+        self.platform_dir = platform_dir
+
+    def get_dir(self):
+        return str(self.platform_dir)
+
+class FakeEnv(dict):
+    """The parts of the SCons/PlatformIO environment the builder scripts use."""
+
+    def __init__(self, project_dir, board_options, platform_dir):
+        super().__init__()
+        self.board = FakeBoard(board_options)
+        self.platform = FakePlatform(platform_dir)
+        self.update({
+            "PROJECT_DIR": str(project_dir),
+            "PROJECT_BUILD_DIR": str(Path(project_dir) / ".pio" / "build"),
+            "BUILD_DIR": str(Path(project_dir) / ".pio" / "build" / "fpga"),
+            "PIOENV": "fpga",
+            "BOARD": "papilio_retrocade_fpga",
+            "PROGNAME": "fpga_bitstream",
+            "PROGSUFFIX": ".bin",
+            "UPLOAD_PROTOCOL": "",
+        })
+        os.makedirs(self["BUILD_DIR"], exist_ok=True)
+
+    def BoardConfig(self):
+        return self.board
+
+    def PioPlatform(self):
+        return self.platform
+
+    def GetOption(self, name):
+        if name == "num_jobs":
+            return 2
+        raise KeyError(name)
+
+    def Depends(self, target, dependencies):
+        pass
+
+    def subst(self, text):
+        for name in sorted(self, key=len, reverse=True):
+            if isinstance(self[name], str):
+                text = text.replace("${%s}" % name, self[name]).replace("$" + name, self[name])
+        return text
+
+def load_builder(env, scripts=BUILDER_SCRIPTS):
+    """Run builder scripts against env; returns the globals of the first one."""
+    namespaces = []
+    for name in scripts:
+        path = PLATFORM_DIR / "builder" / name
+        code = compile(path.read_text(encoding="utf-8"), str(path), "exec")
+        namespace = {"Import": lambda *names: None, "env": env, "__file__": str(path),
+                     "__name__": f"test_{path.stem}"}
+        exec(code, namespace)
+        namespaces.append(namespace)
+    return namespaces[0]
+
+def install_tool(bin_dir, name, tool):
+    """Install tests/tools/<tool> as an executable called name in bin_dir."""
+    bin_dir = Path(bin_dir)
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    path = bin_dir / name
+    source = (TOOLS_DIR / tool).read_text(encoding="utf-8")
+    path.write_text(f"#!{sys.executable}\n{source}", encoding="utf-8")
+    path.chmod(0o755)
+    return path
+
+def read_calls(log_path):
+    """Lines a stand-in tool appended to its call log."""
+    try:
+        return Path(log_path).read_text(encoding="utf-8").splitlines()
+    except OSError:
+        return []
+
+@pytest.fixture
+def platform_dir(tmp_path):
+    """A platform directory of its own, so caches kept next to it stay in tmp_path."""
+    path = tmp_path / "platform" / "platform-gowin"
+    path.mkdir(parents=True)
+    shutil.copytree(PLATFORM_DIR / "builder", path / "builder",
+                    ignore=shutil.ignore_patterns("__pycache__"))
+    return path
+
+@pytest.fixture
+def gowin_home(tmp_path, monkeypatch):
+    """A Gowin installation whose gw_sh is tests/tools/fake_gw_sh.py."""
+    home = tmp_path / GOWIN_HOME_NAME
+    install_tool(home / "IDE" / "bin", "gw_sh", "fake_gw_sh.py")
+    monkeypatch.setenv("GOWIN_HOME", str(home))
+    monkeypatch.setenv("FAKE_GW_SH_LOG", str(tmp_path / "gw_sh_calls.log"))
+    return home
+
+@pytest.fixture
+def gw_sh_calls(tmp_path):
+    """Stages run by each gw_sh call so far, e.g. ["syn", "pnr"]."""
+    return lambda: read_calls(tmp_path / "gw_sh_calls.log")
+
+@pytest.fixture
+def project(tmp_path):
+    root = tmp_path / "project"
+    shutil.copytree(EXAMPLE_PROJECT, root)
+    return root
+
+@pytest.fixture
+def make_env(project, platform_dir):
+    """Create a FakeEnv for the example project with the given board options."""
+    def make(options=None, **variables):
+        board_options = {"build.fpga_top_module": "blinky"}
+        board_options.update(options or {})
+        env = FakeEnv(project, board_options, platform_dir)
+        env.update(variables)
+        return env
+    return make
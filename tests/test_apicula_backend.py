@@ -0,0 +1,84 @@
+"""End-to-end tests for the yosys/nextpnr/gowin_pack build backend."""
+
+import re
+import json
+
+import pytest
+
+from conftest import install_tool, load_builder, read_calls
+
+BOARD = {
+    "build.fpga_backend": "apicula",
+    "build.fpga_cache": "0",
+    "build.device": "GW2A-18",
+    "build.fpga_device_full": "GW2A-LV18PG256C8/I7",
+}
+
+@pytest.fixture
+def apicula(tmp_path, monkeypatch):
+    """Directory with stand-ins for the three tools."""
+    tool_dir = tmp_path / "apicula"
+    for name in ("yosys", "nextpnr-himbaechel", "gowin_pack"):
+        install_tool(tool_dir, name, "fake_apicula.py")
+    monkeypatch.setenv("FAKE_APICULA_LOG", str(tmp_path / "apicula_calls.log"))
+    monkeypatch.delenv("GOWIN_HOME", raising=False)
+    return tool_dir
+
+def build(make_env, apicula, **options):
+    env = make_env(dict(BOARD, **{"build.fpga_apicula_path": str(apicula)}, **options))
+    return load_builder(env)["build_fpga_action"]([], [], env)
+
+def apicula_calls(tmp_path):
+    return {call[0]: call[1:] for call in map(json.loads, read_calls(tmp_path / "apicula_calls.log"))}
+
+def test_builds_bitstream_with_the_three_tools(make_env, project, apicula, tmp_path):
+    assert build(make_env, apicula, **{"build.use_sspi_as_gpio": "1"}) == 0
+    impl_dir = project / "fpga/impl/apicula"
+    calls = apicula_calls(tmp_path)
+
+    # The example mixes Verilog and VHDL, so yosys loads the ghdl plugin
+    assert calls["yosys"] == ["-m", "ghdl", "-q", "-s", "synth.ys"]
+    script = (impl_dir / "synth.ys").read_text()
+    assert "blinky.v" in script
+    assert re.search(r"^ghdl --std=08 .*counter\.vhd\" -e counter$", script, re.M)
+    assert f'synth_gowin -top blinky -json "{(impl_dir / "synth.json").as_posix()}" -family gw2a' in script
+
+    nextpnr = calls["nextpnr-himbaechel"]
+    assert nextpnr[nextpnr.index("--device") + 1] == "GW2A-LV18PG256C8/I7"
+    assert "family=GW2A-18" in nextpnr
+    assert f"cst={impl_dir / 'constraints.cst'}" in nextpnr
+    assert "sspi_as_gpio" in nextpnr
+    assert calls["gowin_pack"] == ["-d", "GW2A-18", "-o", str(impl_dir / "project.fs"),
+                                   "--sspi_as_gpio", str(impl_dir / "pnr.json")]
+
+    bitstream = (project / ".pio/build/fpga/fpga_bitstream.bin").read_bytes()
+    assert bitstream == bytes.fromhex("a5a5a5a5f0f0f0f0")
+    report = json.loads((project / ".pio/build/fpga/fpga_build_report.json").read_text())
+    assert report["backend"] == "apicula"
+    assert report["timing"]["fmax"] == {"clk": 150.0}
+
+def test_family_can_be_set_apart_from_the_device(make_env, project, apicula, tmp_path):
+    assert build(make_env, apicula, **{"build.device": "GW1NR-9C",
+                                       "build.fpga_device_full": "GW1NR-LV9QN88PC6/I5",
+                                       "build.fpga_apicula_family": "GW1N-9C"}) == 0
+    calls = apicula_calls(tmp_path)
+    nextpnr = calls["nextpnr-himbaechel"]
+    assert nextpnr[nextpnr.index("--device") + 1] == "GW1NR-LV9QN88PC6/I5"
+    assert "family=GW1N-9C" in nextpnr
+    assert calls["gowin_pack"][:2] == ["-d", "GW1N-9C"]
+    # synth_gowin only takes -family for the GW2A devices
+    assert "-family" not in (project / "fpga/impl/apicula/synth.ys").read_text()
+
+def test_failing_tool_fails_the_build(make_env, project, apicula, tmp_path, monkeypatch):
+    monkeypatch.setenv("FAKE_APICULA_FAIL", "nextpnr-himbaechel")
+    assert build(make_env, apicula) != 0
+    assert "gowin_pack" not in apicula_calls(tmp_path)
+
+def test_missing_tool_skips_the_build(make_env, project, apicula, tmp_path, monkeypatch, capsys):
+    (apicula / "gowin_pack").unlink()
+    monkeypatch.setenv("PATH", str(tmp_path / "empty"))
+    # As with a missing Gowin toolchain, the build is skipped with a warning
+    assert build(make_env, apicula) == 0
+    assert "gowin_pack not found" in capsys.readouterr().out
+    assert apicula_calls(tmp_path) == {}
+    assert not (project / ".pio/build/fpga/fpga_bitstream.bin").exists()
@@ -0,0 +1,69 @@
+"""Tests for the builder overhead benchmark in misc/benchmark."""
+
+import sys
+import json
+import importlib.util
+
+import pytest
+
+from conftest import PLATFORM_DIR
+
+@pytest.fixture
+def bench(monkeypatch):
+    monkeypatch.delenv("GOWIN_HOME", raising=False)
+    monkeypatch.setenv("BENCH_GW_SH_DELAY", "0")
+    path = PLATFORM_DIR / "misc" / "benchmark" / "bench_builder.py"
+    spec = importlib.util.spec_from_file_location("bench_builder", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def test_generated_project_is_consistent(bench, tmp_path):
+    edited = bench.generate_project(tmp_path / "project", 120)
+    fpga_dir = tmp_path / "project" / "fpga"
+    hdl = sorted(p.relative_to(fpga_dir).as_posix() for p in (fpga_dir / "src").rglob("*.v*"))
+    cst = sorted(p.relative_to(fpga_dir).as_posix() for p in (fpga_dir / "constraints").rglob("*.cst"))
+    assert (len(hdl), len(cst)) == (118, 2)
+    assert sum(path.endswith(".vhd") for path in hdl) == 11
+    gprj = (fpga_dir / "project.gprj").read_text()
+    for path in hdl + cst:
+        assert f'<File path="{path}"' in gprj
+    assert edited.relative_to(fpga_dir).as_posix() in hdl
+
+def test_every_scenario_is_measured(bench, tmp_path):
+    results = bench.benchmark_size(tmp_path, 20, 1)
+    assert list(results) == ["cold", "noop", "touch"]
+    for scenario, result in results.items():
+        assert result["total_ms"] >= result["gw_sh_ms"] >= 0
+        assert result["overhead_ms"] == pytest.approx(result["total_ms"] - result["gw_sh_ms"])
+    # SCons skips the build action when nothing changed
+    assert results["noop"]["gw_sh_ms"] == 0
+    assert (tmp_path / "files_20/project/.pio/build/bench/fpga_bitstream.bin").exists()
+
+def test_regressions_allow_tolerance_and_slack(bench):
+    baseline = {"100": {"noop": {"overhead_ms": 100.0}, "touch": {"overhead_ms": 1000.0}}}
+    results = {"100": {"noop": {"overhead_ms": 140.0}, "touch": {"overhead_ms": 1300.0}},
+               "1000": {"noop": {"overhead_ms": 5000.0}}}
+    # noop is within 25% plus the slack; sizes missing from the baseline are skipped
+    assert bench.find_regressions(results, baseline, 0.25) == [
+        "100 files, touch: 1300.0 ms (baseline 1000.0 ms)"]
+
+def test_main_writes_results_and_fails_on_regressions(bench, tmp_path, monkeypatch, capsys):
+    measured = {"cold": 50.0, "noop": 10.0, "touch": 30.0}
+    monkeypatch.setattr(bench, "benchmark_size", lambda work_dir, size, repeat: {
+        scenario: {"total_ms": ms, "gw_sh_ms": 0.0, "overhead_ms": ms, "slowest_phase": "scan",
+                   "slowest_phase_ms": ms} for scenario, ms in measured.items()})
+    results_path = tmp_path / "bench.json"
+    monkeypatch.setattr(sys, "argv", ["bench_builder.py", "--sizes", "10", "--repeat", "1",
+                                      "--json", str(results_path)])
+    assert bench.main() == 0
+    assert json.loads(results_path.read_text())["sizes"]["10"]["touch"]["overhead_ms"] == 30.0
+
+    monkeypatch.setattr(sys, "argv", ["bench_builder.py", "--sizes", "10",
+                                      "--baseline", str(results_path)])
+    assert bench.main() == 0
+    assert f"✓ No overhead regressions against {results_path}" in capsys.readouterr().out
+
+    measured["touch"] = 100.0
+    assert bench.main() == 1
+    assert "Regression: 10 files, touch: 100.0 ms (baseline 30.0 ms)" in capsys.readouterr().out
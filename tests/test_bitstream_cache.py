@@ -0,0 +1,37 @@
+"""Tests for the content-addressed bitstream cache."""
+
+import shutil
+
+from conftest import load_builder
+
+def build(env):
+    builder = load_builder(env)
+    assert builder["build_fpga_action"]([], [], env) == 0
+
+def test_unchanged_inputs_reuse_cached_bitstream(make_env, project, gowin_home, gw_sh_calls, tmp_path):
+    env = make_env({"build.fpga_cache_dir": str(tmp_path / "cache")})
+    build(env)
+    bitstream = (project / "fpga/impl/pnr/project.bin").read_bytes()
+    assert len(gw_sh_calls()) == 1
+
+    shutil.rmtree(project / "fpga/impl")
+    build(env)
+    assert len(gw_sh_calls()) == 1
+    assert (project / "fpga/impl/pnr/project.bin").read_bytes() == bitstream
+    assert (project / ".pio/build/fpga/fpga_bitstream.bin").read_bytes() == bitstream
+
+def test_changed_source_misses_cache(make_env, project, gowin_home, gw_sh_calls, tmp_path):
+    env = make_env({"build.fpga_cache_dir": str(tmp_path / "cache")})
+    build(env)
+    with open(project / "fpga/src/blinky.v", "a") as f:
+        f.write("\n// changed\n")
+    build(env)
+    assert len(gw_sh_calls()) == 2
+
+def test_cache_can_be_disabled(make_env, project, gowin_home, gw_sh_calls, tmp_path):
+    env = make_env({"build.fpga_cache": "0", "build.fpga_cache_dir": str(tmp_path / "cache")})
+    build(env)
+    shutil.rmtree(project / "fpga/impl")
+    build(env)
+    assert len(gw_sh_calls()) == 2
+    assert not (tmp_path / "cache").exists()
@@ -0,0 +1,87 @@
+"""Tests for bitstream compression, padding trim and upload size reporting."""
+
+import json
+import zlib
+
+import pytest
+
+from conftest import install_tool, load_builder, read_calls
+
+# Erased-flash padding the fake gw_sh appends to the bitstream
+PADDING = 8 * 1024
+
+def build(make_env, tmp_path, options=None):
+    env = make_env(dict({"build.fpga_cache_dir": str(tmp_path / "cache")}, **(options or {})))
+    assert load_builder(env)["build_fpga_action"]([], [], env) == 0
+    return env
+
+def read_report(project):
+    return json.loads((project / ".pio/build/fpga/fpga_build_report.json").read_text())
+
+def test_trim_keeps_word_alignment(make_env):
+    trim = load_builder(make_env())["trim_bitstream_padding"]
+    assert trim(b"\x01\x02\x03\x04\x05\xff\xff\xff\xff\xff") == b"\x01\x02\x03\x04\x05\xff\xff\xff"
+    assert trim(b"\x01\x02\x03\x04") == b"\x01\x02\x03\x04"
+    assert trim(b"\xff" * 16) == b""
+
+def test_padding_is_trimmed_from_the_upload(make_env, project, gowin_home, tmp_path,
+                                            monkeypatch, capsys):
+    monkeypatch.setenv("FAKE_GW_SH_PADDING", str(PADDING))
+    build(make_env, tmp_path, {"build.fpga_bitstream_trim": "1"})
+    bitstream = (project / "fpga/impl/pnr/project.bin").read_bytes()
+    payload = (project / ".pio/build/fpga/fpga_bitstream.bin").read_bytes()
+    assert bitstream == payload + b"\xff" * PADDING
+    assert "(8.0 KB of padding trimmed)" in capsys.readouterr().out
+    assert read_report(project)["payload"] == {
+        "bitstream_size": len(bitstream),
+        "size": len(payload),
+        "deflated_size": len(zlib.compress(payload, 6)),
+        "vendor_compression": False,
+    }
+
+def test_padding_is_kept_by_default(make_env, project, gowin_home, tmp_path, monkeypatch):
+    monkeypatch.setenv("FAKE_GW_SH_PADDING", str(PADDING))
+    build(make_env, tmp_path)
+    payload = (project / ".pio/build/fpga/fpga_bitstream.bin").read_bytes()
+    assert payload == (project / "fpga/impl/pnr/project.bin").read_bytes()
+    assert read_report(project)["payload"]["size"] == len(payload)
+
+def test_vendor_compression_is_a_separate_build(make_env, project, gowin_home, gw_sh_calls,
+                                                tmp_path):
+    build(make_env, tmp_path)
+    assert "bit_compress" not in (project / "fpga/impl/build_script.tcl").read_text()
+    build(make_env, tmp_path, {"build.fpga_bitstream_compress": "1"})
+    # The Tcl script differs, so the uncompressed bitstream is not reused from the cache
+    assert len(gw_sh_calls()) == 2
+    assert "set_option -bit_compress 1" in (project / "fpga/impl/build_script.tcl").read_text()
+    assert read_report(project)["payload"]["vendor_compression"] is True
+
+@pytest.mark.parametrize("value, flags", [("auto", []), ("1", ["--compress"]),
+                                          ("no", ["--no-compress"])])
+def test_upload_compress_option(make_env, tmp_path, monkeypatch, value, flags):
+    monkeypatch.setenv("FAKE_PESPTOOL_LOG", str(tmp_path / "pesptool_calls.log"))
+    monkeypatch.setenv("FAKE_PESPTOOL_FLASH", str(tmp_path / "flash.bin"))
+    pesptool = str(install_tool(tmp_path / "bin", "pesptool", "fake_pesptool.py"))
+    image_path = tmp_path / "image.bin"
+    image_path.write_bytes(b"\0" * 4096)
+
+    env = make_env({"build.fpga_upload_compress": value})
+    uploader = load_builder(env, ("fpga_upload.py",))
+    assert uploader["delta_upload"](env, pesptool, "", str(image_path), 0x100000) == 0
+    call = json.loads(read_calls(tmp_path / "pesptool_calls.log")[0])
+    assert call == ["write-flash"] + flags + ["0x100000", str(image_path)]
+
+def test_upload_is_added_to_the_report(make_env, project, gowin_home, tmp_path, capsys):
+    env = build(make_env, tmp_path, {"build.fpga_upload_compress": "1"})
+    env["UPLOAD_PROTOCOL"] = "pesptool"
+    image_path = project / ".pio/build/fpga/fpga_bitstream.bin"
+    builder = load_builder(env)
+    builder["start_upload_telemetry"]([], [image_path], env)
+    env["FPGA_UPLOAD_START"] -= 2
+    assert builder["finish_upload_telemetry"]([], [image_path], env) == 0
+    assert "Uploaded 64.0 KB in 2.0s (32.0 KB/s)" in capsys.readouterr().out
+    upload = read_report(project)["phases"][-1]
+    assert upload["name"] == "upload"
+    assert upload["protocol"] == "pesptool"
+    assert upload["image_bytes"] == image_path.stat().st_size
+    assert upload["compress"] == "1"
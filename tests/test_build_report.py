@@ -0,0 +1,45 @@
+"""Tests for the machine-readable build report."""
+
+import json
+
+from conftest import load_builder
+
+def read_report(project):
+    return json.loads((project / ".pio/build/fpga/fpga_build_report.json").read_text())
+
+def test_report_records_phases_and_results(make_env, project, gowin_home):
+    env = make_env({"build.fpga_cache": "0", "build.device": "GW2A-18"})
+    assert load_builder(env)["build_fpga_action"]([], [], env) == 0
+    report = read_report(project)
+    assert report["result"] == "built"
+    assert report["top_module"] == "blinky"
+    assert report["toolchain_version"] == "1.9.11.03"
+    assert report["utilization"]["Logic"] == {"used": 120, "total": 20736}
+    assert report["timing"]["fmax"]["clk"] > 120
+    bitstream = (project / ".pio/build/fpga/fpga_bitstream.bin").read_bytes()
+    assert report["bitstream"]["size"] == len(bitstream)
+
+    names = [phase["name"] for phase in report["phases"]]
+    assert names.index("scan_fpga_sources") < names.index("gw_sh:syn") < names.index("gw_sh:pnr")
+    for phase in report["phases"]:
+        assert phase["seconds"] >= 0
+        # The running peak never goes down; each phase records its own increase
+        assert phase["running_peak_rss_kb"] <= report["peak_rss_kb"]
+        assert phase["peak_rss_increase_kb"] >= 0
+    assert sum(phase["peak_rss_increase_kb"] for phase in report["phases"]) <= report["peak_rss_kb"]
+
+def test_failed_build_is_reported(make_env, project, gowin_home, monkeypatch):
+    monkeypatch.setenv("FAKE_GW_SH_FAIL", "1")
+    env = make_env({"build.fpga_cache": "0"})
+    assert load_builder(env)["build_fpga_action"]([], [], env) != 0
+    assert read_report(project)["result"] == "failed"
+
+def test_matrix_memory_estimate_uses_the_build_peak(make_env):
+    env = make_env()
+    matrix = load_builder(env, ("fpga_matrix.py",))
+    estimate = matrix["estimate_build_memory"]
+    report = {"peak_rss_kb": 100_000, "children_peak_rss_kb": 900_000,
+              "phases": [{"running_peak_rss_kb": 100_000, "running_children_peak_rss_kb": 900_000}]}
+    assert estimate(report, 1) == 1_000_000 * 1024
+    assert estimate(None, 1) == 1
+    assert estimate({"phases": []}, 1) == 1
@@ -0,0 +1,27 @@
+"""Tests for the background deletion `pio run -t clean` hands cleaned files to."""
+
+import ast
+import sys
+import subprocess
+
+from conftest import PLATFORM_DIR
+
+def background_remove_script():
+    # platform.py needs PlatformIO to import, so the script is read from its source
+    tree = ast.parse((PLATFORM_DIR / "platform.py").read_text(encoding="utf-8"))
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and node.targets[0].id == "BACKGROUND_REMOVE_SCRIPT":
+            return node.value.value
+
+def test_failures_are_logged_and_the_rest_is_removed(tmp_path):
+    trash = tmp_path / ".trash"
+    (trash / "1-impl" / "pnr").mkdir(parents=True)
+    (trash / "1-impl" / "pnr" / "project.bin").write_bytes(b"\0")
+    # rmtree cannot remove a plain file
+    (trash / "0-broken").write_text("x")
+    log = tmp_path / ".trash.log"
+
+    subprocess.run([sys.executable, "-c", background_remove_script(), str(log),
+                    str(trash / "0-broken"), str(trash / "1-impl")], check=True)
+    assert not (trash / "1-impl").exists()
+    assert str(trash / "0-broken") in log.read_text()
@@ -0,0 +1,88 @@
+"""Tests for the pesptool delta upload that only writes changed flash sectors."""
+
+import json
+import hashlib
+
+import pytest
+
+from conftest import install_tool, load_builder, read_calls
+
+ADDRESS = 0x100000
+SECTOR = 4096
+PORT = "/dev/ttyFAKE0"
+
+@pytest.fixture
+def pesptool(tmp_path, monkeypatch):
+    monkeypatch.setenv("FAKE_PESPTOOL_LOG", str(tmp_path / "pesptool_calls.log"))
+    monkeypatch.setenv("FAKE_PESPTOOL_FLASH", str(tmp_path / "flash.bin"))
+    return str(install_tool(tmp_path / "bin", "pesptool", "fake_pesptool.py"))
+
+@pytest.fixture
+def upload(make_env, pesptool, tmp_path):
+    """Delta-upload an image (bytes) to the board; returns the exit code."""
+    env = make_env()
+    uploader = load_builder(env, ("fpga_upload.py",))
+    def upload(image, port=PORT):
+        image_path = tmp_path / "image.bin"
+        image_path.write_bytes(image)
+        return uploader["delta_upload"](env, pesptool, port, str(image_path), ADDRESS)
+    upload.state_dir = uploader["get_flash_state_dir"](env, f"port-{PORT}")
+    return upload
+
+def pesptool_calls(tmp_path):
+    return [json.loads(line) for line in read_calls(tmp_path / "pesptool_calls.log")]
+
+def flash_contents(tmp_path, size):
+    return (tmp_path / "flash.bin").read_bytes()[ADDRESS:ADDRESS + size]
+
+def make_image(sectors, changed=()):
+    return b"".join(bytes([index + (100 if index in changed else 0)]) * SECTOR
+                    for index in range(sectors))
+
+def test_first_upload_writes_full_image_and_manifest(upload, tmp_path):
+    image = make_image(5)
+    assert upload(image) == 0
+    assert pesptool_calls(tmp_path) == [
+        ["--port", PORT, "write-flash", hex(ADDRESS), str(tmp_path / "image.bin")]]
+
+    manifest = json.loads((upload.state_dir / "manifest.json").read_text())
+    assert manifest["address"] == ADDRESS
+    assert manifest["sector_size"] == SECTOR
+    assert manifest["sectors"] == [hashlib.sha256(image[offset:offset + SECTOR]).hexdigest()
+                                   for offset in range(0, len(image), SECTOR)]
+    assert (upload.state_dir / "last_image.bin").read_bytes() == image
+
+def test_only_changed_sectors_are_written(upload, tmp_path):
+    assert upload(make_image(5)) == 0
+    image = make_image(5, changed=(1, 2, 4))
+    assert upload(image) == 0
+
+    verify, write = pesptool_calls(tmp_path)[1:]
+    assert verify[2:4] == ["verify-flash", hex(ADDRESS)]
+    assert write[2] == "write-flash"
+    assert write[3::2] == [hex(ADDRESS + SECTOR), hex(ADDRESS + 4 * SECTOR)]
+    assert flash_contents(tmp_path, len(image)) == image
+    assert not list(upload.state_dir.glob("delta_*.bin"))
+
+def test_unchanged_image_is_not_written(upload, tmp_path):
+    assert upload(make_image(3)) == 0
+    assert upload(make_image(3)) == 0
+    assert [call[2] for call in pesptool_calls(tmp_path)] == ["write-flash", "verify-flash"]
+
+def test_flash_changed_elsewhere_falls_back_to_full_write(upload, tmp_path):
+    assert upload(make_image(4)) == 0
+    # Another tool wrote the flash since the last delta upload
+    flash = bytearray((tmp_path / "flash.bin").read_bytes())
+    flash[ADDRESS:ADDRESS + SECTOR] = b"\xaa" * SECTOR
+    (tmp_path / "flash.bin").write_bytes(bytes(flash))
+
+    image = make_image(4, changed=(3,))
+    assert upload(image) == 0
+    write = pesptool_calls(tmp_path)[-1]
+    assert write[2:] == ["write-flash", hex(ADDRESS), str(tmp_path / "image.bin")]
+    assert flash_contents(tmp_path, len(image)) == image
+
+def test_without_port_writes_full_image(upload, tmp_path):
+    assert upload(make_image(2), port="") == 0
+    assert pesptool_calls(tmp_path) == [["write-flash", hex(ADDRESS), str(tmp_path / "image.bin")]]
+    assert not (upload.state_dir / "manifest.json").exists()
@@ -0,0 +1,85 @@
+"""Tests for projects with several FPGA environments and the build matrix."""
+
+import os
+import json
+
+import pytest
+
+from conftest import TOOLS_DIR, load_builder, read_calls
+
+class FakeProjectConfig:
+    """ProjectConfig stand-in: environment name to its options."""
+
+    def __init__(self, envs):
+        self.options = envs
+
+    def envs(self):
+        return list(self.options)
+
+    def get(self, section, option, default=None):
+        return self.options[section.split(":", 1)[1]].get(option, default)
+
+PROJECT_ENVS = {
+    "fpga": {"platform": "gowin"},
+    "fpga_alt": {"platform": "gowin"},
+    "esp32": {"platform": "espressif32"},
+}
+
+@pytest.fixture
+def make_project_env(make_env):
+    """A FakeEnv for one environment of a project with several FPGA environments."""
+    def make(options=None, name="fpga"):
+        env = make_env(dict({"build.fpga_cache": "0"}, **(options or {})), PIOENV=name)
+        env.GetProjectConfig = lambda: FakeProjectConfig(PROJECT_ENVS)
+        return env
+    return make
+
+def test_environments_build_in_their_own_directory(make_project_env, project, gowin_home, capsys):
+    env = make_project_env()
+    builder = load_builder(env)
+    assert builder["build_fpga_action"]([], [], env) == 0
+    env_dir = project / "fpga/impl/env/fpga"
+    assert (env_dir / "impl/pnr/project.bin").exists()
+    out = capsys.readouterr().out
+    assert "Building in fpga/impl/env/fpga/" in out
+    assert f"Updated project file: {env_dir / 'project.gprj'}" in out
+
+    # An unchanged environment project is not written again
+    mtime = (env_dir / "project.gprj").stat().st_mtime_ns
+    assert builder["build_fpga_action"]([], [], env) == 0
+    assert (env_dir / "project.gprj").stat().st_mtime_ns == mtime
+    assert "Updated project file" not in capsys.readouterr().out
+
+def test_isolation_can_be_turned_off(make_project_env, project, gowin_home):
+    env = make_project_env({"build.fpga_env_isolation": "0"})
+    assert load_builder(env)["build_fpga_action"]([], [], env) == 0
+    assert (project / "fpga/impl/pnr/project.bin").exists()
+    assert not (project / "fpga/impl/env").exists()
+
+def test_matrix_runs_once_per_pio_run(make_project_env, project, tmp_path, monkeypatch, capsys):
+    # `python -m platformio` runs tests/tools/platformio
+    monkeypatch.setenv("PYTHONPATH", str(TOOLS_DIR))
+    monkeypatch.setenv("FAKE_PIO_LOG", str(tmp_path / "pio_calls.log"))
+    for name in ("fpga", "fpga_alt"):
+        env = make_project_env(name=name)
+        load_builder(env, ("fpga_builder.py", "fpga_matrix.py"))
+        assert env["FPGA_MATRIX_ACTION"](None, None, env) == 0
+    assert sorted(read_calls(tmp_path / "pio_calls.log")) == ["fpga", "fpga_alt"]
+    assert "already built by this `pio run`" in capsys.readouterr().out
+    # The last environment of the run removes the marker
+    assert not (project / ".pio/build/fpga_matrix.run").exists()
+
+def test_matrix_marker_of_an_earlier_run_is_ignored(make_project_env, project, tmp_path,
+                                                    monkeypatch, capsys):
+    monkeypatch.setenv("PYTHONPATH", str(TOOLS_DIR))
+    monkeypatch.setenv("FAKE_PIO_LOG", str(tmp_path / "pio_calls.log"))
+    # An earlier `pio run` whose process ID was reused by this one
+    marker = project / ".pio/build/fpga_matrix.run"
+    marker.parent.mkdir(parents=True, exist_ok=True)
+    marker.write_text(json.dumps({"pid": os.getppid(), "started": "0", "pending": ["fpga"]}))
+    env = make_project_env()
+    load_builder(env, ("fpga_builder.py", "fpga_matrix.py"))
+    assert env["FPGA_MATRIX_ACTION"](None, None, env) == 0
+    assert sorted(read_calls(tmp_path / "pio_calls.log")) == ["fpga", "fpga_alt"]
+    assert "already built" not in capsys.readouterr().out
+    assert json.loads(marker.read_text())["pending"] == ["fpga_alt"]
@@ -0,0 +1,48 @@
+"""Tests for parallel place & route strategy exploration."""
+
+import json
+
+from conftest import load_builder
+
+STRATEGIES = "place_option=0 | place_option=1 | place_option=2"
+
+def explore(make_env, **options):
+    env = make_env(dict({"build.fpga_cache": "0", "build.fpga_explore": "1",
+                         "build.fpga_explore_strategies": STRATEGIES}, **options))
+    builder = load_builder(env)
+    return builder, builder["build_fpga_action"]([], [], env)
+
+def read_summary(project):
+    return json.loads((project / "fpga/impl/explore/summary.json").read_text(encoding="utf-8"))
+
+def test_synthesizes_once_and_runs_every_strategy(make_env, project, gowin_home, gw_sh_calls):
+    _, returncode = explore(make_env)
+    assert returncode == 0
+    assert gw_sh_calls() == ["syn", "pnr", "pnr", "pnr"]
+    summary = read_summary(project)
+    assert [run["strategy"] for run in summary["runs"]] == [
+        {"place_option": "0"}, {"place_option": "1"}, {"place_option": "2"}]
+    tcl = (project / "fpga/impl/explore/run_1/impl/pnr_script.tcl").read_text()
+    assert "-place_option 1" in tcl
+
+def test_promotes_the_best_run(make_env, project, gowin_home):
+    for metric in ("slack", "fmax"):
+        builder, returncode = explore(make_env, **{"build.fpga_explore_metric": metric})
+        assert returncode == 0
+        runs = read_summary(project)["runs"]
+        best = max(runs, key=lambda run: builder["explore_score"](run["timing"], metric))
+        best_bitstream = project / "fpga/impl/explore" / f"run_{best['index']}" / "impl/pnr/project.bin"
+        assert (project / "fpga/impl/pnr/project.bin").read_bytes() == best_bitstream.read_bytes()
+
+def test_failed_strategy_is_skipped(make_env, project, gowin_home, monkeypatch):
+    monkeypatch.setenv("FAKE_GW_SH_FAIL", "-place_option 0")
+    _, returncode = explore(make_env)
+    assert returncode == 0
+    runs = read_summary(project)["runs"]
+    assert runs[0]["timing"] is None
+    assert all(run["timing"] for run in runs[1:])
+
+def test_all_strategies_failing_fails_the_build(make_env, gowin_home, monkeypatch):
+    monkeypatch.setenv("FAKE_GW_SH_FAIL", "-place_option")
+    _, returncode = explore(make_env)
+    assert returncode != 0
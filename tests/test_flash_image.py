@@ -0,0 +1,68 @@
+"""Tests for packing the MCU firmware and the bitstream into one flash image."""
+
+import pytest
+
+from conftest import BUILDER_SCRIPTS, TOOLS_DIR, load_builder, read_calls
+
+@pytest.fixture
+def dual_env(make_env, tmp_path, monkeypatch):
+    """Environment of a dual-target project naming the esp32 firmware environment."""
+    # `python -m platformio` runs tests/tools/platformio
+    monkeypatch.setenv("PYTHONPATH", str(TOOLS_DIR))
+    monkeypatch.setenv("FAKE_PIO_LOG", str(tmp_path / "pio_calls.log"))
+    return make_env({"build.fpga_firmware_env": "esp32", "build.fpga_flash_size": "4MB",
+                     "build.fpga_cache": "0"})
+
+@pytest.fixture
+def packer(dual_env):
+    namespace = load_builder(dual_env, ("flash_image.py",))
+    yield namespace
+    namespace["stop_firmware_builds"]()
+
+@pytest.fixture
+def combine(dual_env, packer, project):
+    """Run the combined-image action on the bitstream; returns the exit code."""
+    bitstream = project / ".pio/build/fpga/fpga_bitstream.bin"
+    if not bitstream.exists():
+        bitstream.write_bytes(b"\x5a" * 4096)
+    output = project / ".pio/build/fpga/combined_flash.bin"
+    return lambda: packer["combine_flash_image_action"]([str(output)], [str(bitstream)], dual_env)
+
+def test_builds_firmware_then_packs_image(combine, project, tmp_path):
+    assert combine() == 0
+    assert read_calls(tmp_path / "pio_calls.log") == ["esp32"]
+    image = (project / ".pio/build/fpga/combined_flash.bin").read_bytes()
+    firmware = (project / ".pio/build/esp32/firmware.bin").read_bytes()
+    assert image[:len(firmware)] == firmware
+    assert image[len(firmware):0x100000] == b"\xff" * (0x100000 - len(firmware))
+    assert image[0x100000:] == b"\x5a" * 4096
+    assert (project / ".pio/build/fpga/esp32_build.log").read_text().startswith("Processing esp32")
+
+def test_firmware_builds_alongside_the_gateware(dual_env, packer, combine, gowin_home, tmp_path,
+                                                monkeypatch, capsys):
+    monkeypatch.setenv("FAKE_PIO_DELAY", "1")
+    dual_env["FPGA_BUILD_FIRMWARE"] = True
+    assert load_builder(dual_env, BUILDER_SCRIPTS)["build_fpga_action"]([], [], dual_env) == 0
+    # Still compiling once the gateware is done
+    proc = packer["FIRMWARE_BUILDS"]["esp32"][0]
+    assert proc.poll() is None
+    assert combine() == 0
+    out = capsys.readouterr().out
+    assert "Building firmware environment 'esp32' in the background" in out
+    assert "Waiting for firmware environment 'esp32'" in out
+    assert read_calls(tmp_path / "pio_calls.log") == ["esp32"]
+    assert packer["FIRMWARE_BUILDS"] == {}
+
+def test_unwaited_firmware_build_is_stopped(dual_env, packer, monkeypatch):
+    monkeypatch.setenv("FAKE_PIO_DELAY", "30")
+    assert packer["start_firmware_build"](dual_env)
+    proc = packer["FIRMWARE_BUILDS"]["esp32"][0]
+    packer["stop_firmware_builds"]()
+    assert proc.poll() is not None
+    assert packer["FIRMWARE_BUILDS"] == {}
+
+def test_failed_firmware_build_fails_packing(combine, project, tmp_path, monkeypatch, capsys):
+    monkeypatch.setenv("FAKE_PIO_FAIL", "1")
+    assert combine() == 1
+    assert not (project / ".pio/build/fpga/combined_flash.bin").exists()
+    assert "error: expected ';'" in capsys.readouterr().out
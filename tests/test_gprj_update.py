@@ -0,0 +1,59 @@
+"""Tests for keeping the .gprj file list and top module in line with the sources."""
+
+import re
+
+from conftest import load_builder
+
+def file_entries(gprj):
+    return re.findall(r'<File path="([^"]+)" type="([^"]+)"', gprj.read_text())
+
+def update(make_env, project, top_module="blinky"):
+    builder = load_builder(make_env())
+    sources = builder["scan_fpga_sources"](project / "fpga")
+    return builder["update_gprj_file"](project / "fpga/project.gprj", sources,
+                                       project / "fpga", top_module)
+
+def test_unchanged_project_is_not_rewritten(make_env, project, gowin_home, capsys):
+    gprj = project / "fpga/project.gprj"
+    before = gprj.read_bytes()
+    mtime = gprj.stat().st_mtime_ns
+    env = make_env({"build.fpga_cache": "0"})
+    assert load_builder(env)["build_fpga_action"]([], [], env) == 0
+    assert gprj.read_bytes() == before
+    assert gprj.stat().st_mtime_ns == mtime
+    assert "Updated project file" not in capsys.readouterr().out
+
+def test_file_list_follows_the_sources(make_env, project, capsys):
+    gprj = project / "fpga/project.gprj"
+    # Entries outside src/ and constraints/, and comments, belong to the user
+    gprj.write_text(gprj.read_text().replace(
+        "<FileList>", '<FileList><!-- keep me --><File path="ip/pll.v" type="file.verilog" enable="1" />'))
+    (project / "fpga/src/uart.v").write_text("module uart; endmodule\n")
+    (project / "fpga/src/counter.vhd").unlink()
+    assert update(make_env, project)
+    assert file_entries(gprj) == [("ip/pll.v", "file.verilog"), ("src/blinky.v", "file.verilog"),
+                                  ("src/uart.v", "file.verilog"), ("constraints/pins.cst", "file.cst")]
+    assert "<!-- keep me -->" in gprj.read_text()
+    assert "Updated project file" in capsys.readouterr().out
+
+    # A second update finds nothing to change
+    mtime = gprj.stat().st_mtime_ns
+    assert update(make_env, project)
+    assert gprj.stat().st_mtime_ns == mtime
+    assert "Updated project file" not in capsys.readouterr().out
+
+def test_top_module_follows_the_board_option(make_env, project, capsys):
+    gprj = project / "fpga/project.gprj"
+    assert update(make_env, project, "counter")
+    assert '<TopModule name="counter" />' in gprj.read_text()
+    assert "Updated project file" in capsys.readouterr().out
+    mtime = gprj.stat().st_mtime_ns
+    assert update(make_env, project, "counter")
+    assert gprj.stat().st_mtime_ns == mtime
+
+def test_disabled_entries_are_enabled(make_env, project):
+    gprj = project / "fpga/project.gprj"
+    gprj.write_text(gprj.read_text().replace('src/blinky.v" type="file.verilog" enable="1"',
+                                             'src/blinky.v" type="file.verilog" enable="0"'))
+    assert update(make_env, project)
+    assert 'src/blinky.v" type="file.verilog" enable="1"' in gprj.read_text()
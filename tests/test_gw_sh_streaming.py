@@ -0,0 +1,47 @@
+"""Tests for streaming gw_sh output and stopping it early."""
+
+import time
+
+from conftest import load_builder
+
+def build(make_env, **options):
+    env = make_env(dict({"build.fpga_cache": "0"}, **options))
+    start = time.time()
+    returncode = load_builder(env)["build_fpga_action"]([], [], env)
+    return returncode, time.time() - start
+
+def test_output_is_shown_by_phase_and_logged(make_env, project, gowin_home, capsys):
+    assert build(make_env)[0] == 0
+    out = capsys.readouterr().out
+    headers = [out.index(f"--- [{phase}] ") for phase in ("syn", "pnr", "bitgen")]
+    assert headers == sorted(headers)
+    assert out.index("--- [pnr] ") < out.index("Running routing ...")
+    log = (project / "fpga/impl/gw_sh.log").read_text()
+    assert "Running routing ..." in log
+    assert "--- [" not in log
+
+def test_fatal_error_stops_gw_sh(make_env, project, gowin_home, monkeypatch, capsys):
+    monkeypatch.setenv("FAKE_GW_SH_FAIL", "1")
+    monkeypatch.setenv("FAKE_GW_SH_LINGER", "30")
+    returncode, seconds = build(make_env)
+    assert returncode != 0
+    assert seconds < 10
+    out = capsys.readouterr().out
+    assert "Aborted gw_sh after" in out
+    assert "on fatal error: ERROR (EX3863)" in out
+    assert "ERROR (EX3863)" in (project / "fpga/impl/gw_sh.log").read_text()
+
+def test_abort_can_be_disabled(make_env, gowin_home, monkeypatch, capsys):
+    monkeypatch.setenv("FAKE_GW_SH_FAIL", "1")
+    monkeypatch.setenv("FAKE_GW_SH_LINGER", "1")
+    returncode, seconds = build(make_env, **{"build.fpga_abort_on_error": "0"})
+    assert returncode != 0
+    assert seconds >= 1
+    assert "Aborted gw_sh" not in capsys.readouterr().out
+
+def test_run_is_stopped_at_the_timeout(make_env, gowin_home, monkeypatch, capsys):
+    monkeypatch.setenv("FAKE_GW_SH_LINGER", "30")
+    returncode, seconds = build(make_env, **{"build.fpga_build_timeout": "1"})
+    assert returncode != 0
+    assert seconds < 10
+    assert "gw_sh timed out after 1s" in capsys.readouterr().out
@@ -0,0 +1,97 @@
+"""Tests for the persistent gw_sh worker and its fallback to a direct gw_sh run."""
+
+import os
+import json
+import shutil
+import signal
+import socket
+import struct
+import threading
+
+import pytest
+
+from conftest import load_builder
+
+@pytest.fixture
+def stop_workers(platform_dir):
+    """Stop the workers a test started once it is done."""
+    yield
+    for state_path in (platform_dir.parent / ".cache" / "gw_sh_worker").glob("*.json"):
+        try:
+            os.kill(json.loads(state_path.read_text())["pid"], signal.SIGTERM)
+        except (OSError, ValueError, KeyError):
+            pass
+
+@pytest.fixture
+def dropping_worker():
+    """A worker that accepts one request and then resets the connection."""
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(1)
+    requests = []
+    def serve():
+        conn, _ = server.accept()
+        with conn, conn.makefile("r") as reader:
+            requests.append(json.loads(reader.readline()))
+            conn.sendall(b"GowinSynthesis start\n")
+            conn.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    yield {"port": server.getsockname()[1], "token": "secret"}, requests
+    thread.join(5)
+    server.close()
+
+def write_script(project):
+    impl_dir = project / "fpga/impl"
+    impl_dir.mkdir(parents=True, exist_ok=True)
+    tcl_script = impl_dir / "build_script.tcl"
+    tcl_script.write_text("open_project ../project.gprj\nrun all\nexit\n")
+    return impl_dir, tcl_script
+
+def test_builds_share_one_gw_sh_session(make_env, project, gowin_home, gw_sh_calls, stop_workers):
+    env = make_env({"build.fpga_cache": "0", "build.fpga_gw_sh_worker": "1",
+                    "build.fpga_gw_sh_worker_idle": "60"})
+    builder = load_builder(env)
+    assert builder["build_fpga_action"]([], [], env) == 0
+    shutil.rmtree(project / "fpga/impl")
+    assert builder["build_fpga_action"]([], [], env) == 0
+    assert gw_sh_calls() == ["console", "all", "all"]
+    assert (project / "fpga/impl/pnr/project.bin").exists()
+
+def test_unreachable_worker_falls_back_to_gw_sh(make_env, project, gowin_home, gw_sh_calls):
+    builder = load_builder(make_env())
+    impl_dir, tcl_script = write_script(project)
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    worker = {"port": port, "token": "secret"}
+    assert builder["run_gw_sh"](gowin_home / "IDE/bin/gw_sh", tcl_script, impl_dir,
+                                worker=worker) == 0
+    assert gw_sh_calls() == ["all"]
+
+def test_worker_failure_after_request_fails_the_build(make_env, project, gowin_home, gw_sh_calls,
+                                                      dropping_worker, capsys):
+    builder = load_builder(make_env())
+    impl_dir, tcl_script = write_script(project)
+    worker, requests = dropping_worker
+    assert builder["run_gw_sh"](gowin_home / "IDE/bin/gw_sh", tcl_script, impl_dir,
+                                worker=worker) == 1
+    assert requests[0]["cmd"] == "run"
+    # The build is not repeated with a local gw_sh
+    assert gw_sh_calls() == []
+    assert "Lost connection to gw_sh worker" in capsys.readouterr().out
+
+def test_success_without_new_outputs_fails_the_build(make_env, project, gowin_home, gw_sh_calls,
+                                                    stop_workers, monkeypatch, capsys):
+    # A stage that fails without a Tcl error still reports exit code 0
+    monkeypatch.setenv("FAKE_GW_SH_NO_OUTPUT", "1")
+    stale = project / "fpga/impl/pnr/project.bin"
+    stale.parent.mkdir(parents=True)
+    stale.write_bytes(b"old bitstream")
+    env = make_env({"build.fpga_cache": "0", "build.fpga_gw_sh_worker": "1",
+                    "build.fpga_gw_sh_worker_idle": "60"})
+    assert load_builder(env)["build_fpga_action"]([], [], env) != 0
+    assert gw_sh_calls() == ["console", "all"]
+    assert "gw_sh reported success but wrote no gwsynthesis/*.vg, pnr/*.bin" in capsys.readouterr().out
+    assert not stale.exists()
+    assert not (project / ".pio/build/fpga/fpga_bitstream.bin").exists()
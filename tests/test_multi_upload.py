@@ -0,0 +1,83 @@
+"""Tests for uploading the bitstream to several boards at once."""
+
+import json
+
+import pytest
+
+from conftest import install_tool, load_builder
+
+ADDRESS = 0x100000
+PORTS = ["/dev/ttyFAKE0", "/dev/ttyFAKE1", "/dev/ttyFAKE2"]
+IMAGE = bytes(range(256)) * 64
+
+@pytest.fixture
+def upload(make_env, tmp_path, monkeypatch):
+    """Run the multi-board upload with the given board options; returns the exit code."""
+    monkeypatch.setenv("FAKE_PESPTOOL_LOG", str(tmp_path / "pesptool_calls.log"))
+    monkeypatch.setenv("FAKE_PESPTOOL_FLASH", str(tmp_path / "flash-{port}.bin"))
+    pesptool = str(install_tool(tmp_path / "bin", "pesptool", "fake_pesptool.py"))
+    image_path = tmp_path / "fpga_bitstream.bin"
+    image_path.write_bytes(IMAGE)
+
+    def upload(options):
+        env = make_env(options, UPLOADER=pesptool, UPLOAD_PROTOCOL="pesptool")
+        uploader = load_builder(env, ("fpga_upload.py",))
+        upload.env = env
+        return uploader["multi_upload_action"]([], [image_path], env)
+    return upload
+
+def flash_contents(tmp_path, port):
+    flash = (tmp_path / f"flash-{port.rsplit('/', 1)[1]}.bin").read_bytes()
+    return flash[ADDRESS:ADDRESS + len(IMAGE)]
+
+def upload_results(env):
+    with open(f"{env['BUILD_DIR']}/fpga_upload_results.json", encoding="utf-8") as f:
+        return json.load(f)
+
+def test_every_board_is_flashed(upload, tmp_path, capsys):
+    assert upload({"build.fpga_upload_ports": ", ".join(PORTS)}) == 0
+    for port in PORTS:
+        assert flash_contents(tmp_path, port) == IMAGE
+    results = upload_results(upload.env)
+    assert results["protocol"] == "pesptool"
+    assert list(results["boards"]) == PORTS
+    assert all(board["ok"] and board["attempts"] == 1 for board in results["boards"].values())
+    out = capsys.readouterr().out
+    assert "Uploading to 3 board(s), 3 at a time..." in out
+    assert "Uploaded 3 of 3 board(s)" in out
+
+def test_failed_board_is_retried(upload, tmp_path, monkeypatch):
+    monkeypatch.setenv("FAKE_PESPTOOL_FAIL", "/dev/ttyFAKE1:1")
+    assert upload({"build.fpga_upload_ports": ", ".join(PORTS)}) == 0
+    board = upload_results(upload.env)["boards"]["/dev/ttyFAKE1"]
+    assert board["ok"] and board["attempts"] == 2
+    assert "Attempt 1 failed with exit code 2, retrying" in open(board["log"]).read()
+    assert flash_contents(tmp_path, "/dev/ttyFAKE1") == IMAGE
+
+def test_failing_board_does_not_stop_the_others(upload, tmp_path, monkeypatch, capsys):
+    monkeypatch.setenv("FAKE_PESPTOOL_FAIL", "/dev/ttyFAKE1")
+    options = {"build.fpga_upload_ports": "\n".join(PORTS), "build.fpga_upload_jobs": "1",
+               "build.fpga_upload_retries": "2"}
+    assert upload(options) == 1
+    boards = upload_results(upload.env)["boards"]
+    assert not boards["/dev/ttyFAKE1"]["ok"]
+    assert boards["/dev/ttyFAKE1"]["attempts"] == 3
+    for port in ("/dev/ttyFAKE0", "/dev/ttyFAKE2"):
+        assert boards[port]["ok"]
+        assert flash_contents(tmp_path, port) == IMAGE
+    out = capsys.readouterr().out
+    assert "Uploading to 3 board(s), 1 at a time..." in out
+    assert "/dev/ttyFAKE1: FAILED (exit code 2)" in out
+    assert f"Failed: /dev/ttyFAKE1 (log: {boards['/dev/ttyFAKE1']['log']})" in out
+
+def test_port_patterns_are_expanded(make_env, tmp_path):
+    uploader = load_builder(make_env(), ("fpga_upload.py",))
+    for name in ("ttyACM1", "ttyACM0", "ttyUSB0"):
+        (tmp_path / name).touch()
+    value = f"{tmp_path}/ttyACM*,\n{tmp_path}/ttyACM0, /dev/ttyS9,"
+    assert uploader["resolve_upload_ports"](value) == [
+        f"{tmp_path}/ttyACM0", f"{tmp_path}/ttyACM1", "/dev/ttyS9"]
+
+def test_no_boards_is_an_error(upload, capsys):
+    assert upload({"build.fpga_upload_ports": "/nonexistent/ttyNONE*"}) == 1
+    assert "Error: No boards found for board_build.fpga_upload_ports" in capsys.readouterr().out
@@ -0,0 +1,57 @@
+"""Tests for out-of-context synthesis of listed modules."""
+
+import re
+from collections import Counter
+
+import pytest
+
+from conftest import load_builder
+
+@pytest.fixture
+def ooc_project(project):
+    """The example with two listed modules sharing leaves with each other and the top level."""
+    src = project / "fpga/src"
+    blinky = (src / "blinky.v").read_text()
+    (src / "blinky.v").write_text(blinky.replace(
+        "endmodule", "  pwm u_pwm (.clk(clk));\n  dimmer u_dim (.clk(clk));\n"
+                     "  sync_ff u_sync (.clk(clk));\nendmodule", 1))
+    (src / "pwm.v").write_text("module pwm(input clk);\n  sync_ff s (.clk(clk));\n"
+                               "  edge_detect e (.clk(clk));\nendmodule\n")
+    (src / "dimmer.v").write_text("module dimmer(input clk);\n  edge_detect e (.clk(clk));\nendmodule\n")
+    (src / "sync_ff.v").write_text("module sync_ff(input clk);\nendmodule\n")
+    (src / "edge_detect.v").write_text("module edge_detect(input clk);\nendmodule\n")
+    return project
+
+def build(make_env):
+    env = make_env({"build.fpga_cache": "0", "build.fpga_ooc_modules": "pwm dimmer"})
+    return load_builder(env)["build_fpga_action"]([], [], env)
+
+def top_level_definitions(project):
+    gprj = project / "fpga/impl/ooc/top/project.gprj"
+    definitions = Counter()
+    for path in re.findall(r'<File path="([^"]+)" type="file.verilog"', gprj.read_text()):
+        text = (gprj.parent / path).read_text()
+        definitions.update(re.findall(r"^\s*module\s+(\w+)", text, re.M))
+    return definitions
+
+def test_shared_leaves_are_defined_once(make_env, ooc_project, gowin_home, gw_sh_calls, capsys):
+    assert build(make_env) == 0
+    # Two modules, then the top level
+    assert gw_sh_calls() == ["syn", "syn", "all"]
+    assert "Synthesizing 2 module(s) out of context" in capsys.readouterr().out
+    assert top_level_definitions(ooc_project) == Counter(
+        ["blinky", "pwm", "dimmer", "sync_ff", "edge_detect"])
+    # sync_ff comes from the top level's own sources
+    links = ooc_project / "fpga/impl/ooc/top/netlists"
+    assert "sync_ff" not in (links / "pwm.vg").read_text()
+    assert (ooc_project / ".pio/build/fpga/fpga_bitstream.bin").exists()
+
+def test_unchanged_modules_reuse_their_netlists(make_env, ooc_project, gowin_home, gw_sh_calls, capsys):
+    assert build(make_env) == 0
+    with open(ooc_project / "fpga/src/dimmer.v", "a") as f:
+        f.write("// changed\n")
+    capsys.readouterr()
+    assert build(make_env) == 0
+    assert gw_sh_calls() == ["syn", "syn", "all", "syn", "all"]
+    assert "pwm: unchanged, using cached netlist" in capsys.readouterr().out
+    assert top_level_definitions(ooc_project)["edge_detect"] == 1
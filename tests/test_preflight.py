@@ -0,0 +1,24 @@
+"""Tests for the constraint pre-flight check."""
+
+from conftest import load_builder
+
+def build_with_unknown_port(make_env, project, options=None):
+    with open(project / "fpga/constraints/pins.cst", "a") as f:
+        f.write('\nIO_LOC "no_such_port" 10;\n')
+    env = make_env(dict({"build.fpga_cache": "0"}, **(options or {})))
+    return load_builder(env)["build_fpga_action"]([], [], env)
+
+def test_errors_only_warn_by_default(make_env, project, gowin_home, gw_sh_calls, capsys):
+    assert build_with_unknown_port(make_env, project) == 0
+    assert gw_sh_calls() == ["all"]
+    out = capsys.readouterr().out
+    assert "no_such_port" in out
+    assert "building anyway" in out
+
+def test_errors_fail_the_build_when_enabled(make_env, project, gowin_home, gw_sh_calls):
+    assert build_with_unknown_port(make_env, project, {"build.fpga_preflight": "1"}) != 0
+    assert gw_sh_calls() == []
+
+def test_check_can_be_disabled(make_env, project, gowin_home, capsys):
+    assert build_with_unknown_port(make_env, project, {"build.fpga_preflight": "0"}) == 0
+    assert "no_such_port" not in capsys.readouterr().out
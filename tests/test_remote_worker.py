@@ -0,0 +1,109 @@
+"""Tests for remote gw_sh builds against a worker on localhost."""
+
+import sys
+import json
+import time
+import hashlib
+import shutil
+import socket
+import threading
+import subprocess
+
+import pytest
+
+from conftest import PLATFORM_DIR, load_builder
+
+import gw_sh_remote_worker
+
+TOKEN = "s3cret"
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+@pytest.fixture
+def remote_worker(gowin_home, tmp_path, monkeypatch):
+    """URL of a worker on localhost that builds with the stand-in gw_sh."""
+    port = get_free_port()
+    worker = subprocess.Popen(
+        [sys.executable, str(PLATFORM_DIR / "builder" / "gw_sh_remote_worker.py"),
+         "--listen", f"127.0.0.1:{port}", "--token", TOKEN, "--jobs", "1",
+         "--gowin-home", str(gowin_home), "--work-dir", str(tmp_path / "remote")],
+        stderr=subprocess.DEVNULL)
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+    # The client has no Gowin installation of its own
+    monkeypatch.delenv("GOWIN_HOME")
+    yield f"tcp://127.0.0.1:{port}"
+    worker.terminate()
+    worker.wait()
+
+def build(make_env, url, token=TOKEN):
+    env = make_env({"build.fpga_cache": "0", "build.device": "GW2A-18",
+                    "build.fpga_remote": url, "build.fpga_remote_token": token})
+    return load_builder(env)["build_fpga_action"]([], [], env)
+
+def test_uploads_only_new_blobs(make_env, project, remote_worker, gw_sh_calls, capsys):
+    assert build(make_env, remote_worker) == 0
+    assert gw_sh_calls() == ["all"]
+    assert (project / "fpga/impl/pnr/project.bin").exists()
+    assert (project / ".pio/build/fpga/fpga_bitstream.bin").exists()
+    assert "Uploaded 4 of 4 file(s)" in capsys.readouterr().out
+
+    # The worker's blob store already has every file
+    shutil.rmtree(project / "fpga/impl")
+    assert build(make_env, remote_worker) == 0
+    assert "Uploaded 0 of 4 file(s)" in capsys.readouterr().out
+    assert (project / "fpga/impl/pnr/project.bin").exists()
+
+    with open(project / "fpga/src/blinky.v", "a") as f:
+        f.write("\n// changed\n")
+    assert build(make_env, remote_worker) == 0
+    assert "Uploaded 1 of 4 file(s)" in capsys.readouterr().out
+    assert gw_sh_calls() == ["all", "all", "all"]
+
+def test_wrong_token_is_refused(make_env, remote_worker, gw_sh_calls, capsys):
+    assert build(make_env, remote_worker, token="wrong") != 0
+    assert "invalid token" in capsys.readouterr().out
+    assert gw_sh_calls() == []
+
+def test_ops_before_hello_are_refused(remote_worker, gw_sh_calls):
+    tcl = b"run all\n"
+    digest = hashlib.sha256(tcl).hexdigest()
+    host, port = remote_worker[len("tcp://"):].rsplit(":", 1)
+    with socket.create_connection((host, int(port)), timeout=10) as sock:
+        stream = sock.makefile("rwb")
+        stream.write(json.dumps({"op": "blob", "sha256": digest, "size": len(tcl)}).encode() + b"\n" + tcl)
+        stream.write(json.dumps({"op": "build", "gprj": "project.gprj", "tcl": tcl.decode(),
+                                 "files": {"project.gprj": digest}}).encode() + b"\n")
+        stream.flush()
+        reply = json.loads(stream.readline())
+        assert reply == {"ok": False, "error": "not authenticated, send hello first"}
+        assert stream.readline() == b""
+    assert gw_sh_calls() == []
+
+def test_slots_limit_concurrent_builds(tmp_path):
+    events = []
+    first = gw_sh_remote_worker.Slot(tmp_path, 1, lambda: events.append("queued"))
+    second = gw_sh_remote_worker.Slot(tmp_path, 1, lambda: events.append("queued"))
+    def take_second():
+        with second:
+            events.append("second")
+    with first:
+        thread = threading.Thread(target=take_second)
+        thread.start()
+        time.sleep(0.3)
+        events.append("first done")
+    thread.join(5)
+    assert events == ["queued", "first done", "second"]
+
+def test_token_check():
+    assert gw_sh_remote_worker.check_token(TOKEN, TOKEN)
+    assert not gw_sh_remote_worker.check_token("wrong", TOKEN)
+    assert not gw_sh_remote_worker.check_token(None, TOKEN)
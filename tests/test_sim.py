@@ -0,0 +1,106 @@
+"""Tests for running testbenches with pio run -t sim."""
+
+import re
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from conftest import install_tool, load_builder, read_calls
+
+ADDER = "module adder(input [3:0] a, b, output [4:0] sum);\n  assign sum = a + b;\nendmodule\n"
+
+PASSING_TB = """\
+module adder_tb;
+  adder dut (.a(4'd1), .b(4'd2));
+  initial $display("adder ok");
+endmodule
+"""
+
+FAILING_TB = """\
+module overflow_tb;
+  adder dut (.a(4'd15), .b(4'd15));
+  initial $fatal(1, "sum overflowed");
+endmodule
+"""
+
+@pytest.fixture
+def sim_project(project, tmp_path, monkeypatch):
+    """The example with an adder, its testbenches and a fake Icarus Verilog on PATH."""
+    (project / "fpga/src/adder.v").write_text(ADDER)
+    (project / "fpga/test").mkdir()
+    (project / "fpga/test/adder_tb.v").write_text(PASSING_TB)
+    (project / "fpga/test/overflow_tb.v").write_text(FAILING_TB)
+    bin_dir = tmp_path / "bin"
+    install_tool(bin_dir, "iverilog", "fake_iverilog.py")
+    install_tool(bin_dir, "vvp", "fake_iverilog.py")
+    monkeypatch.setenv("PATH", str(bin_dir))
+    monkeypatch.setenv("FAKE_IVERILOG_LOG", str(tmp_path / "iverilog_calls.log"))
+    return project
+
+@pytest.fixture
+def sim(make_env, sim_project, tmp_path):
+    """Run pio run -t sim with the given board options; returns the exit code."""
+    def sim(options=None):
+        env = make_env(options)
+        load_builder(env)
+        sim.env = env
+        return load_builder(env, ("fpga_sim.py",))["sim_action"]([], [], env)
+    sim.compiled = lambda: read_calls(tmp_path / "iverilog_calls.log")
+    return sim
+
+def junit_cases(env):
+    suite = ET.parse(f"{env['BUILD_DIR']}/fpga_sim_results.xml").getroot().find("testsuite")
+    return suite, {case.get("name"): case for case in suite.findall("testcase")}
+
+def test_results_are_reported(sim, capsys):
+    assert sim() == 1
+    out = capsys.readouterr().out
+    assert "Running 2 testbench(es) with iverilog, 2 at a time" in out
+    assert "adder_tb: PASSED" in out
+    assert "overflow_tb: FAILED" in out
+    assert "FATAL: sum overflowed" in out
+    assert "Simulation: 1 passed, 1 failed, 0 error(s), 0 skipped" in out
+
+    suite, cases = junit_cases(sim.env)
+    assert (suite.get("tests"), suite.get("failures"), suite.get("errors")) == ("2", "1", "0")
+    assert cases["adder_tb"].find("failure") is None
+    assert cases["adder_tb"].find("system-out").text == "adder ok"
+    assert cases["overflow_tb"].find("failure").get("message") == "FATAL: sum overflowed"
+
+def test_models_are_reused_until_a_source_changes(sim, sim_project, capsys):
+    sim()
+    assert sorted(sim.compiled()) == ["adder_tb", "overflow_tb"]
+    capsys.readouterr()
+    sim()
+    assert len(sim.compiled()) == 2
+    assert re.search(r"adder_tb: PASSED in [\d.]+s \(cached model\)", capsys.readouterr().out)
+
+    with open(sim_project / "fpga/test/adder_tb.v", "a") as f:
+        f.write("// changed\n")
+    sim()
+    assert sim.compiled()[2:] == ["adder_tb"]
+
+def test_filter_and_compile_errors(sim, sim_project, capsys):
+    (sim_project / "fpga/src/adder.v").write_text(ADDER.replace("assign", "!! assign"))
+    assert sim({"build.fpga_sim_filter": "adder*"}) == 1
+    out = capsys.readouterr().out
+    assert "Running 1 testbench(es)" in out
+    assert "adder_tb: ERROR: compilation failed" in out
+    assert "adder.v:2: syntax error" in out
+    suite, cases = junit_cases(sim.env)
+    assert list(cases) == ["adder_tb"]
+    assert cases["adder_tb"].find("error") is not None
+
+def test_testbench_is_stopped_at_the_timeout(sim, sim_project, capsys):
+    (sim_project / "fpga/test/adder_tb.v").write_text(PASSING_TB + "// hang\n")
+    assert sim({"build.fpga_sim_timeout": "1", "build.fpga_sim_filter": "adder_tb"}) == 1
+    assert re.search(r"adder_tb: FAILED in [\d.]+s \(compiled in [\d.]+s\): timed out after 1.0s",
+                     capsys.readouterr().out)
+
+def test_mixed_language_testbench_is_an_error(sim, sim_project, capsys):
+    (sim_project / "fpga/test/counter_tb.v").write_text(
+        "module counter_tb;\n  counter dut ();\nendmodule\n")
+    assert sim({"build.fpga_sim_filter": "counter_tb"}) == 1
+    assert ("counter_tb: ERROR: uses both Verilog and VHDL, which the supported "
+            "simulators cannot mix") in capsys.readouterr().out
+    assert sim.compiled() == []
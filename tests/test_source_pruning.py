@@ -0,0 +1,62 @@
+"""Tests for pruning HDL sources to the files the top module needs."""
+
+import re
+
+from conftest import load_builder
+
+def add_sources(project):
+    src = project / "fpga/src"
+    blinky = (src / "blinky.v").read_text()
+    (src / "blinky.v").write_text('`include "defs.vh"\n' + blinky.replace(
+        "endmodule", "  uart u_uart (.clk(clk));\nendmodule", 1))
+    (src / "defs.vh").write_text("`define WIDTH 8\n")
+    (src / "uart.v").write_text("module uart(input clk);\n  fifo f ();\nendmodule\n")
+    (src / "fifo.v").write_text("module fifo; endmodule\n")
+    (src / "unused_ip").mkdir()
+    (src / "unused_ip/ddr3.v").write_text("module ddr3; endmodule\n")
+    (src / "unused_ip/ddr3_pkg.vhd").write_text("package ddr3_pkg is\nend package;\n")
+
+def gprj_files(project):
+    return re.findall(r'<File path="([^"]+)"', (project / "fpga/project.gprj").read_text())
+
+def test_only_reachable_files_are_built(make_env, project, gowin_home, capsys):
+    add_sources(project)
+    env = make_env({"build.fpga_cache": "0", "build.fpga_prune_sources": "1"})
+    builder = load_builder(env)
+    assert builder["build_fpga_action"]([], [], env) == 0
+    # counter.vhd is used by blinky as well
+    assert gprj_files(project) == ["src/blinky.v", "src/defs.vh", "src/fifo.v", "src/uart.v",
+                                   "src/counter.vhd", "constraints/pins.cst"]
+    assert "Skipping 2 HDL file(s) not used by top module 'blinky'" in capsys.readouterr().out
+    assert (project / "fpga/impl/hdl_graph.json").exists()
+
+    # SCons only tracks the same files
+    dependencies = {path.replace("\\", "/").split("/fpga/", 1)[1]
+                    for path in builder["get_fpga_sources"](env)}
+    assert "src/unused_ip/ddr3.v" not in dependencies
+    assert {"src/uart.v", "src/fifo.v", "src/defs.vh"} <= dependencies
+
+def test_newly_used_file_is_added(make_env, project, gowin_home):
+    add_sources(project)
+    env = make_env({"build.fpga_cache": "0", "build.fpga_prune_sources": "1"})
+    builder = load_builder(env)
+    assert builder["build_fpga_action"]([], [], env) == 0
+    with open(project / "fpga/src/fifo.v", "w") as f:
+        f.write("module fifo;\n  ddr3 mem ();\nendmodule\n")
+    assert builder["build_fpga_action"]([], [], env) == 0
+    assert "src/unused_ip/ddr3.v" in gprj_files(project)
+    assert "src/unused_ip/ddr3_pkg.vhd" not in gprj_files(project)
+
+def test_pruning_is_off_by_default(make_env, project, gowin_home):
+    add_sources(project)
+    env = make_env({"build.fpga_cache": "0"})
+    assert load_builder(env)["build_fpga_action"]([], [], env) == 0
+    assert "src/unused_ip/ddr3.v" in gprj_files(project)
+
+def test_unknown_top_module_keeps_every_source(make_env, project, gowin_home, capsys):
+    add_sources(project)
+    env = make_env({"build.fpga_cache": "0", "build.fpga_prune_sources": "1",
+                    "build.fpga_top_module": "ip_core_top"})
+    assert load_builder(env)["build_fpga_action"]([], [], env) == 0
+    assert "Top module 'ip_core_top' not found in fpga/src, using all sources" in capsys.readouterr().out
+    assert "src/unused_ip/ddr3.v" in gprj_files(project)
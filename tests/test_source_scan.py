@@ -0,0 +1,75 @@
+"""Tests for the indexed FPGA source scan."""
+
+import os
+import json
+import time
+
+import pytest
+
+from conftest import load_builder
+
+def age(*paths):
+    """Backdate directory mtimes so their listings are trusted."""
+    old = time.time() - 60
+    for path in paths:
+        os.utime(path, (old, old))
+
+@pytest.fixture
+def scanner(make_env, project):
+    """Builder globals with list_source_directory counting the directories it lists."""
+    builder = load_builder(make_env())
+    listed = []
+    list_directory = builder["list_source_directory"]
+    def counting(dirpath, *args):
+        listed.append(os.path.relpath(dirpath, project / "fpga"))
+        return list_directory(dirpath, *args)
+    builder["list_source_directory"] = counting
+    builder["listed"] = listed
+    return builder
+
+def scan(builder, project):
+    sources = builder["scan_fpga_sources"](project / "fpga")
+    return {category: sorted(p.relative_to(project / "fpga").as_posix() for p in files)
+            for category, files in sources.items()}
+
+def test_scan_classifies_files(scanner, project):
+    (project / "fpga/src/ip").mkdir()
+    (project / "fpga/src/ip/fifo.sv").write_text("module fifo; endmodule\n")
+    (project / "fpga/src/notes.txt").write_text("not a source\n")
+    assert scan(scanner, project) == {
+        "verilog": ["src/blinky.v", "src/ip/fifo.sv"],
+        "vhdl": ["src/counter.vhd"],
+        "constraints": ["constraints/pins.cst"],
+    }
+    index = json.loads((project / "fpga/impl/source_index.json").read_text())
+    assert index["dirs"]["src"]["files"]["blinky.v"] == "verilog"
+
+def test_unchanged_tree_is_not_listed_again(scanner, make_env, project):
+    age(project / "fpga/src", project / "fpga/constraints")
+    first = scan(scanner, project)
+    assert sorted(scanner["listed"]) == ["constraints", "src"]
+
+    # Neither in this process nor from the index file in a new one
+    scanner["listed"].clear()
+    assert scan(scanner, project) == first
+    fresh = load_builder(make_env())
+    fresh["list_source_directory"] = scanner["list_source_directory"]
+    assert scan(fresh, project) == first
+    assert scanner["listed"] == []
+
+def test_added_and_removed_files_are_picked_up(scanner, project):
+    age(project / "fpga/src", project / "fpga/constraints")
+    scan(scanner, project)
+    (project / "fpga/src/uart.v").write_text("module uart; endmodule\n")
+    (project / "fpga/src/counter.vhd").unlink()
+    sources = scan(scanner, project)
+    assert sources["verilog"] == ["src/blinky.v", "src/uart.v"]
+    assert sources["vhdl"] == []
+    assert scanner["listed"][-1:] == ["src"]
+
+def test_symlinked_directories_are_not_followed(scanner, project):
+    # A link back up the tree must not make the walk recurse forever
+    os.symlink(project / "fpga", project / "fpga/src/loop", target_is_directory=True)
+    os.symlink(project / "fpga/src/blinky.v", project / "fpga/src/alias.v")
+    sources = scan(scanner, project)
+    assert sources["verilog"] == ["src/alias.v", "src/blinky.v"]
@@ -0,0 +1,37 @@
+"""Tests for the separately cached synthesis and place & route stages."""
+
+from conftest import load_builder
+
+STAGED = {"build.fpga_cache": "0", "build.fpga_staged_build": "1"}
+
+def build(env):
+    builder = load_builder(env)
+    assert builder["build_fpga_action"]([], [], env) == 0
+
+def test_first_build_runs_both_stages(make_env, gowin_home, gw_sh_calls):
+    build(make_env(STAGED))
+    assert gw_sh_calls() == ["syn", "pnr"]
+
+def test_constraint_change_reuses_synthesis(make_env, project, gowin_home, gw_sh_calls):
+    env = make_env(STAGED)
+    build(env)
+    with open(project / "fpga/constraints/pins.cst", "a") as f:
+        f.write('\nIO_PORT "led" DRIVE=8;\n')
+    build(env)
+    assert gw_sh_calls() == ["syn", "pnr", "pnr"]
+
+def test_unchanged_netlist_reuses_place_and_route(make_env, project, gowin_home, gw_sh_calls):
+    env = make_env(STAGED)
+    build(env)
+    # A comment changes the synthesis inputs but not the (stand-in) netlist
+    with open(project / "fpga/src/blinky.v", "a") as f:
+        f.write("\n// comment\n")
+    build(env)
+    assert gw_sh_calls() == ["syn", "pnr", "syn"]
+    assert (project / "fpga/impl/pnr/project.bin").exists()
+
+def test_unchanged_project_runs_nothing(make_env, gowin_home, gw_sh_calls):
+    env = make_env(STAGED)
+    build(env)
+    build(env)
+    assert gw_sh_calls() == ["syn", "pnr"]
@@ -0,0 +1,65 @@
+"""Tests for the HDL syntax pre-check."""
+
+import json
+
+import pytest
+
+from conftest import install_tool, load_builder, read_calls
+
+PACKAGE = """\
+package widths is
+  constant WIDTH : integer := 8;
+end package;
+"""
+
+USER = """\
+use work.widths.all;
+entity user is
+end entity;
+"""
+
+def build(make_env, mode):
+    env = make_env({"build.fpga_cache": "0", "build.fpga_syntax_check": mode})
+    return load_builder(env)["build_fpga_action"]([], [], env)
+
+@pytest.mark.parametrize("mode", ["0", "no", " False ", ""])
+def test_check_can_be_disabled(make_env, project, gowin_home, gw_sh_calls, capsys, mode):
+    with open(project / "fpga/src/blinky.v", "a") as f:
+        f.write("\nmodule broken;\n  begin\nendmodule\n")
+    assert build(make_env, mode) == 0
+    assert gw_sh_calls() == ["all"]
+    assert "Syntax check" not in capsys.readouterr().out
+    assert not (project / "fpga/impl/hdl_check.json").exists()
+
+def test_errors_stop_the_build(make_env, project, gowin_home, gw_sh_calls, capsys):
+    with open(project / "fpga/src/blinky.v", "a") as f:
+        f.write("\nmodule broken;\n  begin\nendmodule\n")
+    assert build(make_env, "builtin") != 0
+    assert gw_sh_calls() == []
+    out = capsys.readouterr().out
+    assert "Error: fpga/src/blinky.v:" in out
+    assert "'endmodule' does not match 'begin'" in out
+    assert "Syntax check found 1 error(s)" in out
+
+@pytest.fixture
+def ghdl(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    install_tool(bin_dir, "ghdl", "fake_ghdl.py")
+    monkeypatch.setenv("PATH", str(bin_dir))
+    monkeypatch.setenv("FAKE_GHDL_LOG", str(tmp_path / "ghdl_calls.log"))
+    return lambda: [json.loads(call) for call in read_calls(tmp_path / "ghdl_calls.log")]
+
+def test_ghdl_analyzes_the_packages_a_file_uses(make_env, project, gowin_home, ghdl, capsys):
+    (project / "fpga/src/widths.vhd").write_text(PACKAGE)
+    (project / "fpga/src/user.vhd").write_text(USER)
+    assert build(make_env, "ghdl") == 0
+    assert "Syntax check passed" in capsys.readouterr().out
+    assert ["widths.vhd", "user.vhd"] in ghdl()
+
+def test_ghdl_errors_are_reported_for_their_file(make_env, project, gowin_home, ghdl, capsys):
+    (project / "fpga/src/widths.vhd").write_text(PACKAGE)
+    (project / "fpga/src/user.vhd").write_text(USER.replace("end entity;", "!!\nend entity;"))
+    assert build(make_env, "ghdl") != 0
+    out = capsys.readouterr().out
+    assert "Error: fpga/src/user.vhd:3: unexpected token '!'" in out
+    assert "widths.vhd" not in out
@@ -0,0 +1,83 @@
+"""Tests for Gowin toolchain discovery and its cache."""
+
+import os
+
+import pytest
+
+from conftest import load_builder, install_tool
+
+@pytest.fixture
+def gowin_root(tmp_path, monkeypatch):
+    """An install location holding 1.9.9 (GW1N) and 1.9.11 (GW1N, GW2A)."""
+    monkeypatch.delenv("GOWIN_HOME", raising=False)
+    root = tmp_path / "gowin"
+    for version, families in (("1.9.9.03", ["GW1N"]), ("1.9.11.03", ["GW1N", "gw2a"])):
+        home = root / f"Gowin_V{version}_Education_x64"
+        install_tool(home / "IDE" / "bin", "gw_sh", "fake_gw_sh.py")
+        for family in families:
+            (home / "IDE" / "share" / "device" / family).mkdir(parents=True)
+    return root
+
+@pytest.fixture
+def load_toolchains(make_env, gowin_root):
+    """Load the builder with discovery limited to gowin_root; returns (namespace, env)."""
+    def load(options=None):
+        env = make_env(options)
+        builder = load_builder(env)
+        builder["TOOLCHAIN_ROOTS"] = [gowin_root]
+        return builder, env
+    return load
+
+def test_newest_version_is_selected(load_toolchains):
+    builder, env = load_toolchains()
+    installs = builder["discover_gowin_toolchains"](env)
+    # 1.9.11 is newer than 1.9.9 even though it sorts before it as text
+    assert [install["version"] for install in installs] == ["1.9.11.03", "1.9.9.03"]
+    assert installs[0]["families"] == ["GW1N", "GW2A"]
+    assert builder["resolve_gowin_toolchain"](env)["version"] == "1.9.11.03"
+
+def test_version_policy(load_toolchains, capsys):
+    builder, env = load_toolchains({"build.gowin_version": "1.9.9"})
+    assert builder["resolve_gowin_toolchain"](env)["version"] == "1.9.9.03"
+
+    builder, env = load_toolchains({"build.gowin_version": "1.9.1"})
+    assert builder["resolve_gowin_toolchain"](env) is None
+    assert "Warning: No installed Gowin toolchain matches version 1.9.1" in capsys.readouterr().out
+
+def test_cache_is_reused_until_gw_sh_changes(load_toolchains, gowin_root):
+    builder, env = load_toolchains()
+    builder["discover_gowin_toolchains"](env)
+    assert builder["get_toolchain_cache_path"](env).exists()
+
+    builder, env = load_toolchains()
+    detected = []
+    detect = builder["detect_toolchain_version"]
+    builder["detect_toolchain_version"] = lambda home, gw_sh: detected.append(home) or detect(home, gw_sh)
+    builder["discover_gowin_toolchains"](env)
+    assert detected == []
+
+    # An upgrade in place rewrites gw_sh
+    gw_sh = gowin_root / "Gowin_V1.9.9.03_Education_x64" / "IDE" / "bin" / "gw_sh"
+    stat = gw_sh.stat()
+    os.utime(gw_sh, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    builder["discover_gowin_toolchains"](env)
+    assert [os.path.basename(home) for home in detected] == ["Gowin_V1.9.9.03_Education_x64"]
+
+def test_removed_installation_is_dropped(load_toolchains, gowin_root):
+    builder, env = load_toolchains()
+    assert len(builder["discover_gowin_toolchains"](env)) == 2
+    (gowin_root / "Gowin_V1.9.11.03_Education_x64" / "IDE" / "bin" / "gw_sh").unlink()
+
+    builder, env = load_toolchains()
+    installs = builder["discover_gowin_toolchains"](env)
+    assert [install["version"] for install in installs] == ["1.9.9.03"]
+
+def test_list_marks_the_selected_toolchain(load_toolchains, gowin_root, capsys):
+    builder, env = load_toolchains({"build.gowin_version": "1.9.9"})
+    assert builder["list_toolchains_action"]([], [], env) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0] == "Installed Gowin toolchains (* = used by this environment):"
+    assert lines[1].startswith("    1.9.11.03")
+    assert lines[1].endswith("(GW1N, GW2A)")
+    assert lines[2].startswith("  * 1.9.9.03")
+    assert str(gowin_root / "Gowin_V1.9.9.03_Education_x64") in lines[2]
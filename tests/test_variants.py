@@ -0,0 +1,58 @@
+"""Tests for multi-boot gateware variants packed into one flash image."""
+
+from conftest import load_builder
+
+VARIANTS = ("main address=0x100000\n"
+            "selftest address=0x200000 top_module=selftest\n"
+            "alt address=0x300000 use_sspi_as_gpio=1")
+
+def build(make_env, tmp_path, **options):
+    env = make_env(dict({"build.fpga_cache_dir": str(tmp_path / "cache"),
+                         "build.fpga_prune_sources": "1",
+                         "build.fpga_variants": VARIANTS}, **options))
+    builder = load_builder(env, ("fpga_builder.py", "hdl_analysis.py", "hdl_check.py",
+                                 "apicula_backend.py", "flash_image.py"))
+    return builder["build_fpga_action"]([], [], env)
+
+def variant_dir(project, name):
+    return project / "fpga/impl/variants" / name
+
+def test_variants_are_packed_at_their_addresses(make_env, project, gowin_home, gw_sh_calls, tmp_path):
+    (project / "fpga/src/selftest.v").write_text("module selftest(input clk); endmodule\n")
+    assert build(make_env, tmp_path) == 0
+    assert len(gw_sh_calls()) == 3
+
+    image = (project / ".pio/build/fpga/fpga_bitstream.bin").read_bytes()
+    for name, address in (("main", 0x100000), ("selftest", 0x200000), ("alt", 0x300000)):
+        bitstream = (variant_dir(project, name) / "impl/pnr/project.bin").read_bytes()
+        offset = address - 0x100000
+        assert image[offset:offset + len(bitstream)] == bitstream
+
+    tcl = (variant_dir(project, "selftest") / "impl/build_script.tcl").read_text()
+    assert "-top_module selftest" in tcl
+    tcl = (variant_dir(project, "alt") / "impl/build_script.tcl").read_text()
+    assert "-use_sspi_as_gpio 1" in tcl
+
+def test_only_changed_variant_is_rebuilt(make_env, project, gowin_home, gw_sh_calls, tmp_path):
+    (project / "fpga/src/selftest.v").write_text("module selftest(input clk); endmodule\n")
+    assert build(make_env, tmp_path) == 0
+    assert build(make_env, tmp_path) == 0
+    assert len(gw_sh_calls()) == 3
+
+    def bitstream_times():
+        return {name: (variant_dir(project, name) / "impl/pnr/project.bin").stat().st_mtime_ns
+                for name in ("main", "selftest", "alt")}
+    before = bitstream_times()
+
+    # selftest.v is only reachable from the selftest variant's top module
+    (project / "fpga/src/selftest.v").write_text("module selftest(input clk); wire x; endmodule\n")
+    assert build(make_env, tmp_path) == 0
+    assert len(gw_sh_calls()) == 4
+    after = bitstream_times()
+    assert [name for name in before if before[name] != after[name]] == ["selftest"]
+
+def test_invalid_variant_list_fails_the_build(make_env, gowin_home, gw_sh_calls, tmp_path):
+    assert build(make_env, tmp_path, **{
+        "build.fpga_variants": "main address=0x100000\nother address=0x100000"}) != 0
+    assert build(make_env, tmp_path, **{"build.fpga_variants": "main address=0x100800"}) != 0
+    assert gw_sh_calls() == []
@@ -0,0 +1,124 @@
+"""Tests for watch mode (pio run -t watch)."""
+
+import time
+import threading
+from types import SimpleNamespace
+
+from conftest import load_builder
+
+def wait_until(condition, timeout=30):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.05)
+
+def scripted_sleep(steps):
+    """A time.sleep stand-in running the next step on every call instead of waiting."""
+    steps = iter(steps)
+    return SimpleNamespace(sleep=lambda seconds: next(steps, lambda: None)())
+
+def load_watch(env):
+    load_builder(env)
+    return load_builder(env, ("fpga_watch.py",))
+
+def record_builds(env):
+    """Wrap the build action so the tests can see each build's exit code."""
+    results = []
+    build = env["FPGA_BUILD_ACTION"]
+    env["FPGA_BUILD_ACTION"] = lambda target, source, env: results.append(
+        build(target, source, env)) or results[-1]
+    return results
+
+def test_snapshot_ignores_hidden_files_and_backups(project, make_env):
+    watch = load_builder(make_env(), ("fpga_watch.py",))
+    fpga_dir = project / "fpga"
+    (fpga_dir / "src/.blinky.v.swp").write_text("x")
+    (fpga_dir / "src/blinky.v~").write_text("x")
+    (fpga_dir / "src/.git").mkdir()
+    (fpga_dir / "src/.git/HEAD").write_text("x")
+    (fpga_dir / "impl").mkdir(exist_ok=True)
+    (fpga_dir / "impl/project.bin").write_text("x")
+
+    snapshot = watch["snapshot_watched_files"](fpga_dir)
+    assert sorted(p.split("fpga/", 1)[1] for p in snapshot) == [
+        "constraints/pins.cst", "src/blinky.v", "src/counter.vhd"]
+
+def test_burst_of_saves_rebuilds_once(project, make_env, gowin_home, gw_sh_calls, capsys):
+    env = make_env({"build.fpga_cache": "0"})
+    watch = load_watch(env)
+    results = record_builds(env)
+    src = project / "fpga/src"
+
+    def save(name):
+        with open(src / name, "a") as f:
+            f.write("\n")
+
+    def initial_build_then_save():
+        wait_until(lambda: len(results) == 1)
+        save("blinky.v")
+
+    def stop_after_rebuild():
+        wait_until(lambda: len(results) == 2)
+        raise KeyboardInterrupt
+
+    watch["time"] = scripted_sleep([
+        initial_build_then_save,       # poll: blinky.v changed
+        lambda: save("counter.vhd"),   # debounce: still changing
+        lambda: None,                  # debounce: settled
+        stop_after_rebuild,            # poll
+    ])
+    assert watch["watch_fpga_action"]([], [], env) == 0
+    assert results == [0, 0]
+    assert gw_sh_calls() == ["all", "all"]
+    out = capsys.readouterr().out
+    assert "Changed: src/blinky.v, src/counter.vhd" in out
+    assert "Stopped watching" in out
+
+def test_change_during_build_cancels_it(make_env, capsys):
+    env = make_env()
+    watch = load_builder(env, ("fpga_watch.py",))
+    started, release = threading.Semaphore(0), threading.Event()
+    builds, cancels, uploads = [], [], []
+
+    def build(target, source, env):
+        builds.append(len(builds))
+        started.release()
+        release.wait(30)
+        return 1 if cancels and len(builds) == 1 else 0
+
+    env.update(FPGA_BUILD_ACTION=build, FPGA_CANCEL_BUILDS=lambda: cancels.append(1))
+    env.File = lambda path: path
+    builder = watch["WatchBuilder"](env, [lambda target, source, env: uploads.append(source)])
+    builder.request()
+    assert started.acquire(timeout=30)
+    builder.request()
+    assert cancels == [1]
+    release.set()
+    assert started.acquire(timeout=30)
+    builder.thread.join(30)
+    assert builds == [0, 1]
+    # Only the build with the latest sources is uploaded
+    assert len(uploads) == 1
+    assert "Cancelling obsolete FPGA build..." in capsys.readouterr().out
+
+def test_failed_build_is_not_uploaded(make_env, capsys):
+    env = make_env()
+    watch = load_builder(env, ("fpga_watch.py",))
+    uploads = []
+    env.update(FPGA_BUILD_ACTION=lambda target, source, env: 1, FPGA_CANCEL_BUILDS=lambda: None)
+    builder = watch["WatchBuilder"](env, [lambda target, source, env: uploads.append(source)])
+    builder.request()
+    builder.thread.join(30)
+    assert uploads == []
+    assert "Watching for changes..." in capsys.readouterr().out
+
+def test_upload_without_protocol_warns(make_env, capsys):
+    env = make_env({"build.fpga_watch_upload": "1"})
+    watch = load_builder(env, ("fpga_watch.py",))
+    env.update(FPGA_BUILD_ACTION=lambda target, source, env: 0, FPGA_CANCEL_BUILDS=lambda: None)
+
+    def stop():
+        raise KeyboardInterrupt
+    watch["time"] = scripted_sleep([stop])
+    assert watch["watch_fpga_action"]([], [], env) == 0
+    assert "Warning: No upload_protocol configured, watch mode will not upload" in capsys.readouterr().out
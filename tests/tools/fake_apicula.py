@@ -0,0 +1,50 @@
+"""
+Stand-in for yosys, nextpnr-himbaechel and gowin_pack, used by the tests.
+
+Installed under each tool's name, it acts as the tool it is called as:
+it answers the version flags and writes the files the next step and the
+builder read. The arguments of each call are appended, as a JSON list
+starting with the tool name, to FAKE_APICULA_LOG. FAKE_APICULA_FAIL
+names a tool that fails.
+"""
+
+import os
+import re
+import sys
+import json
+from pathlib import Path
+
+# Bit rows of the .fs bitstream gowin_pack writes
+FS_ROWS = ["// fake bitstream", "10100101" * 4, "11110000" * 4]
+
+NEXTPNR_REPORT = {
+    "utilization": {"LUT4": {"used": 120, "available": 20736}},
+    "fmax": {"clk": {"achieved": 150.0, "constraint": 27.0}},
+}
+
+def option(args, name):
+    return args[args.index(name) + 1]
+
+def main(tool, args):
+    if args in (["-V"], ["--version"]):
+        print(f"{tool} 0.0 (stand-in)")
+        return 0
+    with open(os.environ["FAKE_APICULA_LOG"], "a", encoding="utf-8") as f:
+        f.write(json.dumps([tool] + args) + "\n")
+    if os.environ.get("FAKE_APICULA_FAIL") == tool:
+        print(f"ERROR: {tool} failed")
+        return 1
+
+    if tool == "yosys":
+        script = Path(option(args, "-s")).read_text(encoding="utf-8")
+        netlist = re.search(r'-json "([^"]+)"', script).group(1)
+        Path(netlist).write_text(json.dumps({"modules": {}}), encoding="utf-8")
+    elif tool == "nextpnr-himbaechel":
+        Path(option(args, "--write")).write_text(json.dumps({"modules": {}}), encoding="utf-8")
+        Path(option(args, "--report")).write_text(json.dumps(NEXTPNR_REPORT), encoding="utf-8")
+    elif tool == "gowin_pack":
+        Path(option(args, "-o")).write_text("\n".join(FS_ROWS) + "\n", encoding="utf-8")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(Path(sys.argv[0]).name, sys.argv[1:]))
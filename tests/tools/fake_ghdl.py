@@ -0,0 +1,43 @@
+"""
+Stand-in for `ghdl -a`, used by the tests.
+
+Analyzes the files in order like ghdl: a `use work.<unit>` or
+`entity work.<unit>` naming a unit no earlier file on the command line
+defines is an error, and so is a line containing "!!". It stops at the
+first file with errors. The file names of each call are appended, as a
+JSON list, to FAKE_GHDL_LOG.
+"""
+
+import os
+import re
+import sys
+import json
+from pathlib import Path
+
+def main(args):
+    if args == ["--version"]:
+        print("GHDL 0.0 (stand-in)")
+        return 0
+    files = [arg for arg in args if not arg.startswith("-")]
+    log_path = os.environ.get("FAKE_GHDL_LOG")
+    if log_path:
+        with open(log_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps([Path(path).name for path in files]) + "\n")
+    library = set()
+    for path in files:
+        text = Path(path).read_text(encoding="utf-8").lower()
+        errors = []
+        for number, line in enumerate(text.splitlines(), 1):
+            for unit in re.findall(r"\b(?:use|entity)\s+work\.(\w+)", line):
+                if unit not in library:
+                    errors.append(f'{path}:{number}:5: unit "{unit}" not found in library "work"')
+            if "!!" in line:
+                errors.append(f"{path}:{number}:1: unexpected token '!'")
+        if errors:
+            print("\n".join(errors))
+            return 1
+        library.update(re.findall(r"\b(?:entity|package)\s+(\w+)\s+is\b", text))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,134 @@
+"""
+Stand-in for Gowin's gw_sh, used by the tests.
+
+Runs the Tcl scripts the builder generates without synthesizing
+anything: it writes the outputs the builder reads (reports, a pnr/*.bin
+bitstream derived from the script and a netlist that, like one keeping
+the hierarchy, defines every Verilog module of the project) and appends the stages
+of each run to FAKE_GW_SH_LOG. Started without arguments it reads
+commands from stdin like the interactive console the persistent worker
+drives. FAKE_GW_SH_FAIL=1 makes every run fail with a synthesis error;
+any other value only fails the scripts that contain it.
+FAKE_GW_SH_NO_OUTPUT=1 makes runs succeed without writing anything, like
+a stage that fails without raising a Tcl error. FAKE_GW_SH_LINGER makes
+each run take that many seconds more to exit (after its error, if it
+fails). FAKE_GW_SH_PADDING appends that many erased-flash (0xFF) bytes to
+the bitstream.
+"""
+
+import os
+import re
+import sys
+import time
+import hashlib
+import subprocess
+from pathlib import Path
+
+# Size of the generated bitstream
+BITSTREAM_SIZE = 64 * 1024
+
+UTILIZATION_REPORT = """\
+Resource Usage Summary:
+  Logic                       | 120/20736  | 1%
+  Register                    | 64/15915   | 1%
+  BSRAM                       | 0/46       | 0%
+"""
+
+TIMING_REPORT = ("<table><tr><td>1</td><td>clk</td><td>27.000(MHz)</td>"
+                 "<td>{fmax:.3f}(MHz)</td><td>4</td></tr></table>")
+
+def log_call(line):
+    log_path = os.environ.get("FAKE_GW_SH_LOG")
+    if log_path:
+        with open(log_path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+def read_project_modules(gprj_path):
+    """Names of the modules the Verilog files of a project define."""
+    gprj = Path(gprj_path)
+    text = gprj.read_text(encoding="utf-8") if gprj.exists() else ""
+    modules = []
+    for path in re.findall(r'<File path="([^"]+)" type="file.verilog"', text):
+        source = gprj.parent / path
+        if source.exists():
+            modules += re.findall(r"^\s*module\s+(\w+)", source.read_text(encoding="utf-8"), re.M)
+    return modules
+
+def linger():
+    time.sleep(float(os.environ.get("FAKE_GW_SH_LINGER", "0")))
+
+def run_script(script):
+    tcl = Path(script).read_text(encoding="utf-8")
+    project = re.search(r"^open_project\s+(\S+)", tcl, re.M)
+    name = Path(project.group(1)).stem if project else "project"
+    top = re.search(r"-top_module\s+(\S+)", tcl)
+    top = top.group(1) if top else "top"
+    runs = re.findall(r"^run\s+(\w+)", tcl, re.M) or ["all"]
+    log_call(" ".join(runs))
+    print("GowinSynthesis start", flush=True)
+    fail = os.environ.get("FAKE_GW_SH_FAIL")
+    if fail and (fail == "1" or fail in tcl):
+        print("ERROR (EX3863) : Syntax error near 'endmodule'", flush=True)
+        linger()
+        return 1
+
+    if os.environ.get("FAKE_GW_SH_NO_OUTPUT"):
+        print("All done", flush=True)
+        return 0
+    seed = hashlib.sha256(tcl.encode("utf-8")).digest()
+    if "syn" in runs or "all" in runs:
+        Path("gwsynthesis").mkdir(exist_ok=True)
+        modules = [top] + [m for m in dict.fromkeys(read_project_modules(project.group(1)))
+                           if m != top] if project else [top]
+        Path(f"gwsynthesis/{name}.vg").write_text(
+            "".join(f"module {module};\nendmodule\n" for module in modules), encoding="utf-8")
+        Path(f"gwsynthesis/{name}_syn.rpt.html").write_text("<html>synthesis report</html>",
+                                                            encoding="utf-8")
+        print("Running synthesis ... done", flush=True)
+    if "pnr" in runs or "all" in runs:
+        print("Running placement ...", flush=True)
+        print("Running routing ...", flush=True)
+        Path("pnr").mkdir(exist_ok=True)
+        padding = b"\xff" * int(os.environ.get("FAKE_GW_SH_PADDING", "0"))
+        Path(f"pnr/{name}.bin").write_bytes(
+            (seed * (BITSTREAM_SIZE // len(seed) + 1))[:BITSTREAM_SIZE] + padding)
+        Path(f"pnr/{name}.rpt.txt").write_text(UTILIZATION_REPORT, encoding="utf-8")
+        Path(f"pnr/{name}.tr.html").write_text(TIMING_REPORT.format(fmax=120 + seed[0] / 10),
+                                               encoding="utf-8")
+        Path(f"pnr/{name}.timing_paths").write_text(f"Slack : {seed[1] / 100:.3f}\n",
+                                                    encoding="utf-8")
+        print("Generate file ... bitstream", flush=True)
+    linger()
+    print("All done", flush=True)
+    return 0
+
+def run_console():
+    """Interactive mode for the commands gw_sh_worker.py sends.
+
+    Understands cd, puts and an if/else around a caught source, which is
+    all the worker uses.
+    """
+    log_call("console")
+    failed = False
+    branch = None
+    for line in sys.stdin:
+        line = line.strip()
+        match = re.match(r"cd \{(.*)\}$", line)
+        if match:
+            os.chdir(match.group(1))
+        elif re.search(r"source \{(.*?)\}", line):
+            script = re.search(r"source \{(.*?)\}", line).group(1)
+            failed = subprocess.call([sys.executable, __file__, script]) != 0
+            branch = "failed"
+        elif line.startswith("} else {"):
+            branch = "passed"
+        elif line == "}":
+            branch = None
+        elif line.startswith('puts "'):
+            text = line[len('puts "'):-1].replace("$pio_error", "script failed")
+            if branch is None or (branch == "failed") == failed:
+                print(text, flush=True)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(run_script(sys.argv[-1]) if len(sys.argv) > 1 else run_console())
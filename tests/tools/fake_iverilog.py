@@ -0,0 +1,56 @@
+"""
+Stand-in for Icarus Verilog's iverilog and vvp, used by the tests.
+
+Installed as iverilog it "compiles" a model: the -o file lists the
+source files, and the top module is appended to FAKE_IVERILOG_LOG. A
+source line containing "!!" is a syntax error. Installed as vvp it runs
+the model by printing the text of each $display in the sources, and
+stops with an error at $fatal. A "// hang" comment makes it run forever.
+"""
+
+import os
+import re
+import sys
+import time
+import json
+from pathlib import Path
+
+def compile_model(args):
+    top, output, files = None, "a.out", []
+    args = iter(args)
+    for arg in args:
+        if arg == "-s":
+            top = next(args)
+        elif arg == "-o":
+            output = next(args)
+        elif not arg.startswith("-"):
+            files.append(arg)
+    log_path = os.environ.get("FAKE_IVERILOG_LOG")
+    if log_path:
+        with open(log_path, "a", encoding="utf-8") as f:
+            f.write(f"{top}\n")
+    for path in files:
+        for number, line in enumerate(Path(path).read_text(encoding="utf-8").splitlines(), 1):
+            if "!!" in line:
+                print(f"{path}:{number}: syntax error")
+                return 1
+    Path(output).write_text(json.dumps(files), encoding="utf-8")
+    return 0
+
+def run_model(args):
+    files = json.loads(Path(args[-1]).read_text(encoding="utf-8"))
+    text = "\n".join(Path(path).read_text(encoding="utf-8") for path in files)
+    if "// hang" in text:
+        while True:
+            time.sleep(1)
+    for task, message in re.findall(r'\$(display|fatal)\s*\(\s*(?:\d+\s*,\s*)?"([^"]*)"', text):
+        if task == "fatal":
+            print(f"FATAL: {message}")
+            return 1
+        print(message)
+    return 0
+
+if __name__ == "__main__":
+    if Path(sys.argv[0]).name == "vvp":
+        sys.exit(run_model(sys.argv[1:]))
+    sys.exit(compile_model(sys.argv[1:]))
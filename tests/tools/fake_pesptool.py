@@ -0,0 +1,64 @@
+"""
+Stand-in for pesptool, used by the tests.
+
+Keeps the board's flash in the file FAKE_PESPTOOL_FLASH, where "{port}"
+stands for the name of the --port device, and appends the arguments of
+each call, as a JSON list, to FAKE_PESPTOOL_LOG. Supports write-flash
+(address/file pairs) and verify-flash, which fails when the flash differs
+from the file. FAKE_PESPTOOL_FAIL lists ports, separated by commas, whose
+calls fail; "port:N" only fails the first N calls to that port.
+"""
+
+import os
+import sys
+import json
+from pathlib import Path
+
+def should_fail(port, log_path):
+    for entry in os.environ.get("FAKE_PESPTOOL_FAIL", "").split(","):
+        name, _, count = entry.partition(":")
+        if name and name == port:
+            if not count:
+                return True
+            calls = [json.loads(line) for line in Path(log_path).read_text().splitlines()]
+            return sum(port in call for call in calls) <= int(count)
+    return False
+
+def main(args):
+    log_path = os.environ["FAKE_PESPTOOL_LOG"]
+    with open(log_path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(args) + "\n")
+    port = args[args.index("--port") + 1] if "--port" in args else ""
+    if should_fail(port, log_path):
+        print(f"A fatal error occurred: Could not open {port}")
+        return 2
+    flash_path = Path(os.environ["FAKE_PESPTOOL_FLASH"].replace("{port}", os.path.basename(port)))
+    flash = bytearray(flash_path.read_bytes() if flash_path.exists() else b"")
+
+    # Drop the port and write-flash options, keeping the command and its operands
+    words = []
+    args = iter(args)
+    for arg in args:
+        if arg == "--port":
+            next(args)
+        elif not arg.startswith("--"):
+            words.append(arg)
+    command, operands = words[0], words[1:]
+    pairs = [(int(operands[i], 0), Path(operands[i + 1]).read_bytes())
+             for i in range(0, len(operands), 2)]
+
+    if command == "verify-flash":
+        address, data = pairs[0]
+        return 0 if flash[address:address + len(data)] == data else 1
+    if command == "write-flash":
+        for address, data in pairs:
+            if len(flash) < address + len(data):
+                flash.extend(b"\xff" * (address + len(data) - len(flash)))
+            flash[address:address + len(data)] = data
+        flash_path.write_bytes(bytes(flash))
+        return 0
+    print(f"fake pesptool: unsupported command {command}")
+    return 2
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,34 @@
+"""
+Stand-in for `python -m platformio run -d <project> -e <env>`, used by the tests.
+
+Writes a firmware.bin for the environment and appends the environment
+name to FAKE_PIO_LOG. FAKE_PIO_FAIL makes the build fail and
+FAKE_PIO_DELAY makes it take that many seconds.
+"""
+
+import os
+import sys
+import time
+import argparse
+from pathlib import Path
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command")
+    parser.add_argument("-d", dest="project_dir", default=".")
+    parser.add_argument("-e", dest="environment", required=True)
+    args = parser.parse_args()
+    with open(os.environ["FAKE_PIO_LOG"], "a", encoding="utf-8") as f:
+        f.write(args.environment + "\n")
+    print(f"Processing {args.environment}", flush=True)
+    time.sleep(float(os.environ.get("FAKE_PIO_DELAY", "0")))
+    if os.environ.get("FAKE_PIO_FAIL"):
+        print("src/main.cpp:1:1: error: expected ';'")
+        return 1
+    build_dir = Path(args.project_dir) / ".pio" / "build" / args.environment
+    build_dir.mkdir(parents=True, exist_ok=True)
+    (build_dir / "firmware.bin").write_bytes(b"\xe9" + b"\x01" * 8191)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())